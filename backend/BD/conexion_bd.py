@@ -0,0 +1,344 @@
+"""
+Conexiones a la base de datos EPP
+Un único hilo escritor con conexión persistente (WAL + group commit)
+y un pool pequeño de conexiones de solo lectura.
+
+Las funciones de operaciones_bd.py se declaran con los decoradores
+@operacion_escritura / @operacion_lectura y reciben la conexión como
+primer argumento. Desde código síncrono se llaman normal; desde un
+endpoint async se usa `await funcion.asincrono(...)`.
+"""
+import asyncio
+import functools
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Callable, NamedTuple
+
+from backend.metricas import metricas
+
+# Ruta de la BD
+DB_PATH = os.path.join(os.path.dirname(__file__), "epp_registros.db")
+
+# PRAGMAs de la conexión escritora (WAL permite leer mientras se escribe)
+PRAGMAS_ESCRITOR = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",      # En WAL es seguro ante caídas del proceso
+    "PRAGMA cache_size=-20000",       # ~20 MB de caché de páginas
+    "PRAGMA mmap_size=268435456",     # 256 MB mapeados en memoria
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+]
+
+PRAGMAS_LECTOR = [
+    "PRAGMA cache_size=-8000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",
+]
+
+# Máximo de operaciones de escritura que se confirman en un mismo COMMIT
+MAX_OPERACIONES_POR_TX = 64
+
+# Conexiones de solo lectura disponibles a la vez
+TAMANO_POOL_LECTURA = 4
+
+DURACION_COMMIT = metricas.histograma(
+    "epp_bd_commit_segundos", "Duración del COMMIT de cada transacción agrupada")
+DURACION_TRANSACCION = metricas.histograma(
+    "epp_bd_transaccion_segundos", "Duración total de cada transacción agrupada (BEGIN a COMMIT)")
+OPERACIONES_POR_COMMIT = metricas.histograma(
+    "epp_bd_operaciones_por_commit", "Operaciones de escritura confirmadas en un mismo COMMIT",
+    limites=(1, 2, 4, 8, 16, 32, 64))
+
+
+class _Tarea(NamedTuple):
+    funcion: Callable
+    args: tuple
+    kwargs: dict
+    futuro: Future
+    transaccion: bool
+
+
+# ============================================================================
+# ESCRITOR
+# ============================================================================
+
+class EscritorBD:
+    """
+    Hilo dueño de la única conexión de escritura.
+
+    Las operaciones llegan por una cola; las que esperan juntas se ejecutan
+    en una sola transacción (cada una dentro de su SAVEPOINT, para que el
+    fallo de una no deshaga a las demás) y se confirman con un único COMMIT.
+    Los futuros se resuelven después del COMMIT.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._cola = queue.Queue()
+        self._conn = None
+        self._hilo = threading.Thread(target=self._bucle, name="escritor-bd", daemon=True)
+        self._listo = threading.Event()
+        self._error_inicio = None
+
+    def iniciar(self):
+        self._hilo.start()
+        self._listo.wait()
+        if self._error_inicio:
+            raise self._error_inicio
+
+    def enviar(self, funcion: Callable, *args, transaccion: bool = True, **kwargs) -> Future:
+        """Encola una operación `funcion(conn, *args, **kwargs)` y retorna su futuro"""
+        futuro = Future()
+        self._cola.put(_Tarea(funcion, args, kwargs, futuro, transaccion))
+        return futuro
+
+    def en_hilo_escritor(self) -> bool:
+        return threading.current_thread() is self._hilo
+
+    @property
+    def conexion(self) -> sqlite3.Connection:
+        """Conexión del escritor (solo usar desde el propio hilo escritor)"""
+        return self._conn
+
+    def detener(self):
+        self._cola.put(None)
+        self._hilo.join(timeout=5)
+
+    def _bucle(self):
+        try:
+            # isolation_level=None: las transacciones se manejan explícitamente
+            self._conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+            for pragma in PRAGMAS_ESCRITOR:
+                self._conn.execute(pragma)
+        except Exception as e:
+            self._error_inicio = e
+            self._listo.set()
+            return
+        self._listo.set()
+
+        pendiente = None
+        while True:
+            tarea = pendiente or self._cola.get()
+            pendiente = None
+            if tarea is None:
+                break
+
+            if not tarea.transaccion:
+                self._ejecutar_sin_transaccion(tarea)
+                continue
+
+            # Agrupar lo que ya esté esperando en la cola (group commit)
+            grupo = [tarea]
+            while len(grupo) < MAX_OPERACIONES_POR_TX:
+                try:
+                    siguiente = self._cola.get_nowait()
+                except queue.Empty:
+                    break
+                if siguiente is None or not siguiente.transaccion:
+                    pendiente = siguiente
+                    break
+                grupo.append(siguiente)
+
+            self._ejecutar_grupo(grupo)
+
+        self._conn.close()
+
+    def _ejecutar_grupo(self, grupo):
+        resultados = []
+        inicio = time.perf_counter()
+        try:
+            self._conn.execute("BEGIN IMMEDIATE")
+            for tarea in grupo:
+                if not tarea.futuro.set_running_or_notify_cancel():
+                    continue
+                self._conn.execute("SAVEPOINT operacion")
+                try:
+                    resultado = tarea.funcion(self._conn, *tarea.args, **tarea.kwargs)
+                    self._conn.execute("RELEASE operacion")
+                    resultados.append((tarea, resultado, None))
+                except Exception as e:
+                    self._conn.execute("ROLLBACK TO operacion")
+                    self._conn.execute("RELEASE operacion")
+                    resultados.append((tarea, None, e))
+            with DURACION_COMMIT.cronometrar():
+                self._conn.execute("COMMIT")
+        except Exception as e:
+            if self._conn.in_transaction:
+                self._conn.execute("ROLLBACK")
+            for tarea in grupo:
+                if not tarea.futuro.done():
+                    if tarea.futuro.running():
+                        tarea.futuro.set_exception(e)
+                    elif tarea.futuro.set_running_or_notify_cancel():
+                        tarea.futuro.set_exception(e)
+            return
+        DURACION_TRANSACCION.observar(time.perf_counter() - inicio)
+        OPERACIONES_POR_COMMIT.observar(len(grupo))
+
+        for tarea, resultado, error in resultados:
+            if error is not None:
+                tarea.futuro.set_exception(error)
+            else:
+                tarea.futuro.set_result(resultado)
+
+    def _ejecutar_sin_transaccion(self, tarea):
+        """Operaciones que manejan su propia transacción (ej. VACUUM)"""
+        if not tarea.futuro.set_running_or_notify_cancel():
+            return
+        try:
+            tarea.futuro.set_result(tarea.funcion(self._conn, *tarea.args, **tarea.kwargs))
+        except Exception as e:
+            if self._conn.in_transaction:
+                self._conn.execute("ROLLBACK")
+            tarea.futuro.set_exception(e)
+
+
+# ============================================================================
+# POOL DE LECTURA
+# ============================================================================
+
+class PoolLectura:
+    """Pool de conexiones de solo lectura (WAL permite leer en paralelo al escritor)"""
+
+    def __init__(self, db_path: str, tamano: int):
+        self.db_path = db_path
+        self._disponibles = queue.Queue()
+        self._semaforo = threading.BoundedSemaphore(tamano)
+
+    def _nueva_conexion(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS_LECTOR:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def conexion(self):
+        self._semaforo.acquire()
+        try:
+            try:
+                conn = self._disponibles.get_nowait()
+            except queue.Empty:
+                conn = self._nueva_conexion()
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                self._disponibles.put(conn)
+        finally:
+            self._semaforo.release()
+
+    def cerrar(self):
+        while True:
+            try:
+                self._disponibles.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+# ============================================================================
+# INSTANCIAS COMPARTIDAS
+# ============================================================================
+
+_escritor = None
+_pool = None
+_lock_inicio = threading.Lock()
+
+
+def obtener_escritor() -> EscritorBD:
+    """Retorna el escritor del proceso (lo inicia la primera vez)"""
+    global _escritor
+    if _escritor is None:
+        with _lock_inicio:
+            if _escritor is None:
+                escritor = EscritorBD(DB_PATH)
+                escritor.iniciar()
+                _escritor = escritor
+    return _escritor
+
+
+def obtener_pool() -> PoolLectura:
+    """Retorna el pool de lectura (el escritor se inicia antes para activar WAL)"""
+    global _pool
+    if _pool is None:
+        obtener_escritor()
+        with _lock_inicio:
+            if _pool is None:
+                _pool = PoolLectura(DB_PATH, TAMANO_POOL_LECTURA)
+    return _pool
+
+
+def cerrar_conexiones():
+    """Detiene el escritor y cierra las conexiones de lectura"""
+    global _escritor, _pool
+    with _lock_inicio:
+        if _escritor is not None:
+            _escritor.detener()
+            _escritor = None
+        if _pool is not None:
+            _pool.cerrar()
+            _pool = None
+
+
+# ============================================================================
+# DECORADORES
+# ============================================================================
+
+def operacion_escritura(funcion: Callable = None, *, transaccion: bool = True):
+    """
+    Declara una función `f(conn, ...)` como escritura de la BD.
+
+    - f(...)                  → bloquea hasta el COMMIT y retorna el resultado
+    - f.futuro(...)           → concurrent.futures.Future
+    - await f.asincrono(...)  → para endpoints async (no bloquea el event loop)
+
+    transaccion=False: la función se ejecuta sola, fuera del group commit,
+    y maneja su propia transacción (necesario para VACUUM).
+    """
+    def decorar(f):
+        def futuro(*args, **kwargs) -> Future:
+            return obtener_escritor().enviar(f, *args, transaccion=transaccion, **kwargs)
+
+        @functools.wraps(f)
+        def sincrono(*args, **kwargs):
+            escritor = obtener_escritor()
+            if escritor.en_hilo_escritor():
+                # Llamada anidada desde otra operación: ya estamos en su transacción
+                return f(escritor.conexion, *args, **kwargs)
+            return futuro(*args, **kwargs).result()
+
+        async def asincrono(*args, **kwargs):
+            return await asyncio.wrap_future(futuro(*args, **kwargs))
+
+        sincrono.futuro = futuro
+        sincrono.asincrono = asincrono
+        return sincrono
+
+    if funcion is not None:
+        return decorar(funcion)
+    return decorar
+
+
+def operacion_lectura(f: Callable):
+    """
+    Declara una función `f(conn, ...)` como lectura de la BD.
+
+    - f(...)                  → usa una conexión del pool de solo lectura
+    - await f.asincrono(...)  → igual, pero en un hilo aparte del event loop
+    """
+    @functools.wraps(f)
+    def sincrono(*args, **kwargs):
+        with obtener_pool().conexion() as conn:
+            return f(conn, *args, **kwargs)
+
+    async def asincrono(*args, **kwargs):
+        return await asyncio.to_thread(sincrono, *args, **kwargs)
+
+    sincrono.asincrono = asincrono
+    return sincrono
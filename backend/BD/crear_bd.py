@@ -5,9 +5,215 @@ Ejecutar: python 1_crear_bd.py
 import sqlite3
 import os
 
+from backend.BD.rollups import crear_tablas_rollup, reconstruir_rollups
+from backend.BD.tiempo import fecha_registro_a_epoch
+
 # Ruta de la base de datos
 DB_PATH = os.path.join(os.path.dirname(__file__), "epp_registros.db")
 
+# Versiones del registro de cambios que se conservan (más antiguas → el
+# dashboard que se quedó atrás recarga la lista completa)
+MAX_CAMBIOS_CONSERVADOS = 10000
+
+# Columnas agregadas después de la primera versión del esquema
+# (nombre, definición) → se agregan con ALTER TABLE si faltan
+COLUMNAS_MIGRACION = [
+    ("clave_idempotencia", "TEXT"),
+    ("estado_imagen", "TEXT DEFAULT 'ok'"),
+    ("camera_id", "TEXT"),
+    ("fecha_epoch", "INTEGER"),
+    ("repeticiones", "INTEGER DEFAULT 0"),
+    ("ultima_repeticion", "TEXT"),
+]
+
+
+def aplicar_migraciones(conn: sqlite3.Connection):
+    """
+    Lleva una BD existente al esquema actual. Es idempotente:
+    solo agrega las columnas e índices que falten.
+    """
+    activar_vacuum_incremental(conn)
+    
+    columnas = {fila[1] for fila in conn.execute("PRAGMA table_info(registros)")}
+    for nombre, definicion in COLUMNAS_MIGRACION:
+        if nombre not in columnas:
+            conn.execute(f"ALTER TABLE registros ADD COLUMN {nombre} {definicion}")
+    
+    # Reintentos del spool de main.py nunca deben duplicar filas
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_clave_idempotencia
+        ON registros(clave_idempotencia)
+    """)
+    
+    # Paginación por cursor (id) combinada con filtro de cámara
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_camara_id
+        ON registros(camera_id, id)
+    """)
+    # Reemplazado por idx_fecha_epoch (el texto ISO no ordena bien entre zonas horarias)
+    conn.execute("DROP INDEX IF EXISTS idx_fecha_id")
+    
+    # fecha_hora normalizada a epoch (rollups y rangos de fecha); como todo
+    # índice de SQLite incluye el rowid, equivale a (fecha_epoch, id)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_fecha_epoch
+        ON registros(fecha_epoch)
+    """)
+    
+    # Retención: registros que aún tienen imagen, del más antiguo al más nuevo,
+    # y registros con la imagen todavía en cola (índices parciales, pequeños)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_imagen_fecha
+        ON registros(fecha_epoch) WHERE ruta_imagen != ''
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_imagen_pendiente
+        ON registros(creado_en) WHERE estado_imagen = 'pendiente'
+    """)
+    
+    crear_registro_cambios(conn)
+    crear_tablas_rollup(conn)
+    crear_tabla_tracks(conn)
+    completar_fecha_epoch(conn)
+    conn.commit()
+
+
+def completar_fecha_epoch(conn: sqlite3.Connection, bloque: int = 5000):
+    """
+    Calcula fecha_epoch de los registros que no la tienen (BD anterior a la
+    columna) y reconstruye los rollups si hay registros sin resumir.
+    """
+    pendientes = conn.execute("SELECT COUNT(*) FROM registros WHERE fecha_epoch IS NULL").fetchone()[0]
+    sin_rollups = conn.execute("SELECT COUNT(*) FROM rollup_total").fetchone()[0] == 0 and \
+        conn.execute("SELECT 1 FROM registros LIMIT 1").fetchone() is not None
+    if not pendientes and not sin_rollups:
+        return
+    
+    ultimo_id = 0
+    while pendientes:
+        filas = conn.execute("""
+            SELECT id, fecha_hora FROM registros
+            WHERE fecha_epoch IS NULL AND id > ?
+            ORDER BY id LIMIT ?
+        """, (ultimo_id, bloque)).fetchall()
+        if not filas:
+            break
+        conn.executemany("UPDATE registros SET fecha_epoch = ? WHERE id = ?",
+                         [(fecha_registro_a_epoch(fecha_hora), registro_id) for registro_id, fecha_hora in filas])
+        ultimo_id = filas[-1][0]
+    
+    reconstruir_rollups(conn.cursor())
+    
+    # Las actualizaciones de la migración no son cambios para el dashboard:
+    # se reemplazan por una marca de reinicio (recarga completa)
+    conn.execute("DELETE FROM registros_cambios")
+    conn.execute("INSERT INTO registros_cambios (registro_id, tipo) VALUES (NULL, 'reset')")
+
+
+def crear_registro_cambios(conn: sqlite3.Connection):
+    """
+    Tabla registros_cambios: cada alta, modificación o baja de un registro
+    deja una fila con una versión creciente. GET /api/registros?since_id=N
+    la usa para responder solo lo que cambió y la versión máxima sirve de ETag.
+    
+    La mantienen triggers, así que ningún camino de escritura se la salta.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS registros_cambios (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            registro_id INTEGER,
+            tipo TEXT NOT NULL  -- insert, update, delete, reset
+        )
+    """)
+    for evento, tipo, fila in (("INSERT", "insert", "NEW"),
+                               ("UPDATE", "update", "NEW"),
+                               ("DELETE", "delete", "OLD")):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_registros_{tipo}
+            AFTER {evento} ON registros
+            BEGIN
+                INSERT INTO registros_cambios (registro_id, tipo) VALUES ({fila}.id, '{tipo}');
+            END
+        """)
+    # Compactación: cada 1000 versiones se descartan las más antiguas
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_compactar_cambios
+        AFTER INSERT ON registros_cambios
+        WHEN NEW.version % 1000 = 0
+        BEGIN
+            DELETE FROM registros_cambios WHERE version <= NEW.version - {MAX_CAMBIOS_CONSERVADOS};
+        END
+    """)
+
+
+def crear_tabla_tracks(conn: sqlite3.Connection):
+    """
+    Tabla tracks_persona: una fila por persona seguida por main.py (desde
+    que entra hasta que sale de la imagen) con el EPP acumulado en ese tiempo.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tracks_persona (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            clave_idempotencia TEXT NOT NULL UNIQUE,  -- cámara:track:entrada
+            camera_id TEXT,
+            track_id INTEGER,
+            entrada TEXT NOT NULL,
+            salida TEXT NOT NULL,
+            entrada_epoch INTEGER NOT NULL,
+            salida_epoch INTEGER NOT NULL,
+            duracion REAL DEFAULT 0.0,               -- segundos a la vista
+            frames INTEGER DEFAULT 0,
+            frames_casco INTEGER DEFAULT 0,          -- frames en que tenía cada elemento
+            frames_chaleco INTEGER DEFAULT 0,
+            frames_gafas INTEGER DEFAULT 0,
+            cumplimiento_min REAL DEFAULT 0.0,
+            cumplimiento_max REAL DEFAULT 0.0,
+            cumplimiento_promedio REAL DEFAULT 0.0,
+            creado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_tracks_entrada
+        ON tracks_persona(entrada_epoch)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_tracks_camara
+        ON tracks_persona(camera_id, entrada_epoch)
+    """)
+
+
+def activar_vacuum_incremental(conn: sqlite3.Connection):
+    """
+    auto_vacuum=INCREMENTAL permite devolver espacio al disco de a poco
+    (PRAGMA incremental_vacuum) en lugar de un VACUUM completo que bloquea la BD.
+    En una BD existente el cambio requiere un único VACUUM.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
+    conn.commit()
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    hay_tablas = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' LIMIT 1").fetchone()
+    if hay_tablas:
+        print("🔄 Activando auto_vacuum incremental (VACUUM único, puede tardar)...")
+        conn.execute("VACUUM")
+
+
+def asegurar_esquema():
+    """
+    Crea la BD si no existe o aplica migraciones pendientes (sin logs).
+    Se llama al iniciar el servidor API.
+    """
+    if not os.path.exists(DB_PATH):
+        crear_base_datos()
+        return
+    
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        aplicar_migraciones(conn)
+    finally:
+        conn.close()
+
+
 def crear_base_datos():
     """Crea la base de datos y las tablas necesarias"""
     
@@ -21,6 +227,9 @@ def crear_base_datos():
     
     print(f"\n📍 Ubicación: {DB_PATH}\n")
     
+    # Debe fijarse antes de crear las tablas
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    
     # TABLA PRINCIPAL: registros
     print("📋 Creando tabla 'registros'...")
     cursor.execute("""
@@ -55,6 +264,22 @@ def crear_base_datos():
             -- Ruta de la imagen guardada
             ruta_imagen TEXT,
             
+            -- Estado del guardado de la imagen (pendiente, ok, error, sin_imagen)
+            estado_imagen TEXT DEFAULT 'ok',
+            
+            -- Clave de idempotencia (cámara:frame:timestamp) enviada por main.py
+            clave_idempotencia TEXT,
+            
+            -- Cámara que capturó el frame
+            camera_id TEXT,
+            
+            -- fecha_hora normalizada (epoch en segundos, UTC)
+            fecha_epoch INTEGER,
+            
+            -- Muestras posteriores sin cambios que no se guardaron (deduplicador de main.py)
+            repeticiones INTEGER DEFAULT 0,
+            ultima_repeticion TEXT,
+            
             -- Timestamp de creación
             creado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
@@ -89,6 +314,11 @@ def crear_base_datos():
     """)
     print("   ✅ Índices creados")
     
+    # Actualizar BDs creadas con versiones anteriores del esquema
+    print("🔄 Aplicando migraciones...")
+    aplicar_migraciones(conn)
+    print("   ✅ Esquema actualizado")
+    
     # Guardar cambios
     conn.commit()
     conn.close()
@@ -101,6 +331,9 @@ def crear_base_datos():
     print(f"📊 Tablas creadas:")
     print(f"   - registros (datos principales cada 15 seg)")
     print(f"   - detecciones_persona (detalle por persona)")
+    print(f"   - registros_cambios (versiones para sincronizar el dashboard)")
+    print(f"   - rollup_minuto/hora/dia/total (resúmenes para estadísticas)")
+    print(f"   - tracks_persona (una fila por persona seguida, con su EPP)")
     print("\n✅ Lista para usar!\n")
 
 
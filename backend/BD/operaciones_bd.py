@@ -1,40 +1,45 @@
 """
 Operaciones de base de datos para registros EPP
 Funciones para insertar, consultar y gestionar registros
+
+Las escrituras pasan por el hilo escritor único y las lecturas por el
+pool de solo lectura (ver conexion_bd.py). Cada función recibe la
+conexión como primer argumento; quien la llama NO la pasa.
 """
 import sqlite3
-import os
-from typing import Dict, List, Optional
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 
-# Ruta de la BD
-DB_PATH = os.path.join(os.path.dirname(__file__), "epp_registros.db")
+from backend.BD.conexion_bd import operacion_escritura, operacion_lectura
+from backend.BD import rollups
+from backend.BD.tiempo import fecha_a_epoch, fecha_registro_a_epoch
 
 
-def insertar_registro_completo(datos: Dict) -> int:
-    """
-    Inserta un registro completo en la BD.
-    
-    Args:
-        datos: Diccionario con todos los datos del registro
-        
-    Returns:
-        ID del registro insertado
-    """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Insertar registro principal
-    cursor.execute("""
-        INSERT INTO registros (
-            fecha_hora, frame_number,
-            total_personas, total_cascos, total_chalecos, total_gafas,
-            cumplimiento_general, cumplimiento_casco, cumplimiento_chaleco, cumplimiento_gafas,
-            personas_con_casco, personas_sin_casco,
-            personas_con_chaleco, personas_sin_chaleco,
-            personas_con_gafas, personas_sin_gafas,
-            incumplimientos_totales, ruta_imagen
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
+SQL_INSERTAR_REGISTRO = """
+    INSERT INTO registros (
+        fecha_hora, frame_number,
+        total_personas, total_cascos, total_chalecos, total_gafas,
+        cumplimiento_general, cumplimiento_casco, cumplimiento_chaleco, cumplimiento_gafas,
+        personas_con_casco, personas_sin_casco,
+        personas_con_chaleco, personas_sin_chaleco,
+        personas_con_gafas, personas_sin_gafas,
+        incumplimientos_totales, ruta_imagen, estado_imagen, clave_idempotencia,
+        camera_id, fecha_epoch
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+SQL_INSERTAR_PERSONA = """
+    INSERT INTO detecciones_persona (
+        registro_id, numero_persona,
+        tiene_casco, tiene_chaleco, tiene_gafas,
+        cumplimiento_persona
+    ) VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+
+def _valores_registro(datos: Dict) -> tuple:
+    """Parámetros de SQL_INSERTAR_REGISTRO en el orden de las columnas"""
+    return (
         datos["fecha_hora"],
         datos["frame_number"],
         datos["total_personas"],
@@ -52,36 +57,194 @@ def insertar_registro_completo(datos: Dict) -> int:
         datos["personas_con_gafas"],
         datos["personas_sin_gafas"],
         datos["incumplimientos_totales"],
-        datos["ruta_imagen"]
-    ))
+        datos["ruta_imagen"],
+        datos.get("estado_imagen", "ok"),
+        datos.get("clave_idempotencia"),
+        datos.get("camera_id"),
+        fecha_registro_a_epoch(datos["fecha_hora"])
+    )
+
+
+def _registrar_repeticiones(cursor: sqlite3.Cursor, lista_datos: List[Dict]):
+    """
+    Guarda en el registro anterior las muestras sin cambios que main.py no
+    envió ("repite_anterior" del registro nuevo). Es un valor absoluto, así
+    que un reintento del mismo lote no lo vuelve a sumar.
+    """
+    repeticiones = [
+        (datos["repite_anterior"]["repeticiones"], datos["repite_anterior"].get("ultima_repeticion"),
+         datos["repite_anterior"]["clave_idempotencia"])
+        for datos in lista_datos if datos.get("repite_anterior")
+    ]
+    if repeticiones:
+        cursor.executemany("""
+            UPDATE registros
+            SET repeticiones = MAX(COALESCE(repeticiones, 0), ?), ultima_repeticion = ?
+            WHERE clave_idempotencia = ?
+        """, repeticiones)
+
+
+def _valores_persona(registro_id: int, persona: Dict) -> tuple:
+    """Parámetros de SQL_INSERTAR_PERSONA para una persona"""
+    return (
+        registro_id,
+        persona["numero_persona"],
+        persona["tiene_casco"],
+        persona["tiene_chaleco"],
+        persona["tiene_gafas"],
+        persona["cumplimiento_persona"]
+    )
+
+
+@operacion_escritura
+def insertar_registro_completo(conn: sqlite3.Connection, datos: Dict) -> int:
+    """
+    Inserta un registro completo en la BD.
+    
+    Args:
+        datos: Diccionario con todos los datos del registro
+        
+    Returns:
+        ID del registro insertado (o el ya existente si la clave
+        de idempotencia se había recibido antes)
+    """
+    cursor = conn.cursor()
+    
+    # Reintento de un registro ya guardado → no duplicar
+    if datos.get("clave_idempotencia"):
+        existentes = _buscar_claves(cursor, [datos["clave_idempotencia"]])
+        if existentes:
+            return existentes[datos["clave_idempotencia"]]
+    
+    # Insertar registro principal
+    cursor.execute(SQL_INSERTAR_REGISTRO, _valores_registro(datos))
     
     registro_id = cursor.lastrowid
     
+    # Resúmenes por minuto/hora/día en la misma transacción
+    rollups.sumar_registros(cursor, registro_id, registro_id)
+    
     # Insertar detecciones por persona
     if "detecciones_persona" in datos and datos["detecciones_persona"]:
-        for persona in datos["detecciones_persona"]:
-            cursor.execute("""
-                INSERT INTO detecciones_persona (
-                    registro_id, numero_persona,
-                    tiene_casco, tiene_chaleco, tiene_gafas,
-                    cumplimiento_persona
-                ) VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                registro_id,
-                persona["numero_persona"],
-                persona["tiene_casco"],
-                persona["tiene_chaleco"],
-                persona["tiene_gafas"],
-                persona["cumplimiento_persona"]
-            ))
-    
-    conn.commit()
-    conn.close()
+        cursor.executemany(SQL_INSERTAR_PERSONA, [
+            _valores_persona(registro_id, persona)
+            for persona in datos["detecciones_persona"]
+        ])
+    
+    _registrar_repeticiones(cursor, [datos])
     
     return registro_id
 
 
-def obtener_todos_registros(limite: int = 100) -> List[Dict]:
+def _buscar_claves(cursor: sqlite3.Cursor, claves: List[str]) -> Dict[str, int]:
+    """Retorna {clave_idempotencia: id} de las claves que ya existen en la BD"""
+    encontrados = {}
+    # Consultar en bloques para no superar el límite de parámetros de SQLite
+    for i in range(0, len(claves), 500):
+        bloque = claves[i:i + 500]
+        marcadores = ", ".join("?" * len(bloque))
+        cursor.execute(
+            f"SELECT clave_idempotencia, id FROM registros WHERE clave_idempotencia IN ({marcadores})",
+            bloque
+        )
+        encontrados.update(dict(cursor.fetchall()))
+    return encontrados
+
+
+@operacion_lectura
+def buscar_claves_existentes(conn: sqlite3.Connection, claves: List[str]) -> Dict[str, int]:
+    """
+    Indica qué claves de idempotencia ya están guardadas.
+    Permite saltarse el guardado de imagen de un reintento.
+    """
+    if not claves:
+        return {}
+    return _buscar_claves(conn.cursor(), claves)
+
+
+@operacion_escritura
+def insertar_registros_lote(conn: sqlite3.Connection, lista_datos: List[Dict]) -> List[int]:
+    """
+    Inserta varios registros completos en una sola transacción.
+    Usa executemany tanto para registros como para detecciones_persona.
+    
+    Args:
+        lista_datos: Lista de diccionarios con el mismo formato que
+                     insertar_registro_completo
+        
+    Returns:
+        Lista de IDs en el mismo orden que lista_datos (los reintentos
+        con clave de idempotencia ya guardada retornan el ID existente)
+    """
+    if not lista_datos:
+        return []
+    
+    cursor = conn.cursor()
+    
+    # Descartar reintentos (claves ya guardadas o repetidas dentro del lote)
+    existentes = _buscar_claves(
+        cursor, [d["clave_idempotencia"] for d in lista_datos if d.get("clave_idempotencia")]
+    )
+    nuevos = []
+    indice_por_clave = {}
+    destinos = []  # Por cada entrada: ("existente", id) o ("nuevo", índice en `nuevos`)
+    for datos in lista_datos:
+        clave = datos.get("clave_idempotencia")
+        if clave in existentes:
+            destinos.append(("existente", existentes[clave]))
+        elif clave in indice_por_clave:
+            destinos.append(("nuevo", indice_por_clave[clave]))
+        else:
+            if clave:
+                indice_por_clave[clave] = len(nuevos)
+            destinos.append(("nuevo", len(nuevos)))
+            nuevos.append(datos)
+    
+    ids_nuevos = []
+    if nuevos:
+        # El escritor único tiene el lock de escritura: nadie inserta en medio,
+        # así los IDs AUTOINCREMENT del lote quedan consecutivos
+        cursor.executemany(SQL_INSERTAR_REGISTRO, [_valores_registro(d) for d in nuevos])
+        
+        ultimo_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+        ids_nuevos = list(range(ultimo_id - len(nuevos) + 1, ultimo_id + 1))
+        rollups.sumar_registros(cursor, ids_nuevos[0], ids_nuevos[-1])
+        
+        cursor.executemany(SQL_INSERTAR_PERSONA, [
+            _valores_persona(registro_id, persona)
+            for registro_id, datos in zip(ids_nuevos, nuevos)
+            for persona in (datos.get("detecciones_persona") or [])
+        ])
+        _registrar_repeticiones(cursor, nuevos)
+    
+    registro_ids = [
+        valor if tipo == "existente" else ids_nuevos[valor]
+        for tipo, valor in destinos
+    ]
+    
+    return registro_ids
+
+
+@operacion_escritura
+def actualizar_imagen_registro(conn: sqlite3.Connection, registro_id: int,
+                               ruta_imagen: str, estado_imagen: str) -> bool:
+    """
+    Completa la ruta y el estado de la imagen de un registro
+    (la imagen se guarda en segundo plano después del INSERT).
+    
+    Returns:
+        True si el registro existía
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE registros SET ruta_imagen = ?, estado_imagen = ? WHERE id = ?",
+        (ruta_imagen, estado_imagen, registro_id)
+    )
+    return cursor.rowcount > 0
+
+
+@operacion_lectura
+def obtener_todos_registros(conn: sqlite3.Connection, limite: int = 100) -> List[Dict]:
     """
     Obtiene los últimos registros de la BD.
     
@@ -91,8 +254,6 @@ def obtener_todos_registros(limite: int = 100) -> List[Dict]:
     Returns:
         Lista de registros como diccionarios
     """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row  # Para acceder por nombre de columna
     cursor = conn.cursor()
     
     cursor.execute("""
@@ -102,12 +263,273 @@ def obtener_todos_registros(limite: int = 100) -> List[Dict]:
     """, (limite,))
     
     registros = [dict(row) for row in cursor.fetchall()]
-    conn.close()
     
     return registros
 
 
-def obtener_registro_con_detalle(registro_id: int) -> Optional[Dict]:
+# Columnas que se pueden pedir con fields= en GET /api/registros
+CAMPOS_REGISTRO = (
+    "id", "fecha_hora", "frame_number", "camera_id",
+    "total_personas", "total_cascos", "total_chalecos", "total_gafas",
+    "cumplimiento_general", "cumplimiento_casco", "cumplimiento_chaleco", "cumplimiento_gafas",
+    "personas_con_casco", "personas_sin_casco",
+    "personas_con_chaleco", "personas_sin_chaleco",
+    "personas_con_gafas", "personas_sin_gafas",
+    "incumplimientos_totales", "ruta_imagen", "estado_imagen", "creado_en",
+    "repeticiones", "ultima_repeticion",
+)
+
+# Nombres que usa el frontend → columna real (se resuelven en el SELECT)
+ALIAS_CAMPOS = {
+    "timestamp": "fecha_hora",
+    "cumplimiento_cascos": "cumplimiento_casco",
+    "cumplimiento_chalecos": "cumplimiento_chaleco",
+}
+
+# Tamaño máximo de página
+MAX_LIMITE_PAGINA = 1000
+
+
+def _columnas_select(campos: Optional[List[str]]) -> str:
+    """
+    Arma la lista de columnas del SELECT. Sin campos se devuelven todas
+    más los alias del frontend. Lanza ValueError si un campo no existe.
+    """
+    if not campos:
+        campos = list(CAMPOS_REGISTRO) + list(ALIAS_CAMPOS)
+
+    columnas = []
+    for campo in dict.fromkeys(campos):  # sin repetidos, conservando el orden
+        if campo in CAMPOS_REGISTRO:
+            columnas.append(campo)
+        elif campo in ALIAS_CAMPOS:
+            columnas.append(f"{ALIAS_CAMPOS[campo]} AS {campo}")
+        else:
+            raise ValueError(f"Campo desconocido: {campo}")
+    return ", ".join(columnas)
+
+
+@operacion_lectura
+def obtener_registros_paginados(conn: sqlite3.Connection, limite: int = 100,
+                                before_id: Optional[int] = None,
+                                after_id: Optional[int] = None,
+                                campos: Optional[List[str]] = None,
+                                desde: Optional[str] = None,
+                                hasta: Optional[str] = None,
+                                camara: Optional[str] = None,
+                                cumplimiento_min: Optional[float] = None,
+                                cumplimiento_max: Optional[float] = None) -> List[Dict]:
+    """
+    Página de registros ordenada por ID descendente (paginación por cursor).
+    
+    El cursor es un ID (WHERE id < before_id / id > after_id), así que cada
+    página cuesta lo mismo sin importar cuán atrás esté: SQLite salta directo
+    a la posición con la clave primaria o con los índices (camera_id, id) y
+    (fecha_epoch, id), en lugar de recorrer y descartar filas con OFFSET.
+    
+    Args:
+        limite: Registros por página (máximo MAX_LIMITE_PAGINA)
+        before_id: Solo registros más antiguos que este ID (página siguiente)
+        after_id: Solo registros más nuevos que este ID (página anterior / novedades)
+        campos: Columnas a devolver (None = todas)
+        desde, hasta: Rango de fecha (ISO o epoch, inclusivo; se compara con fecha_epoch)
+        camara: Filtrar por camera_id
+        cumplimiento_min, cumplimiento_max: Rango de cumplimiento_general
+    
+    Returns:
+        Lista de registros (siempre del más nuevo al más antiguo)
+    """
+    limite = max(1, min(int(limite), MAX_LIMITE_PAGINA))
+    
+    condiciones, parametros = [], []
+    filtros = [
+        ("id < ?", before_id),
+        ("id > ?", after_id),
+        ("fecha_epoch >= ?", fecha_a_epoch(desde) if desde is not None else None),
+        ("fecha_epoch <= ?", fecha_a_epoch(hasta) if hasta is not None else None),
+        ("camera_id = ?", camara),
+        ("cumplimiento_general >= ?", cumplimiento_min),
+        ("cumplimiento_general <= ?", cumplimiento_max),
+    ]
+    for condicion, valor in filtros:
+        if valor is not None:
+            condiciones.append(condicion)
+            parametros.append(valor)
+    
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    # Con after_id se recorre hacia adelante desde el cursor y luego se invierte
+    orden = "ASC" if after_id is not None and before_id is None else "DESC"
+    
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT {_columnas_select(campos)} FROM registros
+        {where}
+        ORDER BY id {orden}
+        LIMIT ?
+    """, parametros + [limite])
+    
+    registros = [dict(row) for row in cursor.fetchall()]
+    if orden == "ASC":
+        registros.reverse()
+    
+    return registros
+
+
+# Columnas de exportación: las del registro + su epoch, y las de cada persona
+CAMPOS_EXPORTACION = CAMPOS_REGISTRO + ("fecha_epoch",)
+CAMPOS_PERSONA = ("numero_persona", "tiene_casco", "tiene_chaleco", "tiene_gafas",
+                  "cumplimiento_persona")
+
+
+@operacion_lectura
+def obtener_lote_exportacion(conn: sqlite3.Connection,
+                             despues_de: Tuple[int, int] = (-1, -1),
+                             hasta: Optional[int] = None,
+                             camara: Optional[str] = None,
+                             tamano: int = 1000) -> Tuple[List[Dict], Dict[int, List[Dict]]]:
+    """
+    Siguiente lote de una exportación, en orden (fecha_epoch, id).
+    
+    Cada lote es una consulta corta sobre idx_fecha_epoch que continúa
+    donde terminó la anterior: la conexión vuelve al pool entre lotes y
+    exportar un año entero usa la misma memoria que exportar un lote.
+    
+    Args:
+        despues_de: (fecha_epoch, id) del último registro del lote anterior;
+                    para el primer lote, (desde - 1, máximo id) o (-1, -1)
+        hasta: fecha_epoch máximo (inclusivo)
+        camara: Filtrar por camera_id
+    
+    Returns:
+        (registros, {registro_id: [detecciones de personas]})
+    """
+    condiciones = ["(fecha_epoch, id) > (?, ?)"]
+    parametros: List = list(despues_de)
+    if hasta is not None:
+        condiciones.append("fecha_epoch <= ?")
+        parametros.append(hasta)
+    if camara is not None:
+        condiciones.append("camera_id = ?")
+        parametros.append(camara)
+    
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT {', '.join(CAMPOS_EXPORTACION)} FROM registros
+        WHERE {' AND '.join(condiciones)}
+        ORDER BY fecha_epoch, id
+        LIMIT ?
+    """, parametros + [tamano])
+    registros = [dict(row) for row in cursor.fetchall()]
+    
+    personas: Dict[int, List[Dict]] = {}
+    if registros:
+        ids = [registro["id"] for registro in registros]
+        marcadores = ",".join("?" * len(ids))
+        cursor.execute(f"""
+            SELECT registro_id, {', '.join(CAMPOS_PERSONA)} FROM detecciones_persona
+            WHERE registro_id IN ({marcadores})
+            ORDER BY registro_id, numero_persona
+        """, ids)
+        for row in cursor.fetchall():
+            persona = dict(row)
+            personas.setdefault(persona.pop("registro_id"), []).append(persona)
+    
+    return registros, personas
+
+
+# Más cambios que esto desde la versión del cliente → se le pide recargar todo
+MAX_CAMBIOS_DELTA = 1000
+
+
+def _version_cambios(cursor: sqlite3.Cursor) -> int:
+    fila = cursor.execute("SELECT MAX(version) FROM registros_cambios").fetchone()
+    return fila[0] or 0
+
+
+@operacion_lectura
+def obtener_version_cambios(conn: sqlite3.Connection) -> int:
+    """
+    Versión actual de la tabla registros (marca de agua del registro de cambios).
+    Es una búsqueda por clave primaria: sirve de ETag sin tocar registros.
+    """
+    return _version_cambios(conn.cursor())
+
+
+@operacion_lectura
+def obtener_cambios_desde(conn: sqlite3.Connection, version: int,
+                          campos: Optional[List[str]] = None) -> Dict:
+    """
+    Cambios en registros posteriores a `version` (modo delta del dashboard).
+    
+    Varias modificaciones del mismo registro se reportan una sola vez y un
+    registro creado y borrado dentro del intervalo no aparece.
+    
+    Args:
+        version: Última versión que tiene el cliente (ultimo_cambio de la respuesta anterior)
+        campos: Columnas a devolver en nuevos/modificados (None = todas)
+    
+    Returns:
+        {"ultimo_cambio", "reinicio", "nuevos", "modificados", "eliminados"}.
+        reinicio=True si el cliente debe recargar la lista completa (se borró
+        todo o su versión ya se compactó).
+    """
+    cursor = conn.cursor()
+    ultimo = _version_cambios(cursor)
+    respuesta = {"ultimo_cambio": ultimo, "reinicio": False,
+                 "nuevos": [], "modificados": [], "eliminados": []}
+    if version >= ultimo:
+        return respuesta
+    
+    # Las versiones son consecutivas: si la más antigua conservada es mayor
+    # que version + 1, parte del intervalo ya se compactó
+    minima = cursor.execute("SELECT MIN(version) FROM registros_cambios").fetchone()[0]
+    hubo_reinicio = cursor.execute("""
+        SELECT 1 FROM registros_cambios
+        WHERE version > ? AND tipo = 'reset' LIMIT 1
+    """, (version,)).fetchone()
+    if hubo_reinicio or minima is None or minima > version + 1:
+        respuesta["reinicio"] = True
+        return respuesta
+    
+    cursor.execute("""
+        SELECT registro_id, MAX(tipo = 'insert') AS insertado
+        FROM registros_cambios
+        WHERE version > ? AND version <= ?
+        GROUP BY registro_id
+        LIMIT ?
+    """, (version, ultimo, MAX_CAMBIOS_DELTA + 1))
+    cambios = {fila[0]: bool(fila[1]) for fila in cursor.fetchall()}
+    if len(cambios) > MAX_CAMBIOS_DELTA:
+        respuesta["reinicio"] = True
+        return respuesta
+    
+    # Estado actual de los registros que cambiaron (el id siempre va, para fusionar)
+    if campos and "id" not in campos:
+        campos = ["id"] + list(campos)
+    columnas = _columnas_select(campos)
+    ids = list(cambios)
+    filas = {}
+    for i in range(0, len(ids), 500):
+        bloque = ids[i:i + 500]
+        marcadores = ",".join("?" * len(bloque))
+        for fila in cursor.execute(
+                f"SELECT {columnas} FROM registros WHERE id IN ({marcadores})", bloque):
+            filas[fila["id"]] = dict(fila)
+    
+    for registro_id in sorted(ids, reverse=True):
+        if registro_id in filas:
+            destino = "nuevos" if cambios[registro_id] else "modificados"
+            respuesta[destino].append(filas[registro_id])
+        elif not cambios[registro_id]:
+            # Existía antes y ya no está (si se creó y borró dentro del
+            # intervalo el cliente nunca lo vio y no se informa)
+            respuesta["eliminados"].append(registro_id)
+    
+    return respuesta
+
+
+@operacion_lectura
+def obtener_registro_con_detalle(conn: sqlite3.Connection, registro_id: int) -> Optional[Dict]:
     """
     Obtiene un registro específico con sus detecciones por persona.
     
@@ -117,8 +539,6 @@ def obtener_registro_con_detalle(registro_id: int) -> Optional[Dict]:
     Returns:
         Diccionario con el registro y sus detecciones, o None si no existe
     """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
     # Obtener registro principal
@@ -126,7 +546,6 @@ def obtener_registro_con_detalle(registro_id: int) -> Optional[Dict]:
     registro = cursor.fetchone()
     
     if not registro:
-        conn.close()
         return None
     
     registro_dict = dict(registro)
@@ -141,61 +560,107 @@ def obtener_registro_con_detalle(registro_id: int) -> Optional[Dict]:
     detecciones = [dict(row) for row in cursor.fetchall()]
     registro_dict["detecciones_persona"] = detecciones
     
-    conn.close()
-    
     return registro_dict
 
 
-def obtener_estadisticas_generales() -> Dict:
+@operacion_lectura
+def obtener_estadisticas_generales(conn: sqlite3.Connection, desde: Optional[str] = None,
+                                  hasta: Optional[str] = None) -> Dict:
     """
-    Calcula estadísticas generales de todos los registros.
+    Calcula estadísticas generales desde las tablas rollup (tiempo constante).
+    
+    Args:
+        desde, hasta: Ventana opcional (ISO o epoch); hasta es exclusivo.
+                      Sin ventana se usan los totales globales.
+    
+    Raises:
+        ValueError: Si desde o hasta no son fechas válidas
     
     Returns:
         Diccionario con estadísticas
     """
-    conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     
-    # Contar total de registros
-    cursor.execute("SELECT COUNT(*) FROM registros")
-    total_registros = cursor.fetchone()[0]
+    if desde is None and hasta is None:
+        resumen = rollups.consultar_total(cursor)
+    else:
+        # Ventana abierta: desde el inicio de epoch o hasta el último minuto
+        # con registros (inicio_dia necesita fechas que datetime acepte)
+        inicio = fecha_a_epoch(desde) if desde is not None else 0
+        fin = fecha_a_epoch(hasta) if hasta is not None else rollups.fin_ultimo_minuto(cursor)
+        resumen = rollups.consultar_rango(cursor, inicio, fin) if fin is not None else None
     
-    if total_registros == 0:
-        conn.close()
+    if not resumen:
         return {
             "total_registros": 0,
             "mensaje": "No hay registros aún"
         }
     
-    # Obtener promedios
-    cursor.execute("""
-        SELECT 
-            AVG(cumplimiento_general) as cumpl_gral,
-            AVG(cumplimiento_casco) as cumpl_casco,
-            AVG(cumplimiento_chaleco) as cumpl_chaleco,
-            AVG(cumplimiento_gafas) as cumpl_gafas,
-            SUM(total_personas) as total_personas,
-            SUM(incumplimientos_totales) as total_incumpl
-        FROM registros
-    """)
+    total_registros = resumen["registros"]
     
-    resultado = cursor.fetchone()
-    conn.close()
+    def promedio(metrica: str) -> float:
+        return round((resumen[metrica]["suma"] or 0) / total_registros, 2)
     
-    cumpl_gral = resultado[0] or 0
+    cumpl_gral = promedio("cumplimiento_general")
     
     return {
         "total_registros": total_registros,
-        "cumplimiento_general_promedio": round(cumpl_gral, 2),
-        "cumplimiento_casco_promedio": round(resultado[1] or 0, 2),
-        "cumplimiento_chaleco_promedio": round(resultado[2] or 0, 2),
-        "cumplimiento_gafas_promedio": round(resultado[3] or 0, 2),
-        "total_personas_detectadas": resultado[4] or 0,
-        "total_incumplimientos": resultado[5] or 0,
+        "cumplimiento_general_promedio": cumpl_gral,
+        "cumplimiento_casco_promedio": promedio("cumplimiento_casco"),
+        "cumplimiento_chaleco_promedio": promedio("cumplimiento_chaleco"),
+        "cumplimiento_gafas_promedio": promedio("cumplimiento_gafas"),
+        "total_personas_detectadas": int(resumen["total_personas"]["suma"] or 0),
+        "total_incumplimientos": int(resumen["incumplimientos_totales"]["suma"] or 0),
+        "extremos": {
+            metrica: {"min": resumen[metrica]["min"], "max": resumen[metrica]["max"]}
+            for metrica in rollups.METRICAS
+        },
         "calificacion": calificar_cumplimiento(cumpl_gral)
     }
 
 
+# Puntos máximos de una serie (evita pedir minutos de un año entero)
+MAX_PUNTOS_SERIE = 5000
+
+
+@operacion_lectura
+def obtener_serie_analitica(conn: sqlite3.Connection, granularidad: str,
+                            desde, hasta) -> List[Dict]:
+    """
+    Serie temporal de cumplimiento, personas e incumplimientos.
+    
+    Args:
+        granularidad: minuto, hora, dia, semana o mes
+        desde, hasta: Rango (ISO o epoch); hasta es exclusivo
+    
+    Returns:
+        Lista de puntos {inicio, registros, promedios, sumas, máximos}
+    """
+    if granularidad not in rollups.GRANULARIDADES_SERIE:
+        raise ValueError(f"Granularidad inválida: {granularidad} "
+                         f"(usar {', '.join(rollups.GRANULARIDADES_SERIE)})")
+    
+    serie = rollups.consultar_serie(conn.cursor(), granularidad, fecha_a_epoch(desde),
+                                    fecha_a_epoch(hasta), MAX_PUNTOS_SERIE)
+    puntos = []
+    for resumen in serie:
+        registros = resumen["registros"]
+        puntos.append({
+            "inicio": resumen["inicio"],
+            "fecha": datetime.fromtimestamp(resumen["inicio"]).isoformat(),
+            "registros": registros,
+            "cumplimiento_general": round(resumen["cumplimiento_general"]["suma"] / registros, 2),
+            "cumplimiento_casco": round(resumen["cumplimiento_casco"]["suma"] / registros, 2),
+            "cumplimiento_chaleco": round(resumen["cumplimiento_chaleco"]["suma"] / registros, 2),
+            "cumplimiento_gafas": round(resumen["cumplimiento_gafas"]["suma"] / registros, 2),
+            "cumplimiento_general_min": resumen["cumplimiento_general"]["min"],
+            "personas": int(resumen["total_personas"]["suma"] or 0),
+            "personas_max": int(resumen["total_personas"]["max"] or 0),
+            "incumplimientos": int(resumen["incumplimientos_totales"]["suma"] or 0),
+        })
+    return puntos
+
+
 def calificar_cumplimiento(porcentaje: float) -> str:
     """Retorna calificación cualitativa del cumplimiento"""
     if porcentaje >= 90:
@@ -210,7 +675,8 @@ def calificar_cumplimiento(porcentaje: float) -> str:
         return "Muy Malo"
 
 
-def eliminar_registro(registro_id: int) -> bool:
+@operacion_escritura
+def eliminar_registro(conn: sqlite3.Connection, registro_id: int) -> bool:
     """
     Elimina un registro (y sus detecciones por CASCADE).
     
@@ -220,7 +686,6 @@ def eliminar_registro(registro_id: int) -> bool:
     Returns:
         True si se eliminó, False si no existía
     """
-    conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     
     # Verificar primero si existe
@@ -229,64 +694,346 @@ def eliminar_registro(registro_id: int) -> bool:
     
     if existe:
         print(f"🗑️  Eliminando registro ID: {registro_id}")
+        minutos = rollups.minutos_afectados(cursor, "id = ?", (registro_id,))
         cursor.execute("DELETE FROM registros WHERE id = ?", (registro_id,))
         cursor.execute("DELETE FROM detecciones_persona WHERE registro_id = ?", (registro_id,))
-        conn.commit()
+        rollups.recalcular_tras_borrado(cursor, minutos)
         print(f"✅ Registro {registro_id} eliminado correctamente")
     else:
         print(f"❌ Registro ID {registro_id} NO existe en la BD")
     
-    conn.close()
-    
     return existe is not None
 
 
-def eliminar_todos_registros() -> int:
+@operacion_lectura
+def obtener_rango_ids(conn: sqlite3.Connection) -> Tuple[int, int, int]:
+    """(menor id, mayor id, cantidad) de registros; lo usa la purga para fijar su alcance"""
+    minimo, maximo = conn.execute("SELECT MIN(id), MAX(id) FROM registros").fetchone()
+    total = rollups.consultar_total(conn.cursor())
+    return minimo or 0, maximo or 0, total["registros"] if total else 0
+
+
+@operacion_lectura
+def obtener_camaras(conn: sqlite3.Connection) -> List[Dict]:
+    """
+    Cámaras con registros y la fecha de su último registro. Recorre el índice
+    (camera_id, id) saltando de cámara en cámara, sin leer cada registro.
     """
-    Elimina todos los registros de la base de datos y reinicia el contador de IDs.
+    cursor = conn.execute("""
+        WITH RECURSIVE camaras(camera_id) AS (
+            SELECT MIN(camera_id) FROM registros
+            UNION ALL
+            SELECT (SELECT MIN(camera_id) FROM registros WHERE camera_id > camaras.camera_id)
+            FROM camaras WHERE camera_id IS NOT NULL
+        )
+        SELECT c.camera_id,
+               (SELECT r.fecha_hora FROM registros r
+                WHERE r.camera_id = c.camera_id ORDER BY r.id DESC LIMIT 1) AS ultimo_registro
+        FROM camaras c
+        WHERE c.camera_id IS NOT NULL
+    """)
+    return [{"camera_id": camara_id, "ultimo_registro": ultimo}
+            for camara_id, ultimo in cursor.fetchall()]
+
+
+@operacion_escritura
+def eliminar_lote_registros(conn: sqlite3.Connection, hasta_id: int,
+                            tamano: int = 500) -> List[Tuple[int, str]]:
+    """
+    Elimina hasta `tamano` registros (los más antiguos con id <= hasta_id)
+    en una transacción corta, corrigiendo los rollups.
+    
+    Pensada para llamarse en bucle desde un trabajo en segundo plano:
+    entre lote y lote el escritor sigue atendiendo las inserciones.
     
     Returns:
-        Cantidad de registros eliminados
+        Lista de (id, ruta_imagen) eliminados; vacía cuando no queda nada
     """
-    conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, ruta_imagen FROM registros
+        WHERE id <= ?
+        ORDER BY id
+        LIMIT ?
+    """, (hasta_id, tamano))
+    eliminados = [(fila[0], fila[1] or "") for fila in cursor.fetchall()]
+    if not eliminados:
+        return []
+    
+    desde_id, ultimo_id = eliminados[0][0], eliminados[-1][0]
+    minutos = rollups.minutos_afectados(cursor, "id BETWEEN ? AND ?", (desde_id, ultimo_id))
+    cursor.execute("DELETE FROM registros WHERE id BETWEEN ? AND ?", (desde_id, ultimo_id))
+    cursor.execute("DELETE FROM detecciones_persona WHERE registro_id BETWEEN ? AND ?",
+                   (desde_id, ultimo_id))
+    rollups.recalcular_tras_borrado(cursor, minutos)
+    
+    return eliminados
+
+
+@operacion_escritura
+def liberar_espacio(conn: sqlite3.Connection, paginas: int = 2000) -> int:
+    """
+    Devuelve al sistema de archivos hasta `paginas` páginas libres
+    (auto_vacuum=INCREMENTAL). Es un paso corto, no bloquea como VACUUM.
     
-    # Contar registros antes de eliminar
-    cursor.execute("SELECT COUNT(*) FROM registros")
-    cantidad = cursor.fetchone()[0]
+    Returns:
+        Páginas libres que quedan
+    """
+    conn.execute(f"PRAGMA incremental_vacuum({int(paginas)})").fetchall()
+    return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+# Retención: las consultas recorren el índice parcial idx_imagen_fecha
+# (solo registros que aún tienen imagen), así un año de filas sin imagen
+# no se vuelve a leer en cada ciclo
+SQL_IMAGENES_MAS_ANTIGUAS = """
+    SELECT id, ruta_imagen FROM registros
+    WHERE ruta_imagen != '' AND fecha_epoch < ?
+    ORDER BY fecha_epoch
+    LIMIT ?
+"""
+
+
+@operacion_escritura
+def eliminar_registros_antiguos(conn: sqlite3.Connection, antes_de: int,
+                                tamano: int = 500) -> List[Tuple[int, str]]:
+    """
+    Elimina hasta `tamano` registros con fecha_epoch < antes_de, los más
+    antiguos primero, SIN corregir los rollups: las estadísticas de hora,
+    día y total siguen contando los registros que se van por antigüedad.
     
-    print(f"🗑️  Eliminando {cantidad} registros...")
+    Returns:
+        Lista de (id, ruta_imagen) eliminados; vacía cuando no queda nada
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, ruta_imagen FROM registros
+        WHERE fecha_epoch < ?
+        ORDER BY fecha_epoch
+        LIMIT ?
+    """, (antes_de, tamano))
+    eliminados = [(fila[0], fila[1] or "") for fila in cursor.fetchall()]
+    if not eliminados:
+        return []
     
-    # Eliminar todos los registros (CASCADE eliminará las detecciones)
-    cursor.execute("DELETE FROM registros")
-    cursor.execute("DELETE FROM detecciones_persona")
+    ids = [(registro_id,) for registro_id, _ in eliminados]
+    cursor.executemany("DELETE FROM registros WHERE id = ?", ids)
+    cursor.executemany("DELETE FROM detecciones_persona WHERE registro_id = ?", ids)
+    rollups.podar_minutos(cursor, antes_de)
     
-    # Reiniciar el contador de AUTOINCREMENT en SQLite
-    cursor.execute("DELETE FROM sqlite_sequence WHERE name='registros'")
-    cursor.execute("DELETE FROM sqlite_sequence WHERE name='detecciones_persona'")
+    return eliminados
+
+
+@operacion_escritura
+def quitar_imagenes_antiguas(conn: sqlite3.Connection, antes_de: Optional[int],
+                             estado_imagen: str, tamano: int = 500) -> List[Tuple[int, str]]:
+    """
+    Desvincula la imagen de hasta `tamano` registros (los más antiguos con
+    imagen y fecha_epoch < antes_de; None = cualquiera). El registro se
+    conserva con ruta vacía y el estado indicado; quien llama borra los archivos.
     
-    # Commit antes de VACUUM (VACUUM no se puede hacer en transacción)
-    conn.commit()
+    Returns:
+        Lista de (id, ruta_imagen) desvinculados
+    """
+    cursor = conn.cursor()
+    cursor.execute(SQL_IMAGENES_MAS_ANTIGUAS,
+                   (antes_de if antes_de is not None else 2 ** 62, tamano))
+    quitadas = [(fila[0], fila[1]) for fila in cursor.fetchall()]
+    cursor.executemany(
+        "UPDATE registros SET ruta_imagen = '', estado_imagen = ? WHERE id = ?",
+        [(estado_imagen, registro_id) for registro_id, _ in quitadas]
+    )
+    return quitadas
+
+
+@operacion_lectura
+def obtener_registros_con_imagen(conn: sqlite3.Connection, despues_de: Tuple[int, int] = (-1, -1),
+                                 tamano: int = 500) -> List[Tuple[int, int, str]]:
+    """
+    Recorre por lotes los registros que tienen imagen, en orden (fecha_epoch, id).
     
-    # Verificar que se eliminaron
-    cursor.execute("SELECT COUNT(*) FROM registros")
-    quedan = cursor.fetchone()[0]
-    print(f"📊 Registros después de DELETE: {quedan}")
+    Args:
+        despues_de: (fecha_epoch, id) del último registro del lote anterior
     
-    # Verificar sqlite_sequence
-    cursor.execute("SELECT * FROM sqlite_sequence WHERE name='registros'")
-    seq = cursor.fetchone()
-    print(f"📈 sqlite_sequence para 'registros': {seq}")
+    Returns:
+        Lista de (fecha_epoch, id, ruta_imagen)
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT fecha_epoch, id, ruta_imagen FROM registros
+        WHERE ruta_imagen != '' AND (fecha_epoch, id) > (?, ?)
+        ORDER BY fecha_epoch, id
+        LIMIT ?
+    """, (*despues_de, tamano))
+    return [tuple(fila) for fila in cursor.fetchall()]
+
+
+@operacion_lectura
+def obtener_rutas_por_ids(conn: sqlite3.Connection, ids: List[int]) -> Dict[int, str]:
+    """ruta_imagen actual de cada ID que existe (para detectar archivos huérfanos)"""
+    cursor = conn.cursor()
+    rutas = {}
+    for i in range(0, len(ids), 500):
+        bloque = ids[i:i + 500]
+        marcadores = ",".join("?" * len(bloque))
+        cursor.execute(f"SELECT id, ruta_imagen FROM registros WHERE id IN ({marcadores})", bloque)
+        rutas.update((fila[0], fila[1] or "") for fila in cursor.fetchall())
+    return rutas
+
+
+@operacion_lectura
+def obtener_rutas_antiguas(conn: sqlite3.Connection) -> List[str]:
+    """Rutas en formato plano (registros/IMAGE_*.jpg) que aún usa algún registro"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT DISTINCT ruta_imagen FROM registros
+        WHERE ruta_imagen != '' AND ruta_imagen NOT LIKE 'registros/%/%'
+    """)
+    return [fila[0] for fila in cursor.fetchall()]
+
+
+@operacion_escritura
+def marcar_imagenes_faltantes(conn: sqlite3.Connection, faltantes: List[Tuple[int, str]],
+                              estado_imagen: str) -> int:
+    """
+    Marca registros cuya imagen ya no existe en disco. Solo se actualiza
+    si la ruta no cambió desde que se comprobó (ej. migración en curso).
     
-    # Vacuumar para optimizar y limpiar la BD (fuera de transacción)
-    try:
-        cursor.execute("VACUUM")
-    except Exception as e:
-        print(f"⚠️ No se pudo ejecutar VACUUM: {e}")
+    Returns:
+        Registros marcados
+    """
+    cursor = conn.cursor()
+    cursor.executemany(
+        "UPDATE registros SET ruta_imagen = '', estado_imagen = ? WHERE id = ? AND ruta_imagen = ?",
+        [(estado_imagen, registro_id, ruta) for registro_id, ruta in faltantes]
+    )
+    return cursor.rowcount
+
+
+@operacion_escritura
+def cerrar_imagenes_pendientes(conn: sqlite3.Connection, minutos: int,
+                               estado_imagen: str) -> int:
+    """
+    Pasa a `estado_imagen` los registros que siguen con la imagen pendiente
+    más de `minutos` después de insertarse (ej. el servidor se reinició
+    con imágenes en cola).
     
-    conn.close()
+    Returns:
+        Registros actualizados
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE registros SET estado_imagen = ?
+        WHERE estado_imagen = 'pendiente' AND creado_en < datetime('now', ?)
+    """, (estado_imagen, f"-{int(minutos)} minutes"))
+    return cursor.rowcount
+
+
+# Tracks de personas (main.py envía uno por persona al salir de la imagen)
+CAMPOS_TRACK = ("clave_idempotencia", "camera_id", "track_id", "entrada", "salida",
+                "entrada_epoch", "salida_epoch", "duracion", "frames",
+                "frames_casco", "frames_chaleco", "frames_gafas",
+                "cumplimiento_min", "cumplimiento_max", "cumplimiento_promedio")
+
+SQL_INSERTAR_TRACK = f"""
+    INSERT OR IGNORE INTO tracks_persona ({', '.join(CAMPOS_TRACK)})
+    VALUES ({', '.join('?' for _ in CAMPOS_TRACK)})
+"""
+
+
+def _valores_track(track: Dict) -> tuple:
+    datos = dict(track,
+                 entrada_epoch=fecha_a_epoch(track["entrada"]),
+                 salida_epoch=fecha_a_epoch(track["salida"]))
+    return tuple(datos.get(campo) for campo in CAMPOS_TRACK)
+
+
+@operacion_escritura
+def insertar_tracks(conn: sqlite3.Connection, tracks: List[Dict]) -> int:
+    """
+    Inserta tracks en una sola transacción. Los reintentos del spool
+    (misma clave_idempotencia) se ignoran.
     
-    print(f"✅ {cantidad} registros eliminados. IDs reiniciados.")
+    Returns:
+        Tracks nuevos insertados
+    """
+    antes = conn.total_changes
+    conn.executemany(SQL_INSERTAR_TRACK, [_valores_track(track) for track in tracks])
+    return conn.total_changes - antes
+
+
+def _filtros_tracks(desde: Optional[str], hasta: Optional[str],
+                    camara: Optional[str]) -> Tuple[List[str], List]:
+    condiciones, parametros = [], []
+    filtros = [
+        ("entrada_epoch >= ?", fecha_a_epoch(desde) if desde is not None else None),
+        ("entrada_epoch <= ?", fecha_a_epoch(hasta) if hasta is not None else None),
+        ("camera_id = ?", camara),
+    ]
+    for condicion, valor in filtros:
+        if valor is not None:
+            condiciones.append(condicion)
+            parametros.append(valor)
+    return condiciones, parametros
+
+
+@operacion_lectura
+def obtener_tracks_paginados(conn: sqlite3.Connection, limite: int = 100,
+                             antes_de: Optional[Tuple[int, int]] = None,
+                             desde: Optional[str] = None,
+                             hasta: Optional[str] = None,
+                             camara: Optional[str] = None) -> List[Dict]:
+    """
+    Página de tracks del más nuevo al más antiguo (por entrada).
     
-    return cantidad
+    Args:
+        antes_de: Cursor (entrada_epoch, id) del último track de la página anterior
+    """
+    limite = max(1, min(int(limite), MAX_LIMITE_PAGINA))
+    condiciones, parametros = _filtros_tracks(desde, hasta, camara)
+    if antes_de is not None:
+        condiciones.append("(entrada_epoch, id) < (?, ?)")
+        parametros.extend(antes_de)
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    cursor = conn.execute(f"""
+        SELECT * FROM tracks_persona
+        {where}
+        ORDER BY entrada_epoch DESC, id DESC
+        LIMIT ?
+    """, parametros + [limite])
+    return [dict(row) for row in cursor.fetchall()]
+
+
+@operacion_lectura
+def obtener_resumen_tracks(conn: sqlite3.Connection, desde: Optional[str] = None,
+                           hasta: Optional[str] = None,
+                           camara: Optional[str] = None) -> Dict:
+    """
+    Estadísticas por persona: cuántas personas pasaron, cuánto tiempo
+    estuvieron y qué fracción de ese tiempo llevaban cada elemento.
+    """
+    condiciones, parametros = _filtros_tracks(desde, hasta, camara)
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    fila = conn.execute(f"""
+        SELECT COUNT(*) AS personas,
+               COALESCE(SUM(duracion), 0) AS segundos_totales,
+               AVG(duracion) AS duracion_promedio,
+               AVG(cumplimiento_promedio) AS cumplimiento_promedio,
+               AVG(cumplimiento_min) AS cumplimiento_min_promedio,
+               SUM(frames_casco) * 100.0 / NULLIF(SUM(frames), 0) AS porcentaje_tiempo_casco,
+               SUM(frames_chaleco) * 100.0 / NULLIF(SUM(frames), 0) AS porcentaje_tiempo_chaleco,
+               SUM(frames_gafas) * 100.0 / NULLIF(SUM(frames), 0) AS porcentaje_tiempo_gafas,
+               SUM(cumplimiento_min >= 100) AS personas_siempre_completas,
+               SUM(cumplimiento_max <= 0) AS personas_nunca_con_epp
+        FROM tracks_persona
+        {where}
+    """, parametros).fetchone()
+    return {clave: (round(valor, 2) if isinstance(valor, float) else (valor or 0))
+            for clave, valor in dict(fila).items()}
+
 
+@operacion_escritura
+def eliminar_tracks_antiguos(conn: sqlite3.Connection, antes_de: int) -> int:
+    """Elimina los tracks que entraron antes de `antes_de` (epoch). Retorna cuántos"""
+    cursor = conn.execute("DELETE FROM tracks_persona WHERE entrada_epoch < ?", (antes_de,))
+    return cursor.rowcount
@@ -0,0 +1,338 @@
+"""
+Tablas de resumen (rollups) de registros por minuto, hora, día y total
+Cada fila guarda, para un intervalo, la cantidad de registros y la suma,
+mínimo y máximo de cada métrica. Las estadísticas se leen de aquí en
+tiempo constante en lugar de recorrer toda la tabla registros.
+
+- Al insertar: se suman en la MISMA transacción que el INSERT (upsert)
+- Al borrar: se recalculan solo los intervalos afectados
+  (minuto desde registros, hora desde minutos, día desde horas, total desde días)
+
+Los intervalos son epoch en segundos: minuto y hora alineados a UTC,
+día a la medianoche local del servidor.
+"""
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from backend.BD.tiempo import inicio_dia, siguiente_dia
+
+# Métricas de registros que se resumen
+METRICAS = (
+    "cumplimiento_general",
+    "cumplimiento_casco",
+    "cumplimiento_chaleco",
+    "cumplimiento_gafas",
+    "total_personas",
+    "incumplimientos_totales",
+)
+
+GRANULARIDADES = ("minuto", "hora", "dia", "total")
+
+# Expresión SQL del inicio del intervalo a partir de una columna epoch
+_EXPRESION_INTERVALO = {
+    "minuto": "({col} / 60) * 60",
+    "hora": "({col} / 3600) * 3600",
+    "dia": "CAST(strftime('%s', date({col}, 'unixepoch', 'localtime'), 'utc') AS INTEGER)",
+    "total": "0",
+}
+
+# Cada nivel se recalcula desde el nivel inmediatamente más fino
+_ORIGEN = {"hora": "minuto", "dia": "hora", "total": "dia"}
+
+
+def tabla(granularidad: str) -> str:
+    return f"rollup_{granularidad}"
+
+
+def _columnas() -> List[str]:
+    columnas = ["registros"]
+    for metrica in METRICAS:
+        columnas += [f"suma_{metrica}", f"min_{metrica}", f"max_{metrica}"]
+    return columnas
+
+
+COLUMNAS = _columnas()
+
+
+def crear_tablas_rollup(conn: sqlite3.Connection):
+    """Crea las tablas rollup_minuto/hora/dia/total si no existen"""
+    definiciones = ",\n".join(
+        f"{columna} {'INTEGER' if columna == 'registros' else 'REAL'}" for columna in COLUMNAS
+    )
+    for granularidad in GRANULARIDADES:
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {tabla(granularidad)} (
+                intervalo INTEGER PRIMARY KEY,
+                {definiciones}
+            )
+        """)
+
+
+# ============================================================================
+# SQL DE AGREGACIÓN
+# ============================================================================
+
+def _select_desde_registros(granularidad: str, where: str) -> str:
+    """SELECT agregado de registros agrupado por intervalo"""
+    expresion = _EXPRESION_INTERVALO[granularidad].format(col="fecha_epoch")
+    agregados = ["COUNT(*)"]
+    for metrica in METRICAS:
+        agregados += [f"SUM({metrica})", f"MIN({metrica})", f"MAX({metrica})"]
+    return f"""
+        SELECT {expresion} AS intervalo_calc, {', '.join(agregados)}
+        FROM registros
+        WHERE fecha_epoch IS NOT NULL AND {where}
+        GROUP BY intervalo_calc
+    """
+
+
+def _select_desde_rollup(granularidad: str, where: str) -> str:
+    """SELECT agregado del nivel más fino agrupado por el intervalo de `granularidad`"""
+    expresion = _EXPRESION_INTERVALO[granularidad].format(col="intervalo")
+    agregados = ["SUM(registros)"]
+    for metrica in METRICAS:
+        agregados += [f"SUM(suma_{metrica})", f"MIN(min_{metrica})", f"MAX(max_{metrica})"]
+    return f"""
+        SELECT {expresion} AS intervalo_calc, {', '.join(agregados)}
+        FROM {tabla(_ORIGEN[granularidad])}
+        WHERE {where}
+        GROUP BY intervalo_calc
+    """
+
+
+def _sql_upsert(granularidad: str, select: str) -> str:
+    """INSERT ... SELECT que suma sobre la fila existente del intervalo"""
+    actualizaciones = ["registros = registros + excluded.registros"]
+    for metrica in METRICAS:
+        actualizaciones += [
+            f"suma_{metrica} = suma_{metrica} + excluded.suma_{metrica}",
+            f"min_{metrica} = MIN(min_{metrica}, excluded.min_{metrica})",
+            f"max_{metrica} = MAX(max_{metrica}, excluded.max_{metrica})",
+        ]
+    return f"""
+        INSERT INTO {tabla(granularidad)} (intervalo, {', '.join(COLUMNAS)})
+        {select}
+        ON CONFLICT(intervalo) DO UPDATE SET {', '.join(actualizaciones)}
+    """
+
+
+# ============================================================================
+# MANTENIMIENTO
+# ============================================================================
+
+def sumar_registros(cursor: sqlite3.Cursor, id_desde: int, id_hasta: int):
+    """
+    Suma a los rollups los registros con ID entre id_desde e id_hasta
+    (recién insertados, dentro de la transacción del INSERT).
+    """
+    for granularidad in GRANULARIDADES:
+        select = _select_desde_registros(granularidad, "id BETWEEN ? AND ?")
+        cursor.execute(_sql_upsert(granularidad, select), (id_desde, id_hasta))
+
+
+def minutos_afectados(cursor: sqlite3.Cursor, where: str, parametros: Iterable) -> List[int]:
+    """Intervalos de minuto de los registros que se van a borrar (llamar ANTES del DELETE)"""
+    expresion = _EXPRESION_INTERVALO["minuto"].format(col="fecha_epoch")
+    cursor.execute(
+        f"SELECT DISTINCT {expresion} FROM registros WHERE fecha_epoch IS NOT NULL AND {where}",
+        tuple(parametros)
+    )
+    return [fila[0] for fila in cursor.fetchall()]
+
+
+def _recalcular(cursor: sqlite3.Cursor, granularidad: str, rangos: List[Tuple[int, int]]):
+    """Reemplaza las filas de los intervalos dados recalculándolas desde su origen"""
+    if granularidad == "minuto":
+        select = _select_desde_registros(granularidad, "fecha_epoch >= ? AND fecha_epoch < ?")
+    else:
+        select = _select_desde_rollup(granularidad, "intervalo >= ? AND intervalo < ?")
+    cursor.executemany(f"DELETE FROM {tabla(granularidad)} WHERE intervalo = ?",
+                       [(inicio,) for inicio, _ in rangos])
+    cursor.executemany(
+        f"INSERT INTO {tabla(granularidad)} (intervalo, {', '.join(COLUMNAS)}) {select}",
+        rangos
+    )
+
+
+def recalcular_tras_borrado(cursor: sqlite3.Cursor, minutos: List[int]):
+    """
+    Corrige los rollups después de borrar registros (llamar DESPUÉS del DELETE,
+    con lo que retornó minutos_afectados). Solo se tocan los intervalos afectados.
+    """
+    if not minutos:
+        return
+    _recalcular(cursor, "minuto", [(m, m + 60) for m in minutos])
+
+    horas = sorted({m // 3600 * 3600 for m in minutos})
+    _recalcular(cursor, "hora", [(h, h + 3600) for h in horas])
+
+    dias = sorted({inicio_dia(h) for h in horas})
+    _recalcular(cursor, "dia", [(d, siguiente_dia(d)) for d in dias])
+
+    cursor.execute(f"DELETE FROM {tabla('total')}")
+    cursor.execute(
+        f"INSERT INTO {tabla('total')} (intervalo, {', '.join(COLUMNAS)}) "
+        f"{_select_desde_rollup('total', '1')}"
+    )
+
+
+def podar_minutos(cursor: sqlite3.Cursor, antes_de: int):
+    """
+    Quita los intervalos de minuto de las horas completas anteriores a
+    `antes_de`. Los usa la retención tras borrar registros antiguos: hora,
+    día y total se conservan, así las estadísticas históricas no cambian.
+
+    Solo se podan horas enteras que ya no tienen registros: si después se
+    borra un registro (eliminar_registro), recalcular_tras_borrado rehace su
+    hora desde los minutos, y una hora con minutos podados perdería la
+    historia que la retención quiso conservar. Por eso el corte baja a la
+    hora del registro más antiguo que queda (la retención borra por lotes).
+    """
+    cursor.execute("SELECT MIN(fecha_epoch) FROM registros")
+    mas_antiguo = cursor.fetchone()[0]
+    limite = antes_de if mas_antiguo is None else min(antes_de, mas_antiguo)
+    cursor.execute(f"DELETE FROM {tabla('minuto')} WHERE intervalo < ?", (limite // 3600 * 3600,))
+
+
+def vaciar_rollups(cursor: sqlite3.Cursor):
+    for granularidad in GRANULARIDADES:
+        cursor.execute(f"DELETE FROM {tabla(granularidad)}")
+
+
+def reconstruir_rollups(cursor: sqlite3.Cursor):
+    """Recalcula todos los rollups desde cero (migración de una BD existente)"""
+    vaciar_rollups(cursor)
+    cursor.execute(
+        f"INSERT INTO {tabla('minuto')} (intervalo, {', '.join(COLUMNAS)}) "
+        f"{_select_desde_registros('minuto', '1')}"
+    )
+    for granularidad in ("hora", "dia", "total"):
+        cursor.execute(
+            f"INSERT INTO {tabla(granularidad)} (intervalo, {', '.join(COLUMNAS)}) "
+            f"{_select_desde_rollup(granularidad, '1')}"
+        )
+
+
+# ============================================================================
+# CONSULTA
+# ============================================================================
+
+def _techo(valor: int, paso: int) -> int:
+    return -(-valor // paso) * paso
+
+
+def descomponer_rango(desde: int, hasta: int) -> List[Tuple[str, int, int]]:
+    """
+    Cubre [desde, hasta) con la menor cantidad de intervalos completos:
+    días en el centro, horas y minutos en los bordes. Resolución: 1 minuto.
+
+    Returns:
+        Lista de (granularidad, inicio, fin) para consultar cada tabla por rango
+    """
+    a, b = _techo(desde, 60), hasta // 60 * 60
+    if a >= b:
+        return []
+    ha, hb = _techo(a, 3600), b // 3600 * 3600
+    if ha >= hb:
+        return [("minuto", a, b)]
+
+    da = inicio_dia(ha)
+    if da < ha:
+        da = siguiente_dia(ha)
+    db = inicio_dia(hb)
+    if da >= db:
+        return [("minuto", a, ha), ("hora", ha, hb), ("minuto", hb, b)]
+
+    return [("minuto", a, ha), ("hora", ha, da), ("dia", da, db),
+            ("hora", db, hb), ("minuto", hb, b)]
+
+
+def _fila_a_resumen(fila) -> Optional[Dict]:
+    if not fila or not fila[0]:
+        return None
+    resumen = {"registros": fila[0]}
+    for i, metrica in enumerate(METRICAS):
+        resumen[metrica] = {
+            "suma": fila[1 + 3 * i],
+            "min": fila[2 + 3 * i],
+            "max": fila[3 + 3 * i],
+        }
+    return resumen
+
+
+def consultar_total(cursor: sqlite3.Cursor) -> Optional[Dict]:
+    """Resumen de toda la tabla (una fila)"""
+    cursor.execute(f"SELECT {', '.join(COLUMNAS)} FROM {tabla('total')}")
+    return _fila_a_resumen(cursor.fetchone())
+
+
+def fin_ultimo_minuto(cursor: sqlite3.Cursor) -> Optional[int]:
+    """Fin del último minuto con registros (cota superior de una ventana abierta), o None si no hay"""
+    cursor.execute(f"SELECT MAX(intervalo) FROM {tabla('minuto')}")
+    ultimo = cursor.fetchone()[0]
+    return None if ultimo is None else ultimo + 60
+
+
+def consultar_rango(cursor: sqlite3.Cursor, desde: int, hasta: int) -> Optional[Dict]:
+    """Resumen de los registros con fecha_epoch en [desde, hasta)"""
+    partes, parametros = [], []
+    for granularidad, inicio, fin in descomponer_rango(desde, hasta):
+        if inicio < fin:
+            partes.append(f"SELECT {', '.join(COLUMNAS)} FROM {tabla(granularidad)} "
+                          f"WHERE intervalo >= ? AND intervalo < ?")
+            parametros += [inicio, fin]
+    if not partes:
+        return None
+
+    agregados = ["SUM(registros)"]
+    for metrica in METRICAS:
+        agregados += [f"SUM(suma_{metrica})", f"MIN(min_{metrica})", f"MAX(max_{metrica})"]
+    cursor.execute(
+        f"SELECT {', '.join(agregados)} FROM ({' UNION ALL '.join(partes)})",
+        parametros
+    )
+    return _fila_a_resumen(cursor.fetchone())
+
+
+# Series: cada granularidad se lee de la tabla rollup que le corresponde;
+# semana y mes agrupan los días
+_SERIES = {
+    "minuto": ("minuto", "intervalo"),
+    "hora": ("hora", "intervalo"),
+    "dia": ("dia", "intervalo"),
+    "semana": ("dia", "CAST(strftime('%s', date(intervalo, 'unixepoch', 'localtime', "
+                      "'weekday 0', '-6 days'), 'utc') AS INTEGER)"),
+    "mes": ("dia", "CAST(strftime('%s', date(intervalo, 'unixepoch', 'localtime', "
+                   "'start of month'), 'utc') AS INTEGER)"),
+}
+
+GRANULARIDADES_SERIE = tuple(_SERIES)
+
+
+def consultar_serie(cursor: sqlite3.Cursor, granularidad: str, desde: int, hasta: int,
+                    max_puntos: int) -> List[Dict]:
+    """
+    Serie temporal de [desde, hasta) agrupada por granularidad, con una sola
+    consulta por rango de clave primaria sobre la tabla rollup correspondiente.
+    """
+    origen, expresion = _SERIES[granularidad]
+    agregados = ["SUM(registros)"]
+    for metrica in METRICAS:
+        agregados += [f"SUM(suma_{metrica})", f"MIN(min_{metrica})", f"MAX(max_{metrica})"]
+    cursor.execute(f"""
+        SELECT {expresion} AS inicio, {', '.join(agregados)}
+        FROM {tabla(origen)}
+        WHERE intervalo >= ? AND intervalo < ?
+        GROUP BY inicio
+        ORDER BY inicio
+        LIMIT ?
+    """, (desde, hasta, max_puntos))
+
+    serie = []
+    for fila in cursor.fetchall():
+        resumen = _fila_a_resumen(fila[1:])
+        if resumen:
+            resumen["inicio"] = fila[0]
+            serie.append(resumen)
+    return serie
+
@@ -0,0 +1,62 @@
+"""
+Conversión de fechas a epoch (segundos UTC) para la BD
+fecha_hora llega como texto ISO desde el sink, a veces con zona horaria
+y a veces sin ella; fecha_epoch normaliza ambas a un entero comparable. Los filtros de la API
+también aceptan epoch y rechazan lo que no sea una fecha.
+"""
+import time
+from datetime import datetime, timedelta
+
+
+def fecha_a_epoch(fecha_hora) -> int:
+    """
+    Convierte una fecha a epoch en segundos: texto ISO, o epoch como número
+    o como texto de dígitos (ej. "1700000000").
+    Sin zona horaria se asume la hora local del servidor (como datetime.now()).
+    
+    Raises:
+        ValueError: Si no es una fecha válida o está fuera del rango de datetime
+    """
+    if isinstance(fecha_hora, str):
+        texto = fecha_hora.strip()
+        try:
+            epoch = int(texto)
+        except ValueError:
+            try:
+                return int(datetime.fromisoformat(texto.replace('Z', '+00:00')).timestamp())
+            except (ValueError, OverflowError, OSError):
+                raise ValueError(f"Fecha inválida: {fecha_hora!r} (usar ISO o epoch)") from None
+    elif isinstance(fecha_hora, (int, float)) and not isinstance(fecha_hora, bool):
+        epoch = fecha_hora
+    else:
+        raise ValueError(f"Fecha inválida: {fecha_hora!r} (usar ISO o epoch)")
+    
+    # inicio_dia / siguiente_dia pasan el epoch por datetime: validar aquí
+    try:
+        datetime.fromtimestamp(epoch)
+    except (ValueError, OverflowError, OSError):
+        raise ValueError(f"Fecha fuera de rango: {fecha_hora!r}") from None
+    return int(epoch)
+
+
+def fecha_registro_a_epoch(fecha_hora) -> int:
+    """
+    fecha_a_epoch para la fecha_hora de un registro (la envía el sink): si no
+    se puede interpretar se usa la hora actual, en vez de rechazar el registro
+    """
+    try:
+        return fecha_a_epoch(fecha_hora)
+    except ValueError:
+        return int(time.time())
+
+
+def inicio_dia(epoch: int) -> int:
+    """Epoch de la medianoche local del día que contiene `epoch`"""
+    fecha = datetime.fromtimestamp(epoch)
+    return int(fecha.replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+
+
+def siguiente_dia(epoch: int) -> int:
+    """Epoch de la medianoche local siguiente (los días con cambio de horario duran 23/25 h)"""
+    fecha = datetime.fromtimestamp(inicio_dia(epoch)) + timedelta(days=1, hours=2)
+    return inicio_dia(int(fecha.timestamp()))
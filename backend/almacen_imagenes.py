@@ -0,0 +1,255 @@
+"""
+Almacén de imágenes de registros
+Organiza las imágenes en subcarpetas por fecha y cámara con nombres únicos:
+
+    registros/AAAA/MM/DD/<camara>/<registro_id>.jpg
+
+- El nombre es el ID del registro → dos registros del mismo segundo no se pisan
+- Las carpetas por día mantienen cada directorio pequeño (listar/borrar es rápido)
+- Las escrituras son atómicas (archivo temporal + rename)
+- Las rutas antiguas (registros/IMAGE_AAAAMMDD_HHMMSS.jpg) se siguen
+  resolviendo y se migran al abrir o borrar el registro
+"""
+import os
+import shutil
+import threading
+from datetime import datetime
+from typing import Dict, Iterator, NamedTuple, Optional
+
+# Ruta de la carpeta registros (un nivel arriba de backend)
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REGISTROS_DIR = os.path.join(BASE_DIR, "registros")
+
+# Prefijo de las rutas relativas guardadas en registros.ruta_imagen
+PREFIJO_RUTA = "registros/"
+
+# Carpeta de cámara cuando el registro no indica ninguna
+CAMARA_POR_DEFECTO = "general"
+
+# Archivos que la recolección de huérfanos considera imágenes (el resto no se toca)
+EXTENSIONES_IMAGEN = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def _fecha_desde_texto(fecha_hora: str) -> datetime:
+    try:
+        return datetime.fromisoformat(fecha_hora.replace('Z', '+00:00'))
+    except (ValueError, AttributeError):
+        return datetime.now()
+
+
+def _nombre_seguro(texto: str) -> str:
+    """Deja solo caracteres válidos para un nombre de carpeta"""
+    limpio = "".join(c if c.isalnum() or c in "-_" else "_" for c in str(texto))
+    return limpio or CAMARA_POR_DEFECTO
+
+
+def ruta_relativa_imagen(registro_id: int, fecha_hora: str, camara: Optional[str] = None) -> str:
+    """
+    Ruta relativa (la que se guarda en la BD) para la imagen de un registro.
+
+    Ejemplo:
+        >>> ruta_relativa_imagen(123, "2025-11-02T10:00:00", "cam1")
+        'registros/2025/11/02/cam1/00000123.jpg'
+    """
+    fecha = _fecha_desde_texto(fecha_hora)
+    return (f"{PREFIJO_RUTA}{fecha:%Y/%m/%d}/{_nombre_seguro(camara or CAMARA_POR_DEFECTO)}/"
+            f"{registro_id:08d}.jpg")
+
+
+def resolver_ruta(ruta_relativa: str) -> Optional[str]:
+    """
+    Convierte una ruta relativa (nueva o antigua) en ruta absoluta dentro
+    de REGISTROS_DIR. Retorna None si la ruta intenta salir de la carpeta.
+    """
+    if not ruta_relativa:
+        return None
+    ruta_relativa = ruta_relativa.replace("\\", "/")
+    if ruta_relativa.startswith(PREFIJO_RUTA):
+        ruta_relativa = ruta_relativa[len(PREFIJO_RUTA):]
+
+    base = os.path.realpath(REGISTROS_DIR)
+    ruta = os.path.realpath(os.path.join(base, *ruta_relativa.split("/")))
+    if os.path.commonpath([base, ruta]) != base or ruta == base:
+        return None
+    return ruta
+
+
+def escribir_atomico(ruta_relativa: str, datos: bytes) -> str:
+    """
+    Escribe los bytes en un archivo temporal de la misma carpeta y lo
+    renombra al destino: un lector nunca ve una imagen a medio escribir.
+
+    Returns:
+        La misma ruta relativa recibida
+    """
+    ruta = resolver_ruta(ruta_relativa)
+    if ruta is None:
+        raise ValueError(f"Ruta de imagen inválida: {ruta_relativa}")
+
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temporal, "wb") as f:
+            f.write(datos)
+        os.replace(temporal, ruta)
+    except Exception:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+    return ruta_relativa
+
+
+def es_ruta_antigua(ruta_relativa: str) -> bool:
+    """True si la imagen está en la carpeta plana (formato anterior)"""
+    if not ruta_relativa:
+        return False
+    ruta_relativa = ruta_relativa.replace("\\", "/")
+    if ruta_relativa.startswith(PREFIJO_RUTA):
+        ruta_relativa = ruta_relativa[len(PREFIJO_RUTA):]
+    return "/" not in ruta_relativa
+
+
+def migrar_imagen_antigua(registro: Dict) -> Optional[str]:
+    """
+    Copia la imagen de un registro con ruta antigua a su ubicación nueva.
+
+    Se usa enlace duro (o copia) en lugar de mover porque con el formato
+    anterior dos registros del mismo segundo podían compartir archivo.
+    El archivo antiguo queda huérfano y lo limpia la recolección de huérfanos.
+
+    Returns:
+        Nueva ruta relativa, o None si no había nada que migrar
+    """
+    ruta_actual = registro.get("ruta_imagen")
+    if not es_ruta_antigua(ruta_actual):
+        return None
+
+    origen = resolver_ruta(ruta_actual)
+    if origen is None or not os.path.exists(origen):
+        return None
+
+    ruta_nueva = ruta_relativa_imagen(registro["id"], registro.get("fecha_hora", ""),
+                                      registro.get("camera_id"))
+    destino = resolver_ruta(ruta_nueva)
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    if not os.path.exists(destino):
+        try:
+            os.link(origen, destino)
+        except OSError:
+            shutil.copy2(origen, destino)
+    return ruta_nueva
+
+
+def eliminar_imagen(ruta_relativa: str) -> bool:
+    """Borra la imagen de un registro. Retorna True si existía"""
+    ruta = resolver_ruta(ruta_relativa)
+    if ruta is None:
+        return False
+    try:
+        os.remove(ruta)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def eliminar_carpetas_vacias():
+    """Quita las carpetas de día/cámara que quedaron vacías tras un borrado"""
+    base = os.path.realpath(REGISTROS_DIR)
+    for raiz, _, _ in os.walk(base, topdown=False):
+        if raiz != base:
+            try:
+                os.rmdir(raiz)  # Solo tiene éxito si está vacía
+            except OSError:
+                pass
+
+
+class ArchivoImagen(NamedTuple):
+    """Archivo encontrado al recorrer REGISTROS_DIR"""
+    ruta_relativa: str           # Como se guarda en registros.ruta_imagen
+    ruta: str                    # Ruta absoluta
+    registro_id: Optional[int]   # None en archivos con nombre antiguo o temporales
+    tamano: int
+    modificado: float            # mtime en segundos
+    temporal: bool               # Restos de una escritura atómica interrumpida
+
+
+def recorrer_imagenes() -> Iterator[ArchivoImagen]:
+    """Recorre todos los archivos de REGISTROS_DIR (para la recolección de huérfanos)"""
+    base = os.path.realpath(REGISTROS_DIR)
+    pendientes = [base]
+    while pendientes:
+        carpeta = pendientes.pop()
+        try:
+            entradas = list(os.scandir(carpeta))
+        except FileNotFoundError:
+            continue
+        for entrada in entradas:
+            if entrada.is_dir(follow_symlinks=False):
+                pendientes.append(entrada.path)
+                continue
+            if not entrada.is_file(follow_symlinks=False):
+                continue
+            nombre, extension = os.path.splitext(entrada.name)
+            temporal = extension == ".tmp"
+            if not temporal and extension.lower() not in EXTENSIONES_IMAGEN:
+                continue
+            try:
+                info = entrada.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            relativa = PREFIJO_RUTA + os.path.relpath(entrada.path, base).replace(os.sep, "/")
+            registro_id = int(nombre) if (carpeta != base and not temporal
+                                          and nombre.isdigit()) else None
+            yield ArchivoImagen(relativa, entrada.path, registro_id,
+                                info.st_size, info.st_mtime, temporal)
+
+
+class MedidorAlmacen:
+    """
+    Calcula cuánto ocupan las imágenes sin volver a leer todo el árbol:
+    el total de cada carpeta se guarda junto con su mtime, que cambia al
+    crear, renombrar o borrar archivos dentro. Solo se vuelven a sumar las
+    carpetas que cambiaron (normalmente las del día actual).
+    """
+
+    def __init__(self):
+        self._carpetas: Dict[str, tuple] = {}
+
+    def medir(self) -> int:
+        """Bytes ocupados por los archivos de REGISTROS_DIR"""
+        base = os.path.realpath(REGISTROS_DIR)
+        vistas = set()
+        total = 0
+        pendientes = [base]
+        while pendientes:
+            carpeta = pendientes.pop()
+            try:
+                mtime = os.stat(carpeta).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            vistas.add(carpeta)
+            cache = self._carpetas.get(carpeta)
+            if cache is not None and cache[0] == mtime:
+                _, bytes_archivos, subcarpetas = cache
+            else:
+                bytes_archivos, subcarpetas = 0, []
+                try:
+                    entradas = list(os.scandir(carpeta))
+                except FileNotFoundError:
+                    continue
+                for entrada in entradas:
+                    try:
+                        if entrada.is_dir(follow_symlinks=False):
+                            subcarpetas.append(entrada.path)
+                        elif entrada.is_file(follow_symlinks=False):
+                            bytes_archivos += entrada.stat(follow_symlinks=False).st_size
+                    except FileNotFoundError:
+                        continue
+                self._carpetas[carpeta] = (mtime, bytes_archivos, subcarpetas)
+            total += bytes_archivos
+            pendientes.extend(subcarpetas)
+
+        # Olvidar carpetas que ya no existen
+        for carpeta in set(self._carpetas) - vistas:
+            del self._carpetas[carpeta]
+        return total
@@ -1,8 +1,14 @@
 """
 3_calcular_cumplimiento.py
 Módulo para calcular cumplimiento de EPP basado en detecciones
+
+Si model_1 trae las cajas (xyxy), cada casco/chaleco/gafas se asigna a la
+persona que lo contiene (matrices persona × EPP con NumPy y emparejamiento
+en bloque). Sin cajas se usa el conteo de clases como antes.
 """
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
 
 # Clases EPP reconocidas
 CLASES_EPP = {
@@ -13,6 +19,29 @@ CLASES_EPP = {
     "safety glasses": "Gafas"
 }
 
+# Zona de la caja de la persona donde se busca cada EPP, como fracciones de
+# su alto (0 = borde superior, 1 = borde inferior). El casco y las gafas
+# pueden sobresalir un poco por arriba de la caja de la persona.
+REGIONES_EPP = {
+    "Casco": (-0.15, 0.40),
+    "Chaleco": (0.10, 0.85),
+    "Gafas": (-0.05, 0.35),
+}
+
+# Fracción mínima del área del EPP que debe caer dentro de la zona
+UMBRAL_CONTENCION = 0.5
+
+# Peso del IoU con la zona para desempatar personas superpuestas
+PESO_IOU = 0.1
+
+# Código de cada clase para la asociación: 0 = persona, 1.. = EPP de REGIONES_EPP
+_TIPOS_EPP = tuple(REGIONES_EPP)
+_CODIGOS_CLASE = {
+    clase: 0 if nombre == "Persona" else _TIPOS_EPP.index(nombre) + 1
+    for clase, nombre in CLASES_EPP.items()
+}
+_REGIONES = np.array([REGIONES_EPP[tipo] for tipo in _TIPOS_EPP], dtype=np.float32)
+
 
 def calcular_cumplimiento(detecciones_roboflow: Dict) -> Dict:
     """
@@ -48,15 +77,25 @@ def calcular_cumplimiento(detecciones_roboflow: Dict) -> Dict:
         # Retornar resultado vacío pero válido
         return crear_resultado_vacio()
     
-    # Calcular cumplimiento por elemento
+    # Asociar cada EPP a una persona por posición (si hay cajas); si no,
+    # distribución proporcional por conteo
+    asociacion = asociar_epp(detecciones_roboflow["model_1"])
+    if asociacion is not None and len(asociacion["Persona"]) == conteo["personas"]:
+        distribucion = distribucion_desde_asociacion(asociacion)
+        detecciones_individuales = detecciones_desde_asociacion(asociacion)
+    else:
+        distribucion = calcular_distribucion_personas(conteo)
+        detecciones_individuales = generar_detecciones_individuales(conteo, distribucion)
+    
+    # Calcular cumplimiento por elemento (personas que lo tienen / personas)
     cumplimiento_casco = calcular_cumplimiento_elemento(
-        conteo["personas"], conteo["cascos"]
+        conteo["personas"], distribucion["personas_con_casco"]
     )
     cumplimiento_chaleco = calcular_cumplimiento_elemento(
-        conteo["personas"], conteo["chalecos"]
+        conteo["personas"], distribucion["personas_con_chaleco"]
     )
     cumplimiento_gafas = calcular_cumplimiento_elemento(
-        conteo["personas"], conteo["gafas"]
+        conteo["personas"], distribucion["personas_con_gafas"]
     )
     
     # Cumplimiento general (promedio de los 3 elementos)
@@ -64,9 +103,6 @@ def calcular_cumplimiento(detecciones_roboflow: Dict) -> Dict:
         cumplimiento_casco + cumplimiento_chaleco + cumplimiento_gafas
     ) / 3
     
-    # Calcular distribución de personas con/sin cada elemento
-    distribucion = calcular_distribucion_personas(conteo)
-    
     # Calcular incumplimientos totales
     incumplimientos = (
         distribucion["personas_sin_casco"] +
@@ -74,9 +110,6 @@ def calcular_cumplimiento(detecciones_roboflow: Dict) -> Dict:
         distribucion["personas_sin_gafas"]
     )
     
-    # Generar detecciones individuales (asumiendo distribución proporcional)
-    detecciones_individuales = generar_detecciones_individuales(conteo, distribucion)
-    
     return {
         "total_personas": conteo["personas"],
         "total_cascos": conteo["cascos"],
@@ -190,6 +223,172 @@ def generar_detecciones_individuales(conteo: Dict, distribucion: Dict) -> List[D
     return detecciones
 
 
+# ============================================================================
+# ASOCIACIÓN ESPACIAL PERSONA ↔ EPP
+# ============================================================================
+
+def extraer_cajas(model_1: Dict) -> Optional[Tuple[np.ndarray, List[str]]]:
+    """
+    Cajas (N, 4) en xyxy y sus clases desde la salida de model_1.
+    Acepta sv.Detections serializado ("xyxy" + data.class_name) o la lista
+    "predictions" de Roboflow (x, y centro + width, height).
+
+    Returns:
+        (cajas, clases) o None si no hay cajas alineadas con las clases
+    """
+    clases = list((model_1.get("data") or {}).get("class_name") or [])
+    try:
+        if model_1.get("xyxy") is not None:
+            cajas = np.asarray(model_1["xyxy"], dtype=np.float32).reshape(-1, 4)
+        elif isinstance(model_1.get("predictions"), list):
+            predicciones = model_1["predictions"]
+            centros = np.array([[p["x"], p["y"], p["width"], p["height"]] for p in predicciones],
+                               dtype=np.float32).reshape(-1, 4)
+            mitad = centros[:, 2:] / 2
+            cajas = np.concatenate([centros[:, :2] - mitad, centros[:, :2] + mitad], axis=1)
+            clases = clases or [p.get("class", "") for p in predicciones]
+        else:
+            return None
+    except (KeyError, TypeError, ValueError):
+        return None
+    if len(cajas) != len(clases):
+        return None
+    return cajas, clases
+
+
+def matrices_contencion(personas: np.ndarray, elementos: np.ndarray,
+                        regiones: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Matrices (personas × elementos) de contención (fracción del área del
+    elemento dentro de la zona de la persona) e IoU con esa zona.
+    `regiones` (E, 2) es la zona vertical de cada elemento (ver REGIONES_EPP).
+    """
+    alto = (personas[:, 3] - personas[:, 1])[:, None]
+    zona_x1 = personas[:, 0][:, None]
+    zona_x2 = personas[:, 2][:, None]
+    zona_y1 = personas[:, 1][:, None] + alto * regiones[:, 0]
+    zona_y2 = personas[:, 1][:, None] + alto * regiones[:, 1]
+    ancho_interseccion = np.minimum(zona_x2, elementos[:, 2]) - np.maximum(zona_x1, elementos[:, 0])
+    alto_interseccion = np.minimum(zona_y2, elementos[:, 3]) - np.maximum(zona_y1, elementos[:, 1])
+    interseccion = np.clip(ancho_interseccion, 0, None) * np.clip(alto_interseccion, 0, None)
+    area_elementos = (elementos[:, 2] - elementos[:, 0]) * (elementos[:, 3] - elementos[:, 1])
+    area_zonas = (zona_x2 - zona_x1) * (zona_y2 - zona_y1)
+    contencion = interseccion / np.maximum(area_elementos, 1e-6)
+    iou = interseccion / np.maximum(area_zonas + area_elementos - interseccion, 1e-6)
+    return contencion, iou
+
+
+def emparejar(puntajes: np.ndarray) -> np.ndarray:
+    """
+    Emparejamiento voraz por puntaje (cada persona recibe a lo sumo un
+    elemento y cada elemento va a una sola persona). En cada ronda se
+    asignan en bloque todos los pares que son el mejor mutuo; -inf = no
+    candidato. Da el mismo resultado que tomar los pares de mayor a menor.
+
+    Args:
+        puntajes: (P, E) o (T, P, E) para resolver T tipos de EPP a la vez
+
+    Returns:
+        Por persona (P,) o (T, P), el índice del elemento asignado o -1
+    """
+    lote = puntajes.reshape((int(np.prod(puntajes.shape[:-2])),) + puntajes.shape[-2:])
+    asignados = np.full(lote.shape[:2], -1, dtype=np.intp)
+    if lote.size == 0 or not np.isfinite(lote).any():
+        return asignados.reshape(puntajes.shape[:-1])
+
+    lote = lote.copy()
+    tipos = np.arange(lote.shape[0])[:, None]
+    filas = np.arange(lote.shape[1])[None, :]
+    while True:
+        mejor_elemento = lote.argmax(axis=2)                              # (T, P)
+        mejor_persona = lote.argmax(axis=1)                               # (T, E)
+        mutuos = (np.isfinite(lote[tipos, filas, mejor_elemento])
+                  & (np.take_along_axis(mejor_persona, mejor_elemento, axis=1) == filas))
+        if not mutuos.any():
+            return asignados.reshape(puntajes.shape[:-1])
+        t, p = np.nonzero(mutuos)
+        e = mejor_elemento[t, p]
+        asignados[t, p] = e
+        lote[t, p, :] = -np.inf
+        lote[t, :, e] = -np.inf
+
+
+def asociar_epp(model_1: Dict) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Asigna cada casco, chaleco y par de gafas a la persona que lo contiene.
+
+    Returns:
+        {"Persona": cajas de personas (P, 4), "Casco"/"Chaleco"/"Gafas":
+        índice (P,) de la caja asignada en model_1 o -1}, o None sin cajas
+    """
+    extraidas = extraer_cajas(model_1)
+    if extraidas is None:
+        return None
+    cajas, clases = extraidas
+    codigos = np.fromiter((_CODIGOS_CLASE.get(clase, -1) for clase in clases),
+                          dtype=np.intp, count=len(clases))
+    personas = cajas[codigos == 0]
+
+    # Una sola pasada persona × todos los EPP (cada columna con la zona de su tipo)
+    indices_epp = np.flatnonzero(codigos > 0)
+    tipo_epp = codigos[indices_epp] - 1
+    contencion, iou = matrices_contencion(personas, cajas[indices_epp], _REGIONES[tipo_epp])
+    puntajes = np.where(contencion >= UMBRAL_CONTENCION, contencion + PESO_IOU * iou, -np.inf)
+
+    # Separar por tipo en bloques (T, P, E_max) rellenos con -inf y emparejar todos juntos
+    conteos = np.bincount(tipo_epp, minlength=len(_TIPOS_EPP))
+    inicio_tipo = np.cumsum(conteos) - conteos
+    orden = np.argsort(tipo_epp, kind="stable")
+    columna = np.empty_like(tipo_epp)
+    columna[orden] = np.arange(len(orden)) - inicio_tipo[tipo_epp[orden]]
+    bloques = np.full((len(_TIPOS_EPP), len(personas), conteos.max(initial=0)), -np.inf)
+    bloques[tipo_epp, :, columna] = puntajes.T
+    caja_de_columna = np.full(bloques.shape[::2], -1, dtype=np.intp)
+    caja_de_columna[tipo_epp, columna] = indices_epp
+
+    asignados = emparejar(bloques)
+    if caja_de_columna.shape[1]:
+        # Columna del bloque → índice de la caja en model_1
+        asignados = np.where(asignados >= 0,
+                             np.take_along_axis(caja_de_columna, np.maximum(asignados, 0), axis=1), -1)
+    asociacion = {"Persona": personas}
+    asociacion.update(zip(_TIPOS_EPP, asignados))
+    return asociacion
+
+
+def distribucion_desde_asociacion(asociacion: Dict[str, np.ndarray]) -> Dict[str, int]:
+    """Como calcular_distribucion_personas, pero con el EPP asignado a cada persona"""
+    personas = len(asociacion["Persona"])
+    con_casco = int((asociacion["Casco"] >= 0).sum())
+    con_chaleco = int((asociacion["Chaleco"] >= 0).sum())
+    con_gafas = int((asociacion["Gafas"] >= 0).sum())
+    return {
+        "personas_con_casco": con_casco,
+        "personas_sin_casco": personas - con_casco,
+        "personas_con_chaleco": con_chaleco,
+        "personas_sin_chaleco": personas - con_chaleco,
+        "personas_con_gafas": con_gafas,
+        "personas_sin_gafas": personas - con_gafas
+    }
+
+
+def detecciones_desde_asociacion(asociacion: Dict[str, np.ndarray]) -> List[Dict]:
+    """Una detección por persona (en el orden de model_1) con su EPP real"""
+    tiene = np.stack([asociacion["Casco"] >= 0, asociacion["Chaleco"] >= 0,
+                      asociacion["Gafas"] >= 0], axis=1)
+    cumplimiento = np.round(tiene.sum(axis=1) / 3 * 100, 2)
+    return [
+        {
+            "numero_persona": i + 1,
+            "tiene_casco": bool(casco),
+            "tiene_chaleco": bool(chaleco),
+            "tiene_gafas": bool(gafas),
+            "cumplimiento_persona": float(porcentaje)
+        }
+        for i, ((casco, chaleco, gafas), porcentaje) in enumerate(zip(tiene.tolist(), cumplimiento.tolist()))
+    ]
+
+
 def crear_resultado_vacio() -> Dict:
     """Retorna un resultado vacío cuando no hay detecciones"""
     return {
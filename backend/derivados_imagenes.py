@@ -0,0 +1,183 @@
+"""
+Derivados de las imágenes de registros (miniatura y tamaño medio)
+El dashboard casi nunca necesita la imagen original: la tabla muestra
+miniaturas y el detalle una versión mediana. Los derivados se generan la
+primera vez que se piden y se guardan en una caché en disco:
+
+    cache_imagenes/<tamano>/<ruta de la original>.<jpg|webp>
+
+La caché tiene un tamaño máximo; al superarlo se borran los derivados
+usados hace más tiempo (LRU). Las imágenes de registros nunca cambian
+(el nombre es el ID del registro), así que un derivado tampoco caduca.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import cv2
+
+from backend.almacen_imagenes import BASE_DIR, PREFIJO_RUTA
+
+# Lado mayor (px) de cada tamaño; nunca se amplía una imagen más chica
+TAMANOS = {
+    "mini": 160,
+    "media": 640,
+}
+
+# Formato → (extensión, media type, parámetros de cv2.imencode)
+FORMATOS = {
+    "jpeg": (".jpg", "image/jpeg", [cv2.IMWRITE_JPEG_QUALITY, 80]),
+    "webp": (".webp", "image/webp", [cv2.IMWRITE_WEBP_QUALITY, 75]),
+}
+
+CACHE_DIR = os.path.join(BASE_DIR, "cache_imagenes")
+
+# Tamaño máximo de la caché de derivados
+MAX_MB_CACHE = 512
+
+# ETags calculados que se recuerdan (clave: ruta + mtime + tamaño)
+MAX_ETAGS_EN_MEMORIA = 10000
+
+
+def calcular_etag(ruta: str) -> str:
+    """ETag fuerte a partir del contenido del archivo (hash BLAKE2 de 16 bytes)"""
+    hash_contenido = hashlib.blake2b(digest_size=16)
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b""):
+            hash_contenido.update(bloque)
+    return f'"{hash_contenido.hexdigest()}"'
+
+
+class EtagsArchivos:
+    """
+    Recuerda el ETag de cada archivo mientras no cambie su mtime ni su
+    tamaño, para no volver a leerlo completo en cada petición.
+    """
+
+    def __init__(self, maximo: int = MAX_ETAGS_EN_MEMORIA):
+        self._maximo = maximo
+        self._etags: "OrderedDict[tuple, str]" = OrderedDict()  # (ruta, mtime_ns, tamaño) → ETag
+        self._lock = threading.Lock()
+
+    def obtener(self, ruta: str, info: Optional[os.stat_result] = None) -> str:
+        info = info or os.stat(ruta)
+        clave = (ruta, info.st_mtime_ns, info.st_size)
+        with self._lock:
+            etag = self._etags.get(clave)
+            if etag is not None:
+                self._etags.move_to_end(clave)
+                return etag
+        etag = calcular_etag(ruta)
+        with self._lock:
+            self._etags[clave] = etag
+            while len(self._etags) > self._maximo:
+                self._etags.popitem(last=False)
+        return etag
+
+
+class CacheDerivados:
+    """
+    Caché LRU en disco de derivados de imágenes.
+
+    Uso:
+        cache = CacheDerivados()
+        ruta = cache.obtener(ruta_original, "registros/2025/11/02/cam1/00000123.jpg",
+                             "mini", "webp")
+    """
+
+    def __init__(self, carpeta: str = CACHE_DIR, max_mb: float = MAX_MB_CACHE):
+        self.carpeta = carpeta
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._entradas: Optional["OrderedDict[str, int]"] = None  # ruta → bytes, del menos al más usado
+        self._total = 0
+        self._lock = threading.Lock()
+        self._generando: Dict[str, threading.Lock] = {}
+
+    def _ruta_derivado(self, ruta_relativa: str, tamano: str, formato: str) -> str:
+        ruta_relativa = ruta_relativa.replace("\\", "/")
+        if ruta_relativa.startswith(PREFIJO_RUTA):
+            ruta_relativa = ruta_relativa[len(PREFIJO_RUTA):]
+        base, _ = os.path.splitext(ruta_relativa)
+        return os.path.join(self.carpeta, tamano, *base.split("/")) + FORMATOS[formato][0]
+
+    def _cargar_indice(self):
+        """Lee la caché existente al primer uso (los más viejos por mtime, primero)"""
+        archivos = []
+        for raiz, _, nombres in os.walk(self.carpeta):
+            for nombre in nombres:
+                ruta = os.path.join(raiz, nombre)
+                try:
+                    info = os.stat(ruta)
+                except FileNotFoundError:
+                    continue
+                archivos.append((info.st_mtime, ruta, info.st_size))
+        archivos.sort()
+        self._entradas = OrderedDict((ruta, tamano) for _, ruta, tamano in archivos)
+        self._total = sum(self._entradas.values())
+
+    def obtener(self, ruta_original: str, ruta_relativa: str, tamano: str, formato: str) -> str:
+        """
+        Ruta del derivado en disco, generándolo si todavía no existe.
+
+        Raises:
+            ValueError: Si la imagen original no se puede decodificar
+        """
+        destino = self._ruta_derivado(ruta_relativa, tamano, formato)
+        with self._lock:
+            if self._entradas is None:
+                self._cargar_indice()
+            if destino in self._entradas and os.path.exists(destino):
+                self._entradas.move_to_end(destino)
+                return destino
+            generando = self._generando.setdefault(destino, threading.Lock())
+
+        # Un derivado pedido por varias peticiones a la vez se genera una sola vez
+        with generando:
+            if not os.path.exists(destino):
+                self._generar(ruta_original, destino, tamano, formato)
+            bytes_derivado = os.path.getsize(destino)
+
+        with self._lock:
+            self._generando.pop(destino, None)
+            self._total += bytes_derivado - self._entradas.pop(destino, 0)
+            self._entradas[destino] = bytes_derivado
+            self._desalojar(conservar=destino)
+        return destino
+
+    def _generar(self, ruta_original: str, destino: str, tamano: str, formato: str):
+        imagen = cv2.imread(ruta_original, cv2.IMREAD_COLOR)
+        if imagen is None:
+            raise ValueError(f"No se pudo leer la imagen {ruta_original}")
+
+        alto, ancho = imagen.shape[:2]
+        escala = TAMANOS[tamano] / max(alto, ancho)
+        if escala < 1:
+            imagen = cv2.resize(imagen, (max(1, round(ancho * escala)), max(1, round(alto * escala))),
+                                interpolation=cv2.INTER_AREA)
+
+        extension, _, parametros = FORMATOS[formato]
+        ok, codificada = cv2.imencode(extension, imagen, parametros)
+        if not ok:
+            raise ValueError(f"No se pudo codificar el derivado {formato}")
+
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        temporal = f"{destino}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporal, "wb") as f:
+            f.write(codificada.tobytes())
+        os.replace(temporal, destino)
+
+    def _desalojar(self, conservar: str):
+        """Borra los derivados menos usados hasta volver bajo el máximo (con el lock tomado)"""
+        while self._total > self.max_bytes and len(self._entradas) > 1:
+            ruta, bytes_derivado = next(iter(self._entradas.items()))
+            if ruta == conservar:
+                self._entradas.move_to_end(ruta)
+                continue
+            del self._entradas[ruta]
+            self._total -= bytes_derivado
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
@@ -0,0 +1,135 @@
+"""
+Difusor de eventos en tiempo real (Server-Sent Events)
+Los endpoints publican eventos compactos (registro nuevo, borrado, cámara)
+y cada dashboard suscrito los recibe por GET /api/eventos.
+
+Cada cliente tiene su propio buffer acotado: si un cliente lento lo llena,
+se vacía su buffer y se le envía un único evento "resync" (el dashboard
+pide entonces un delta con since_id). Así un cliente lento nunca frena
+a los demás ni hace crecer la memoria del servidor.
+"""
+import asyncio
+import itertools
+import json
+import threading
+from typing import AsyncIterator, Dict, Optional, Set
+
+# Eventos en espera por cliente
+TAMANO_BUFFER_CLIENTE = 100
+
+# Segundos sin eventos tras los que se envía un comentario (mantiene viva la conexión)
+INTERVALO_LATIDO = 15
+
+EVENTO_RESYNC = "resync"
+
+
+class Suscripcion:
+    """Buffer acotado de un cliente conectado"""
+
+    def __init__(self, tamano_buffer: int):
+        self.cola = asyncio.Queue(maxsize=tamano_buffer)
+        self.descartados = 0
+
+    def entregar(self, evento: Optional[str]):
+        """Encola un evento ya formateado (solo desde el hilo del event loop)"""
+        try:
+            self.cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            # Cliente lento: se descarta lo pendiente y se le pide resincronizar
+            self.descartados += self.cola.qsize()
+            while not self.cola.empty():
+                self.cola.get_nowait()
+            self.cola.put_nowait(formatear_evento(EVENTO_RESYNC, {}))
+            if evento is None:
+                self.cola.put_nowait(None)
+
+
+def formatear_evento(tipo: str, datos: Dict, evento_id: Optional[int] = None) -> str:
+    """Formato de texto SSE: id / event / data + línea en blanco"""
+    lineas = []
+    if evento_id is not None:
+        lineas.append(f"id: {evento_id}")
+    lineas.append(f"event: {tipo}")
+    lineas.append(f"data: {json.dumps(datos, ensure_ascii=False, separators=(',', ':'))}")
+    return "\n".join(lineas) + "\n\n"
+
+
+class DifusorEventos:
+    """
+    Fan-out en proceso de eventos hacia los clientes SSE.
+
+    Uso:
+        difusor.vincular_loop(asyncio.get_running_loop())   # al iniciar el servidor
+        difusor.publicar("registro_nuevo", {"id": 12, ...}) # desde endpoints o hilos
+    """
+
+    def __init__(self, tamano_buffer: int = TAMANO_BUFFER_CLIENTE):
+        self.tamano_buffer = tamano_buffer
+        self._suscripciones: Set[Suscripcion] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._contador = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def vincular_loop(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    @property
+    def clientes(self) -> int:
+        return len(self._suscripciones)
+
+    def suscribir(self) -> Suscripcion:
+        suscripcion = Suscripcion(self.tamano_buffer)
+        self._suscripciones.add(suscripcion)
+        return suscripcion
+
+    def desuscribir(self, suscripcion: Suscripcion):
+        self._suscripciones.discard(suscripcion)
+
+    def publicar(self, tipo: str, datos: Dict):
+        """
+        Publica un evento a todos los clientes. Se puede llamar desde el
+        event loop o desde cualquier hilo (pool de imágenes, escritor BD).
+        """
+        if self._loop is None or self._loop.is_closed():
+            return
+        with self._lock:
+            evento = formatear_evento(tipo, datos, next(self._contador))
+
+        try:
+            en_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            en_loop = False
+
+        if en_loop:
+            self._repartir(evento)
+        else:
+            self._loop.call_soon_threadsafe(self._repartir, evento)
+
+    def _repartir(self, evento: Optional[str]):
+        # Nunca espera: entregar() es put_nowait sobre el buffer de cada cliente
+        for suscripcion in list(self._suscripciones):
+            suscripcion.entregar(evento)
+
+    async def escuchar(self, suscripcion: Suscripcion) -> AsyncIterator[str]:
+        """Genera el texto SSE de un cliente hasta que se cierre el difusor"""
+        try:
+            while True:
+                try:
+                    evento = await asyncio.wait_for(suscripcion.cola.get(), INTERVALO_LATIDO)
+                except asyncio.TimeoutError:
+                    yield ": latido\n\n"
+                    continue
+                if evento is None:
+                    break
+                yield evento
+        finally:
+            self.desuscribir(suscripcion)
+
+    def cerrar(self):
+        """Termina todas las conexiones abiertas (al apagar el servidor)"""
+        if self._loop is not None and not self._loop.is_closed():
+            self._repartir(None)
+
+
+# Instancia compartida del servidor
+difusor = DifusorEventos()
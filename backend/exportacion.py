@@ -0,0 +1,163 @@
+"""
+Exportación de registros con sus detecciones por persona
+Genera el archivo por partes (CSV, NDJSON o Parquet) a medida que se leen
+lotes de la BD, para enviarlo como respuesta en streaming: la memoria no
+depende de cuántos registros se exporten.
+
+- CSV / Parquet: una fila por persona (registro + persona, como un LEFT JOIN;
+  los registros sin personas salen en una fila con las columnas de persona vacías)
+- NDJSON: una línea por registro con sus personas anidadas en "personas"
+"""
+import csv
+import io
+import json
+from typing import Dict, Iterator, List, Optional
+
+from backend.BD.operaciones_bd import (
+    obtener_lote_exportacion,
+    CAMPOS_EXPORTACION,
+    CAMPOS_PERSONA
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet es opcional (pip install pyarrow)
+    pa = None
+    pq = None
+
+# Registros leídos de la BD por lote
+TAMANO_LOTE_EXPORTACION = 1000
+
+# Formato → (media type, extensión)
+FORMATOS_EXPORTACION = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+COLUMNAS_FILA = CAMPOS_EXPORTACION + CAMPOS_PERSONA
+
+# Columnas de texto y decimales (el resto son enteros) para el esquema Parquet
+COLUMNAS_TEXTO = {"fecha_hora", "camera_id", "ruta_imagen", "estado_imagen", "creado_en",
+                  "ultima_repeticion"}
+COLUMNAS_DECIMALES = {"cumplimiento_general", "cumplimiento_casco", "cumplimiento_chaleco",
+                      "cumplimiento_gafas", "cumplimiento_persona"}
+
+
+def parquet_disponible() -> bool:
+    return pa is not None
+
+
+def recorrer_lotes(desde: Optional[int] = None, hasta: Optional[int] = None,
+                   camara: Optional[str] = None,
+                   tamano: int = TAMANO_LOTE_EXPORTACION) -> Iterator[tuple]:
+    """
+    Genera (registros, personas) lote a lote hasta agotar el rango.
+    desde / hasta: epoch inclusivos (ya validados con fecha_a_epoch)
+    """
+    cursor = (desde - 1, 2 ** 62) if desde is not None else (-1, -1)
+    while True:
+        registros, personas = obtener_lote_exportacion(cursor, hasta, camara, tamano)
+        if not registros:
+            return
+        yield registros, personas
+        cursor = (registros[-1]["fecha_epoch"], registros[-1]["id"])
+
+
+def _filas(registros: List[Dict], personas: Dict[int, List[Dict]]) -> Iterator[Dict]:
+    """Registro × persona (un registro sin personas da una fila sin datos de persona)"""
+    vacia = dict.fromkeys(CAMPOS_PERSONA)
+    for registro in registros:
+        for persona in personas.get(registro["id"]) or [vacia]:
+            yield {**registro, **persona}
+
+
+def exportar_csv(lotes: Iterator[tuple]) -> Iterator[bytes]:
+    salida = io.StringIO()
+    escritor = csv.DictWriter(salida, fieldnames=COLUMNAS_FILA, extrasaction="ignore")
+    escritor.writeheader()
+    for registros, personas in lotes:
+        escritor.writerows(_filas(registros, personas))
+        yield salida.getvalue().encode("utf-8")
+        salida.seek(0)
+        salida.truncate()
+    if salida.tell():
+        yield salida.getvalue().encode("utf-8")
+
+
+def exportar_ndjson(lotes: Iterator[tuple]) -> Iterator[bytes]:
+    for registros, personas in lotes:
+        yield "".join(
+            json.dumps({**registro, "personas": personas.get(registro["id"], [])},
+                       ensure_ascii=False, separators=(",", ":")) + "\n"
+            for registro in registros
+        ).encode("utf-8")
+
+
+class _SalidaEnMemoria(io.RawIOBase):
+    """Archivo de solo escritura que acumula bytes hasta que se retiran"""
+
+    def __init__(self):
+        self._partes: List[bytes] = []
+        self._posicion = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, datos) -> int:
+        self._partes.append(bytes(datos))
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self) -> int:
+        return self._posicion
+
+    def retirar(self) -> bytes:
+        datos = b"".join(self._partes)
+        self._partes.clear()
+        return datos
+
+
+def _esquema_parquet():
+    campos = []
+    for columna in COLUMNAS_FILA:
+        if columna in COLUMNAS_TEXTO:
+            tipo = pa.string()
+        elif columna in COLUMNAS_DECIMALES:
+            tipo = pa.float64()
+        else:
+            tipo = pa.int64()
+        campos.append(pa.field(columna, tipo))
+    return pa.schema(campos)
+
+
+def exportar_parquet(lotes: Iterator[tuple]) -> Iterator[bytes]:
+    """
+    Parquet columnar: cada lote se escribe como un row group y sus bytes se
+    envían de inmediato; el footer sale al final.
+    """
+    if pa is None:
+        raise RuntimeError("Exportar a Parquet requiere pyarrow (pip install pyarrow)")
+
+    esquema = _esquema_parquet()
+    salida = _SalidaEnMemoria()
+    escritor = pq.ParquetWriter(salida, esquema, compression="zstd")
+    try:
+        for registros, personas in lotes:
+            columnas = {columna: [] for columna in COLUMNAS_FILA}
+            for fila in _filas(registros, personas):
+                for columna in COLUMNAS_FILA:
+                    columnas[columna].append(fila.get(columna))
+            escritor.write_table(pa.Table.from_pydict(columnas, schema=esquema))
+            yield salida.retirar()
+    finally:
+        escritor.close()
+    yield salida.retirar()
+
+
+EXPORTADORES = {
+    "csv": exportar_csv,
+    "ndjson": exportar_ndjson,
+    "parquet": exportar_parquet,
+}
@@ -0,0 +1,85 @@
+"""
+Guardado de imágenes en segundo plano
+El registro se inserta y se responde de inmediato; la imagen se decodifica
+y escribe en un pool de hilos acotado. Al terminar se avisa con
+(registro_id, ruta_imagen, estado_imagen) para actualizar la BD.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from backend.metricas import metricas
+
+# Estados posibles de registros.estado_imagen
+ESTADO_PENDIENTE = "pendiente"
+ESTADO_OK = "ok"
+ESTADO_ERROR = "error"
+ESTADO_SIN_IMAGEN = "sin_imagen"
+ESTADO_EXPIRADA = "expirada"   # Borrada por la política de retención
+ESTADO_PERDIDA = "perdida"     # El archivo desapareció del disco
+
+# Hilos que escriben imágenes en paralelo
+MAX_HILOS_IMAGENES = 2
+
+# Imágenes en espera como máximo (acota la memoria si el disco va lento)
+MAX_IMAGENES_PENDIENTES = 64
+
+DURACION_ESCRITURA = metricas.histograma(
+    "epp_api_imagen_escritura_segundos", "Decodificación y escritura de cada imagen en disco")
+IMAGENES_DESCARTADAS = metricas.contador(
+    "epp_api_imagenes_descartadas_total", "Imágenes no guardadas porque el pool estaba saturado")
+
+
+class GuardadorImagenes:
+    """
+    Pool acotado para escribir imágenes fuera del event loop.
+
+    Uso:
+        guardador = GuardadorImagenes(al_terminar=actualizar_imagen_registro)
+        guardador.programar(registro_id, lambda: jpg_bytes_a_archivo(...))
+    """
+
+    def __init__(self, al_terminar: Callable[[int, str, str], None],
+                 max_hilos: int = MAX_HILOS_IMAGENES,
+                 max_pendientes: int = MAX_IMAGENES_PENDIENTES):
+        self._al_terminar = al_terminar
+        self._pool = ThreadPoolExecutor(max_workers=max_hilos, thread_name_prefix="imagenes")
+        self._cupos = threading.BoundedSemaphore(max_pendientes)
+
+    def programar(self, registro_id: int, guardar: Callable[[], Optional[str]]) -> bool:
+        """
+        Encola el guardado de la imagen de un registro.
+
+        Args:
+            registro_id: ID del registro ya insertado
+            guardar: Función sin argumentos que escribe la imagen y retorna su ruta
+
+        Returns:
+            True si se encoló, False si el pool está saturado
+        """
+        if not self._cupos.acquire(blocking=False):
+            IMAGENES_DESCARTADAS.inc()
+            print(f"⚠️ Cola de imágenes llena, imagen del registro {registro_id} descartada")
+            return False
+        self._pool.submit(self._guardar, registro_id, guardar)
+        return True
+
+    def _guardar(self, registro_id: int, guardar: Callable[[], Optional[str]]):
+        try:
+            with DURACION_ESCRITURA.cronometrar():
+                ruta_imagen = guardar() or ""
+        except Exception as e:
+            print(f"❌ Error guardando imagen del registro {registro_id}: {e}")
+            ruta_imagen = ""
+        finally:
+            self._cupos.release()
+
+        estado = ESTADO_OK if ruta_imagen else ESTADO_ERROR
+        try:
+            self._al_terminar(registro_id, ruta_imagen, estado)
+        except Exception as e:
+            print(f"❌ No se pudo actualizar la imagen del registro {registro_id}: {e}")
+
+    def cerrar(self):
+        """Espera a que terminen las imágenes en curso"""
+        self._pool.shutdown(wait=True)
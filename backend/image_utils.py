@@ -9,21 +9,30 @@ from typing import Optional
 import numpy as np
 import cv2
 
-# Ruta de la carpeta registros (un nivel arriba de backend)
-BACKEND_DIR = os.path.dirname(os.path.dirname(__file__))
-REGISTROS_DIR = os.path.join(BACKEND_DIR, "registros")
+from backend.almacen_imagenes import REGISTROS_DIR, ruta_relativa_imagen, escribir_atomico
 
 # Crear carpeta si no existe
 os.makedirs(REGISTROS_DIR, exist_ok=True)
 
 
-def numpy_array_a_jpg(numpy_array: list, fecha_hora: str) -> str:
+def _codificar_jpg(img_array: np.ndarray) -> bytes:
+    """Codifica un array BGR a JPEG en memoria (se escribe luego de forma atómica)"""
+    ok, buffer = cv2.imencode(".jpg", img_array)
+    if not ok:
+        raise ValueError("No se pudo codificar la imagen a JPEG")
+    return buffer.tobytes()
+
+
+def numpy_array_a_jpg(numpy_array: list, registro_id: int, fecha_hora: str,
+                      camara: Optional[str] = None) -> str:
     """
     Convierte un numpy array (lista) a imagen JPG y la guarda.
     
     Args:
         numpy_array: Lista de píxeles (viene del JSON serializado)
+        registro_id: ID del registro (nombre único del archivo)
         fecha_hora: Fecha y hora del registro (formato ISO)
+        camara: Cámara de origen (subcarpeta)
     
     Returns:
         Ruta relativa donde se guardó la imagen
@@ -32,29 +41,25 @@ def numpy_array_a_jpg(numpy_array: list, fecha_hora: str) -> str:
         # Convertir lista a numpy array
         img_array = np.array(numpy_array, dtype=np.uint8)
         
-        # Crear nombre de archivo basado en fecha
-        fecha_obj = datetime.fromisoformat(fecha_hora.replace('Z', '+00:00'))
-        nombre_archivo = f"IMAGE_{fecha_obj.strftime('%Y%m%d_%H%M%S')}.jpg"
-        ruta_completa = os.path.join(REGISTROS_DIR, nombre_archivo)
-        
-        # Guardar imagen
-        cv2.imwrite(ruta_completa, img_array)
-        
-        # Retornar ruta relativa
-        return f"registros/{nombre_archivo}"
+        # Guardar imagen y retornar ruta relativa
+        ruta = ruta_relativa_imagen(registro_id, fecha_hora, camara)
+        return escribir_atomico(ruta, _codificar_jpg(img_array))
         
     except Exception as e:
         print(f"❌ Error guardando imagen: {e}")
         return ""
 
 
-def base64_a_jpg(base64_string: str, fecha_hora: str) -> str:
+def base64_a_jpg(base64_string: str, registro_id: int, fecha_hora: str,
+                 camara: Optional[str] = None) -> str:
     """
     Convierte una imagen en base64 a JPG y la guarda.
     
     Args:
         base64_string: String en base64 de la imagen
+        registro_id: ID del registro (nombre único del archivo)
         fecha_hora: Fecha y hora del registro (formato ISO)
+        camara: Cámara de origen (subcarpeta)
     
     Returns:
         Ruta relativa donde se guardó la imagen
@@ -67,26 +72,71 @@ def base64_a_jpg(base64_string: str, fecha_hora: str) -> str:
         # Decodificar base64
         img_data = base64.b64decode(base64_string)
         
-        # Crear nombre de archivo
-        fecha_obj = datetime.fromisoformat(fecha_hora.replace('Z', '+00:00'))
-        nombre_archivo = f"IMAGE_{fecha_obj.strftime('%Y%m%d_%H%M%S')}.jpg"
-        ruta_completa = os.path.join(REGISTROS_DIR, nombre_archivo)
+        # Guardar imagen y retornar ruta relativa
+        ruta = ruta_relativa_imagen(registro_id, fecha_hora, camara)
+        return escribir_atomico(ruta, img_data)
         
-        # Guardar imagen
-        with open(ruta_completa, 'wb') as f:
-            f.write(img_data)
+    except Exception as e:
+        print(f"❌ Error guardando imagen desde base64: {e}")
+        return ""
+
+
+def jpg_bytes_a_archivo(imagen_jpg: bytes, registro_id: int, fecha_hora: str,
+                        camara: Optional[str] = None) -> str:
+    """
+    Guarda una imagen que ya viene codificada en JPEG (transporte binario).
+    No decodifica ni recodifica: escribe el buffer tal cual.
+    
+    Args:
+        imagen_jpg: Bytes JPEG recibidos en el multipart
+        registro_id: ID del registro (nombre único del archivo)
+        fecha_hora: Fecha y hora del registro (formato ISO)
+        camara: Cámara de origen (subcarpeta)
+    
+    Returns:
+        Ruta relativa donde se guardó la imagen
+    """
+    try:
+        ruta = ruta_relativa_imagen(registro_id, fecha_hora, camara)
+        return escribir_atomico(ruta, imagen_jpg)
+        
+    except Exception as e:
+        print(f"❌ Error guardando imagen JPEG: {e}")
+        return ""
+
+
+def frame_crudo_a_jpg(buffer: bytes, forma: list, dtype: str, registro_id: int,
+                      fecha_hora: str, camara: Optional[str] = None) -> str:
+    """
+    Guarda un frame enviado como buffer crudo contiguo (shape + dtype).
+    Se reconstruye con np.frombuffer, sin crear objetos Python por píxel.
+    
+    Args:
+        buffer: Bytes del array original (ndarray.tobytes())
+        forma: Shape del array, ej. [1080, 1920, 3]
+        dtype: Tipo del array, ej. "uint8"
+        registro_id: ID del registro (nombre único del archivo)
+        fecha_hora: Fecha y hora del registro (formato ISO)
+        camara: Cámara de origen (subcarpeta)
+    
+    Returns:
+        Ruta relativa donde se guardó la imagen
+    """
+    try:
+        img_array = np.frombuffer(buffer, dtype=np.dtype(dtype)).reshape(forma)
         
-        # Retornar ruta relativa
-        return f"registros/{nombre_archivo}"
+        ruta = ruta_relativa_imagen(registro_id, fecha_hora, camara)
+        return escribir_atomico(ruta, _codificar_jpg(img_array))
         
     except Exception as e:
-        print(f"❌ Error guardando imagen desde base64: {e}")
+        print(f"❌ Error guardando frame crudo: {e}")
         return ""
 
 
-def extraer_imagen_del_output(output_roboflow: dict) -> Optional[str]:
+def extraer_imagen_del_output(output_roboflow: dict, registro_id: int) -> Optional[str]:
     """
     Extrae la imagen del output de Roboflow en el formato que esté disponible.
+    Se guarda con el ID del registro como nombre (ver almacen_imagenes.py).
     
     Prioridad:
     1. _numpy_image (lista de píxeles)
@@ -104,17 +154,18 @@ def extraer_imagen_del_output(output_roboflow: dict) -> Optional[str]:
     fecha_hora = output_roboflow.get("output_image", {}).get(
         "_video_metadata", {}
     ).get("frame_timestamp", datetime.now().isoformat())
+    camara = output_roboflow.get("camera_id")
     
     # Intentar desde numpy array (ya convertido a lista)
     if "_numpy_image" in output_image and output_image["_numpy_image"]:
         numpy_array = output_image["_numpy_image"]
         if isinstance(numpy_array, list):
-            return numpy_array_a_jpg(numpy_array, fecha_hora)
+            return numpy_array_a_jpg(numpy_array, registro_id, fecha_hora, camara)
     
     # Intentar desde base64
     if "_base64_image" in output_image and output_image["_base64_image"]:
         base64_str = output_image["_base64_image"]
         if isinstance(base64_str, str) and base64_str:
-            return base64_a_jpg(base64_str, fecha_hora)
+            return base64_a_jpg(base64_str, registro_id, fecha_hora, camara)
     
     return None
@@ -0,0 +1,247 @@
+"""
+Métricas en formato de texto de Prometheus
+Contadores, medidores e histogramas en memoria, sin dependencias externas.
+Cada proceso tiene su propio registro (`metricas`):
+
+- servidor_api.py los expone en GET /metrics
+- main.py (captura) los expone con servir_metricas(), un servidor HTTP
+  mínimo en un thread aparte
+
+Uso:
+    from backend.metricas import metricas
+
+    PETICIONES = metricas.contador("epp_peticiones_total", "Peticiones", ["ruta"])
+    DURACION = metricas.histograma("epp_duracion_segundos", "Duración", ["ruta"])
+
+    PETICIONES.inc(ruta="/api/registros")
+    with DURACION.cronometrar(ruta="/api/registros"):
+        ...
+"""
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence
+
+TIPO_CONTENIDO = "text/plain; version=0.0.4; charset=utf-8"
+
+# Límites (segundos) por defecto de los histogramas: de 1 ms a 10 s
+LIMITES_POR_DEFECTO = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _formatear_etiquetas(nombres: Sequence[str], valores: Sequence, extra: str = "") -> str:
+    partes = [f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _formatear_numero(valor: float) -> str:
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = (),
+                 funcion: Optional[Callable[[], float]] = None):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._funcion = funcion  # Valor calculado al exponer (sin etiquetas)
+        self._valores: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _iniciar_sin_etiquetas(self):
+        """Las métricas sin etiquetas se exponen desde el inicio (en 0)"""
+        if not self.etiquetas and self._funcion is None:
+            self._valores[()] = self._valor_inicial()
+
+    def _valor_inicial(self):
+        return 0
+
+    def _clave(self, etiquetas: Dict) -> tuple:
+        if set(etiquetas) != set(self.etiquetas):
+            raise ValueError(f"{self.nombre} espera las etiquetas {self.etiquetas}, "
+                             f"recibió {tuple(etiquetas)}")
+        return tuple(str(etiquetas[nombre]) for nombre in self.etiquetas)
+
+    def _lineas_valores(self) -> List[str]:
+        if self._funcion is not None:
+            return [f"{self.nombre} {_formatear_numero(self._funcion())}"]
+        with self._lock:
+            valores = list(self._valores.items())
+        return [f"{self.nombre}{_formatear_etiquetas(self.etiquetas, clave)} {_formatear_numero(valor)}"
+                for clave, valor in valores]
+
+    def exponer(self) -> List[str]:
+        return [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}",
+                *self._lineas_valores()]
+
+
+class Contador(_Metrica):
+    """Valor que solo crece (eventos, bytes, errores)"""
+    tipo = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._iniciar_sin_etiquetas()
+
+    def inc(self, cantidad: float = 1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+
+class Medidor(_Metrica):
+    """Valor que sube y baja (tamaño de una cola, bytes pendientes)"""
+    tipo = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._iniciar_sin_etiquetas()
+
+    def set(self, valor: float, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = valor
+
+
+class _Serie:
+    __slots__ = ("cubetas", "suma", "cuenta")
+
+    def __init__(self, cantidad_cubetas: int):
+        self.cubetas = [0] * cantidad_cubetas
+        self.suma = 0.0
+        self.cuenta = 0
+
+
+class Histograma(_Metrica):
+    """Distribución de duraciones (u otros valores) en cubetas acumuladas"""
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = (),
+                 limites: Sequence[float] = LIMITES_POR_DEFECTO):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.limites = tuple(sorted(limites)) + (float("inf"),)
+        self._iniciar_sin_etiquetas()
+
+    def _valor_inicial(self):
+        return _Serie(len(self.limites))
+
+    def observar(self, valor: float, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            serie = self._valores.get(clave)
+            if serie is None:
+                serie = self._valores[clave] = self._valor_inicial()
+            for i, limite in enumerate(self.limites):
+                if valor <= limite:
+                    serie.cubetas[i] += 1
+                    break
+            serie.suma += valor
+            serie.cuenta += 1
+
+    @contextmanager
+    def cronometrar(self, **etiquetas):
+        """Observa la duración (segundos) del bloque `with`"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **etiquetas)
+
+    def _lineas_valores(self) -> List[str]:
+        with self._lock:
+            series = [(clave, list(serie.cubetas), serie.suma, serie.cuenta)
+                      for clave, serie in self._valores.items()]
+        lineas = []
+        for clave, cubetas, suma, cuenta in series:
+            acumulado = 0
+            for limite, cantidad in zip(self.limites, cubetas):
+                acumulado += cantidad
+                etiquetas = _formatear_etiquetas(self.etiquetas, clave,
+                                                 f'le="{_formatear_numero(limite)}"')
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {acumulado}")
+            etiquetas = _formatear_etiquetas(self.etiquetas, clave)
+            lineas.append(f"{self.nombre}_sum{etiquetas} {_formatear_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{etiquetas} {cuenta}")
+        return lineas
+
+
+class RegistroMetricas:
+    """Conjunto de métricas de un proceso (un nombre → una métrica)"""
+
+    def __init__(self):
+        self._metricas: Dict[str, _Metrica] = {}
+        self._lock = threading.Lock()
+
+    def _registrar(self, metrica: _Metrica) -> _Metrica:
+        with self._lock:
+            existente = self._metricas.get(metrica.nombre)
+            if existente is not None:
+                # Módulos importados dos veces (ej. por reload) reciben la misma métrica
+                return existente
+            self._metricas[metrica.nombre] = metrica
+            return metrica
+
+    def contador(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = (),
+                 funcion: Optional[Callable[[], float]] = None) -> Contador:
+        return self._registrar(Contador(nombre, ayuda, etiquetas, funcion))
+
+    def medidor(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = (),
+                funcion: Optional[Callable[[], float]] = None) -> Medidor:
+        return self._registrar(Medidor(nombre, ayuda, etiquetas, funcion))
+
+    def histograma(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = (),
+                   limites: Sequence[float] = LIMITES_POR_DEFECTO) -> Histograma:
+        return self._registrar(Histograma(nombre, ayuda, etiquetas, limites))
+
+    def exponer(self) -> str:
+        """Todas las métricas en formato de texto de Prometheus"""
+        with self._lock:
+            metricas = list(self._metricas.values())
+        lineas = []
+        for metrica in metricas:
+            try:
+                lineas.extend(metrica.exponer())
+            except Exception as e:
+                # Un medidor calculado que falla no debe tumbar el resto
+                lineas.append(f"# ERROR {metrica.nombre}: {_escapar(e)}")
+        return "\n".join(lineas) + "\n"
+
+
+metricas = RegistroMetricas()
+
+
+def servir_metricas(puerto: int, host: str = "0.0.0.0",
+                    registro: RegistroMetricas = metricas) -> ThreadingHTTPServer:
+    """
+    Sirve GET /metrics en un thread aparte (para procesos sin FastAPI,
+    como la captura). Retorna el servidor (servidor.shutdown() lo detiene).
+    """
+    class _Manejador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            cuerpo = registro.exponer().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", TIPO_CONTENIDO)
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, formato, *args):
+            pass  # Sin una línea en consola por cada scrape
+
+    servidor = ThreadingHTTPServer((host, puerto), _Manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="metricas", daemon=True).start()
+    return servidor
@@ -0,0 +1,295 @@
+"""
+Política de retención de registros e imágenes
+Sin retención la tabla registros y la carpeta registros/ crecen para
+siempre (un frame cada ~5 s por cámara). Cada ciclo, en segundo plano:
+
+1. Borra los registros más antiguos que DIAS_REGISTROS
+2. Borra las imágenes más antiguas que DIAS_IMAGENES (el registro se queda,
+   con estado_imagen = "expirada")
+3. Recolecta huérfanos: archivos sin registro y registros sin archivo
+4. Si las imágenes superan MAX_GB_IMAGENES, borra las más antiguas hasta
+   volver bajo el límite
+
+Todo se hace de lo más antiguo a lo más nuevo, en lotes cortos (el escritor
+de la BD sigue atendiendo la ingesta entre lote y lote). Los rollups de
+hora/día/total no se corrigen: las estadísticas históricas se conservan
+aunque sus registros ya no existan.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from backend.BD.operaciones_bd import (
+    eliminar_registros_antiguos,
+    eliminar_tracks_antiguos,
+    quitar_imagenes_antiguas,
+    obtener_registros_con_imagen,
+    obtener_rutas_por_ids,
+    obtener_rutas_antiguas,
+    marcar_imagenes_faltantes,
+    cerrar_imagenes_pendientes,
+    liberar_espacio
+)
+from backend.almacen_imagenes import (
+    MedidorAlmacen,
+    recorrer_imagenes,
+    resolver_ruta,
+    eliminar_carpetas_vacias
+)
+from backend.guardado_imagenes import ESTADO_EXPIRADA, ESTADO_PERDIDA, ESTADO_ERROR
+from backend.trabajos import Trabajo
+
+# ============================================================================
+# CONFIGURACIÓN (0 desactiva la regla)
+# ============================================================================
+DIAS_IMAGENES = 14
+DIAS_REGISTROS = 365
+MAX_GB_IMAGENES = 20
+
+# Segundos entre ciclos de retención
+INTERVALO_RETENCION = 10 * 60
+
+# La recolección de huérfanos recorre todo el disco: se hace con menos frecuencia
+INTERVALO_HUERFANOS = 6 * 60 * 60
+
+# Registros / imágenes por transacción
+TAMANO_LOTE_RETENCION = 500
+
+# Archivos más nuevos que esto no se tocan (su registro puede estar insertándose)
+ANTIGUEDAD_MINIMA_HUERFANO = 10 * 60
+
+# Minutos tras los que una imagen que sigue "pendiente" se da por perdida
+MINUTOS_IMAGEN_PENDIENTE = 60
+
+HILOS_BORRADO = 4
+PAGINAS_VACUUM_POR_PASO = 2000
+
+
+def _borrar_archivo(ruta_relativa: str) -> int:
+    """Borra una imagen. Retorna los bytes liberados (0 si no existía)"""
+    ruta = resolver_ruta(ruta_relativa)
+    if ruta is None:
+        return 0
+    try:
+        tamano = os.path.getsize(ruta)
+        os.remove(ruta)
+        return tamano
+    except FileNotFoundError:
+        return 0
+    except OSError as e:
+        print(f"⚠️ No se pudo eliminar {ruta_relativa}: {e}")
+        return 0
+
+
+class PoliticaRetencion:
+    """
+    Ejecuta un ciclo completo de retención. Se lanza como trabajo
+    (GestorTrabajos) para que su progreso se vea en /api/trabajos.
+
+    Uso:
+        politica = PoliticaRetencion()
+        gestor.iniciar("retencion", politica.ejecutar)
+    """
+
+    def __init__(self, dias_imagenes: int = DIAS_IMAGENES,
+                 dias_registros: int = DIAS_REGISTROS,
+                 max_gb_imagenes: float = MAX_GB_IMAGENES,
+                 intervalo_huerfanos: int = INTERVALO_HUERFANOS,
+                 al_eliminar: Optional[Callable[[int], None]] = None):
+        self.dias_imagenes = dias_imagenes
+        self.dias_registros = dias_registros
+        self.max_bytes_imagenes = int(max_gb_imagenes * 1024 ** 3)
+        self.intervalo_huerfanos = intervalo_huerfanos
+        self._al_eliminar = al_eliminar
+        self._medidor = MedidorAlmacen()
+        self._ultima_recoleccion = 0.0
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self.bytes_imagenes: Optional[int] = None
+        self.ultimo_resumen: Dict = {}
+
+    def configuracion(self) -> Dict:
+        return {
+            "dias_imagenes": self.dias_imagenes,
+            "dias_registros": self.dias_registros,
+            "max_gb_imagenes": round(self.max_bytes_imagenes / 1024 ** 3, 3),
+            "intervalo_huerfanos": self.intervalo_huerfanos,
+        }
+
+    def ejecutar(self, trabajo: Trabajo) -> str:
+        ahora = time.time()
+        with ThreadPoolExecutor(max_workers=HILOS_BORRADO,
+                                thread_name_prefix="retencion") as pool:
+            self._pool = pool
+            registros = self._expirar_registros(trabajo, ahora)
+            self._expirar_tracks(trabajo, ahora)
+            imagenes = self._expirar_imagenes(trabajo, ahora)
+            if ahora - self._ultima_recoleccion >= self.intervalo_huerfanos:
+                self._recolectar_huerfanos(trabajo, ahora)
+                self._ultima_recoleccion = ahora
+            imagenes += self._ajustar_a_presupuesto(trabajo)
+
+        if registros:
+            # Devolver al disco las páginas que dejaron los registros borrados
+            while liberar_espacio(PAGINAS_VACUUM_POR_PASO) > 0:
+                pass
+        if registros or imagenes or trabajo.detalle.get("huerfanos_eliminados"):
+            eliminar_carpetas_vacias()
+        if registros and self._al_eliminar:
+            self._al_eliminar(registros)
+
+        self.ultimo_resumen = dict(trabajo.detalle, bytes_imagenes=self.bytes_imagenes)
+        return (f"Retención: {registros} registros y {imagenes} imágenes eliminados, "
+                f"{trabajo.detalle.get('huerfanos_eliminados', 0)} huérfanos")
+
+    # ------------------------------------------------------------------------
+
+    def _borrar_archivos(self, rutas: List[str]) -> int:
+        """Borra en paralelo; retorna los bytes liberados"""
+        return sum(self._pool.map(_borrar_archivo, [r for r in rutas if r]))
+
+    def _expirar_registros(self, trabajo: Trabajo, ahora: float) -> int:
+        if not self.dias_registros:
+            return 0
+        corte = int(ahora - self.dias_registros * 86400)
+        total = 0
+        while True:
+            eliminados = eliminar_registros_antiguos(corte, TAMANO_LOTE_RETENCION)
+            if not eliminados:
+                return total
+            self._borrar_archivos([ruta for _, ruta in eliminados])
+            liberar_espacio(PAGINAS_VACUUM_POR_PASO)
+            total += len(eliminados)
+            trabajo.avanzar(len(eliminados), registros_eliminados=len(eliminados))
+
+    def _expirar_tracks(self, trabajo: Trabajo, ahora: float):
+        """Los tracks de personas siguen la misma regla de días que los registros"""
+        if not self.dias_registros:
+            return
+        eliminados = eliminar_tracks_antiguos(int(ahora - self.dias_registros * 86400))
+        if eliminados:
+            trabajo.avanzar(0, tracks_eliminados=eliminados)
+
+    def _expirar_imagenes(self, trabajo: Trabajo, ahora: float) -> int:
+        if not self.dias_imagenes:
+            return 0
+        corte = int(ahora - self.dias_imagenes * 86400)
+        total = 0
+        while True:
+            quitadas = quitar_imagenes_antiguas(corte, ESTADO_EXPIRADA, TAMANO_LOTE_RETENCION)
+            if not quitadas:
+                return total
+            self._borrar_archivos([ruta for _, ruta in quitadas])
+            total += len(quitadas)
+            trabajo.avanzar(len(quitadas), imagenes_expiradas=len(quitadas))
+
+    def _ajustar_a_presupuesto(self, trabajo: Trabajo) -> int:
+        self.bytes_imagenes = self._medidor.medir()
+        if not self.max_bytes_imagenes:
+            return 0
+        total = 0
+        while self.bytes_imagenes > self.max_bytes_imagenes:
+            quitadas = quitar_imagenes_antiguas(None, ESTADO_EXPIRADA, TAMANO_LOTE_RETENCION)
+            if not quitadas:
+                break  # Lo que queda no pertenece a ningún registro borrable
+            self.bytes_imagenes -= self._borrar_archivos([ruta for _, ruta in quitadas])
+            total += len(quitadas)
+            trabajo.avanzar(len(quitadas), imagenes_por_espacio=len(quitadas))
+        return total
+
+    def _recolectar_huerfanos(self, trabajo: Trabajo, ahora: float):
+        limite = ahora - ANTIGUEDAD_MINIMA_HUERFANO
+
+        # 1. Archivos sin registro que los use
+        rutas_antiguas = None
+        candidatos: List = []
+        borrar: List[str] = []
+
+        def revisar_candidatos():
+            rutas = obtener_rutas_por_ids([a.registro_id for a in candidatos])
+            borrar.extend(a.ruta_relativa for a in candidatos
+                          if rutas.get(a.registro_id) != a.ruta_relativa)
+            candidatos.clear()
+
+        for archivo in recorrer_imagenes():
+            if archivo.modificado > limite:
+                continue
+            if archivo.temporal:
+                borrar.append(archivo.ruta_relativa)
+            elif archivo.registro_id is not None:
+                candidatos.append(archivo)
+                if len(candidatos) >= TAMANO_LOTE_RETENCION:
+                    revisar_candidatos()
+            else:
+                # Formato plano anterior: puede estar compartido por varios registros
+                if rutas_antiguas is None:
+                    rutas_antiguas = set(obtener_rutas_antiguas())
+                if archivo.ruta_relativa not in rutas_antiguas:
+                    borrar.append(archivo.ruta_relativa)
+        if candidatos:
+            revisar_candidatos()
+        for i in range(0, len(borrar), TAMANO_LOTE_RETENCION):
+            self._borrar_archivos(borrar[i:i + TAMANO_LOTE_RETENCION])
+        trabajo.avanzar(len(borrar), huerfanos_eliminados=len(borrar))
+
+        # 2. Registros cuya imagen ya no está en disco
+        marcados = 0
+        cursor: Tuple[int, int] = (-1, -1)
+        while True:
+            lote = obtener_registros_con_imagen(cursor, TAMANO_LOTE_RETENCION)
+            if not lote:
+                break
+            faltantes = []
+            for _, registro_id, ruta_imagen in lote:
+                ruta = resolver_ruta(ruta_imagen)
+                if ruta is None or not os.path.exists(ruta):
+                    faltantes.append((registro_id, ruta_imagen))
+            if faltantes:
+                marcados += marcar_imagenes_faltantes(faltantes, ESTADO_PERDIDA)
+            cursor = lote[-1][:2]
+        trabajo.avanzar(marcados, imagenes_perdidas=marcados)
+
+        # 3. Imágenes que quedaron "pendiente" (ej. reinicio con la cola llena)
+        cerradas = cerrar_imagenes_pendientes(MINUTOS_IMAGEN_PENDIENTE, ESTADO_ERROR)
+        trabajo.avanzar(cerradas, pendientes_cerradas=cerradas)
+
+
+class PlanificadorRetencion:
+    """
+    Hilo que lanza un ciclo de retención cada INTERVALO_RETENCION segundos.
+
+    Uso:
+        planificador = PlanificadorRetencion(lanzar=lambda: gestor.iniciar(...))
+        planificador.iniciar()   # al arrancar el servidor
+        planificador.detener()   # al apagarlo
+    """
+
+    def __init__(self, lanzar: Callable[[], Trabajo], intervalo: int = INTERVALO_RETENCION):
+        self._lanzar = lanzar
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def iniciar(self):
+        if self._hilo is not None:
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="retencion", daemon=True)
+        self._hilo.start()
+
+    def _bucle(self):
+        # El primer ciclo espera un poco: no competir con el arranque del servidor
+        espera = min(60, self.intervalo)
+        while not self._detener.wait(espera):
+            try:
+                self._lanzar()
+            except Exception as e:
+                print(f"⚠️ No se pudo lanzar la retención: {e}")
+            espera = self.intervalo
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=5)
+            self._hilo = None
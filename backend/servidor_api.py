@@ -1,14 +1,20 @@
 """
 Servidor FastAPI para recibir y procesar detecciones EPP
 """
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, File, Form, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
-from typing import Dict
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
+from typing import Callable, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from datetime import datetime
+import asyncio
+import functools
+import json
 import sys
 import os
 import subprocess
+import time
 import psutil
 
 # Agregar rutas al path
@@ -17,20 +23,127 @@ sys.path.insert(0, BASE_DIR)
 
 from backend.BD.operaciones_bd import (
     insertar_registro_completo,
-    obtener_todos_registros,
+    insertar_registros_lote,
+    buscar_claves_existentes,
+    obtener_registros_paginados,
+    obtener_version_cambios,
+    obtener_cambios_desde,
     obtener_registro_con_detalle,
     obtener_estadisticas_generales,
+    obtener_serie_analitica,
+    actualizar_imagen_registro,
     eliminar_registro,
-    eliminar_todos_registros
+    obtener_rango_ids,
+    eliminar_lote_registros,
+    liberar_espacio,
+    obtener_camaras,
+    insertar_tracks,
+    obtener_tracks_paginados,
+    obtener_resumen_tracks,
+    MAX_LIMITE_PAGINA
 )
+from backend.BD.conexion_bd import cerrar_conexiones
+from backend.BD.tiempo import fecha_a_epoch
+from backend.BD.crear_bd import asegurar_esquema
 from backend.cumplimiento import calcular_cumplimiento
-from backend.image_utils import extraer_imagen_del_output
+from backend.image_utils import (
+    extraer_imagen_del_output,
+    jpg_bytes_a_archivo,
+    frame_crudo_a_jpg
+)
+from backend.almacen_imagenes import (
+    resolver_ruta,
+    migrar_imagen_antigua,
+    eliminar_imagen,
+    eliminar_carpetas_vacias
+)
+from backend.guardado_imagenes import (
+    GuardadorImagenes,
+    ESTADO_PENDIENTE,
+    ESTADO_OK,
+    ESTADO_ERROR,
+    ESTADO_SIN_IMAGEN
+)
+from backend.difusor_eventos import difusor, formatear_evento
+from backend.trabajos import GestorTrabajos, Trabajo
+from backend.retencion import PoliticaRetencion, PlanificadorRetencion
+from backend.derivados_imagenes import CacheDerivados, EtagsArchivos, TAMANOS, FORMATOS
+from backend.metricas import metricas, TIPO_CONTENIDO
+from backend.exportacion import (
+    EXPORTADORES,
+    FORMATOS_EXPORTACION,
+    parquet_disponible,
+    recorrer_lotes
+)
+
+# Crear la BD o aplicar migraciones pendientes antes de atender peticiones
+asegurar_esquema()
+
+
+
+def _imagen_guardada(registro_id: int, ruta_imagen: str, estado_imagen: str):
+    """Al terminar una imagen (hilo del pool): actualizar BD y avisar a los dashboards"""
+    actualizar_imagen_registro(registro_id, ruta_imagen, estado_imagen)
+    difusor.publicar("registro_actualizado", {
+        "id": registro_id, "estado_imagen": estado_imagen, "ruta_imagen": ruta_imagen
+    })
+
+
+# Pool acotado que escribe las imágenes fuera del event loop
+guardador_imagenes = GuardadorImagenes(al_terminar=_imagen_guardada)
+
+# Trabajos largos (purga de registros); su progreso también se publica por SSE
+gestor_trabajos = GestorTrabajos(
+    al_actualizar=lambda trabajo: difusor.publicar("trabajo", trabajo.a_dict())
+)
+
+# Purga: registros por transacción, hilos que borran imágenes y páginas
+# devueltas al disco por paso de vacuum incremental
+TAMANO_LOTE_PURGA = 500
+HILOS_BORRADO_IMAGENES = 4
+PAGINAS_VACUUM_POR_PASO = 2000
+
+# Retención periódica de registros e imágenes (ver backend/retencion.py)
+politica_retencion = PoliticaRetencion(
+    al_eliminar=lambda cantidad: difusor.publicar("registros_eliminados", {"cantidad": cantidad})
+)
+
+
+def _lanzar_retencion() -> Trabajo:
+    """Inicia un ciclo de retención salvo que ya haya uno (o una purga) en curso"""
+    return (gestor_trabajos.en_curso("retencion") or gestor_trabajos.en_curso("purga")
+            or gestor_trabajos.iniciar("retencion", politica_retencion.ejecutar))
+
+
+planificador_retencion = PlanificadorRetencion(lanzar=_lanzar_retencion)
+
+# Miniaturas / tamaño medio generados a pedido y ETags de contenido
+cache_derivados = CacheDerivados()
+etags_imagenes = EtagsArchivos()
+
+
+@asynccontextmanager
+async def ciclo_de_vida(app: FastAPI):
+    """Arranque y cierre ordenado de los recursos compartidos del servidor"""
+    # Los hilos (pool de imágenes) publican eventos a través de este loop
+    difusor.vincular_loop(asyncio.get_running_loop())
+    planificador_retencion.iniciar()
+    yield
+    planificador_retencion.detener()
+    # Cerrar las conexiones SSE abiertas
+    difusor.cerrar()
+    # Terminar las imágenes en curso (actualizan la BD) antes de cerrarla
+    guardador_imagenes.cerrar()
+    # Vaciar la cola del escritor y cerrar las conexiones de la BD
+    cerrar_conexiones()
+
 
 # Crear aplicación FastAPI
 app = FastAPI(
     title="API EPP",
     description="Sistema de monitoreo de EPP",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=ciclo_de_vida
 )
 
 # Configurar CORS
@@ -43,6 +156,45 @@ app.add_middleware(
 )
 
 
+# ============================================================================
+# MÉTRICAS (GET /metrics)
+# ============================================================================
+
+DURACION_PETICION = metricas.histograma(
+    "epp_api_peticion_segundos", "Latencia de cada endpoint hasta enviar la respuesta",
+    ["metodo", "ruta", "estado"])
+BYTES_RECIBIDOS = metricas.contador(
+    "epp_api_bytes_recibidos_total", "Bytes recibidos en el cuerpo de las peticiones",
+    ["ruta"])
+metricas.medidor("epp_api_conexiones_sse", "Dashboards conectados por SSE",
+                 funcion=lambda: difusor.clientes)
+
+
+@app.middleware("http")
+async def medir_peticion(request: Request, call_next):
+    """Latencia y bytes por endpoint (la ruta es la plantilla, ej. /api/registros/{registro_id})"""
+    inicio = time.perf_counter()
+    estado = 500
+    try:
+        response = await call_next(request)
+        estado = response.status_code
+        return response
+    finally:
+        ruta_app = request.scope.get("route")
+        ruta = getattr(ruta_app, "path", None) or "sin_ruta"
+        DURACION_PETICION.observar(time.perf_counter() - inicio,
+                                   metodo=request.method, ruta=ruta, estado=estado)
+        tamano = request.headers.get("content-length")
+        if tamano and tamano.isdigit():
+            BYTES_RECIBIDOS.inc(int(tamano), ruta=ruta)
+
+
+@app.get("/metrics")
+async def exponer_metricas():
+    """Métricas del servidor en formato de texto de Prometheus"""
+    return Response(content=metricas.exponer(), media_type=TIPO_CONTENIDO)
+
+
 @app.get("/")
 async def inicio():
     """Endpoint de prueba"""
@@ -53,12 +205,134 @@ async def inicio():
     }
 
 
-@app.post("/api/registros")
-async def recibir_deteccion(data: Dict):
+def _resumen_evento(registro_id: int, datos_bd: Dict) -> Dict:
+    """Datos mínimos de un registro nuevo para el evento en tiempo real"""
+    return {
+        "id": registro_id,
+        "fecha_hora": datos_bd["fecha_hora"],
+        "camera_id": datos_bd["camera_id"],
+        "total_personas": datos_bd["total_personas"],
+        "cumplimiento_general": datos_bd["cumplimiento_general"],
+        "incumplimientos_totales": datos_bd["incumplimientos_totales"],
+        "estado_imagen": datos_bd["estado_imagen"]
+    }
+
+
+def _construir_datos_bd(fecha_hora: str, frame_number: int, resultado_cumplimiento: Dict,
+                        ruta_imagen: str,
+                        clave_idempotencia: Optional[str] = None,
+                        estado_imagen: str = ESTADO_OK,
+                        camera_id: Optional[str] = None,
+                        repite_anterior: Optional[Dict] = None) -> Dict:
+    """Arma el diccionario que esperan las funciones de inserción de la BD"""
+    return {
+        "fecha_hora": fecha_hora,
+        "frame_number": frame_number,
+        "total_personas": resultado_cumplimiento["total_personas"],
+        "total_cascos": resultado_cumplimiento["total_cascos"],
+        "total_chalecos": resultado_cumplimiento["total_chalecos"],
+        "total_gafas": resultado_cumplimiento["total_gafas"],
+        "cumplimiento_general": resultado_cumplimiento["cumplimiento_general"],
+        "cumplimiento_casco": resultado_cumplimiento["cumplimiento_casco"],
+        "cumplimiento_chaleco": resultado_cumplimiento["cumplimiento_chaleco"],
+        "cumplimiento_gafas": resultado_cumplimiento["cumplimiento_gafas"],
+        "personas_con_casco": resultado_cumplimiento["personas_con_casco"],
+        "personas_sin_casco": resultado_cumplimiento["personas_sin_casco"],
+        "personas_con_chaleco": resultado_cumplimiento["personas_con_chaleco"],
+        "personas_sin_chaleco": resultado_cumplimiento["personas_sin_chaleco"],
+        "personas_con_gafas": resultado_cumplimiento["personas_con_gafas"],
+        "personas_sin_gafas": resultado_cumplimiento["personas_sin_gafas"],
+        "incumplimientos_totales": resultado_cumplimiento["incumplimientos_totales"],
+        "ruta_imagen": ruta_imagen,
+        "estado_imagen": estado_imagen,
+        "clave_idempotencia": clave_idempotencia,
+        "camera_id": camera_id,
+        "repite_anterior": repite_anterior,
+        "detecciones_persona": resultado_cumplimiento["detecciones_persona"]
+    }
+
+
+def _leer_repeticion(data: Dict) -> Optional[Dict]:
     """
-    Recibe detección de Roboflow, calcula cumplimiento,
-    guarda imagen y almacena en BD
+    "repite_anterior" de la metadata: muestras sin cambios descartadas por
+    main.py después del registro anterior (None si falta o es inválido)
+    """
+    repeticion = data.get("repite_anterior")
+    if not isinstance(repeticion, dict):
+        return None
+    clave = repeticion.get("clave_idempotencia")
+    cantidad = repeticion.get("repeticiones")
+    if not isinstance(clave, str) or not isinstance(cantidad, int) or cantidad < 0:
+        return None
+    return {"clave_idempotencia": clave, "repeticiones": cantidad,
+            "ultima_repeticion": repeticion.get("ultima_repeticion")}
+
+
+def _validar_metadata(data, con_imagen_indice: bool = False):
     """
+    Revisa la forma de la metadata de un registro antes de tocar la BD:
+    un payload mal formado se responde con 422, no como falla del servidor.
+    
+    Raises:
+        ValueError: Con el motivo, si la metadata no se puede procesar
+    """
+    if not isinstance(data, dict):
+        raise ValueError(f"se esperaba un objeto, llegó {type(data).__name__}")
+    output_image = data.get("output_image", {})
+    video_metadata = output_image.get("_video_metadata", {}) if isinstance(output_image, dict) else None
+    if not isinstance(video_metadata, dict):
+        raise ValueError("output_image._video_metadata debe ser un objeto")
+    if not isinstance(video_metadata.get("frame_timestamp", ""), str):
+        raise ValueError("frame_timestamp debe ser una fecha ISO")
+    if not _es_entero(video_metadata.get("frame_number", 0)):
+        raise ValueError("frame_number debe ser un entero")
+    model_1 = data.get("model_1", {})
+    predicciones = model_1.get("data", {}) if isinstance(model_1, dict) else None
+    if not isinstance(predicciones, dict):
+        raise ValueError("model_1.data debe ser un objeto")
+    clases = predicciones.get("class_name", [])
+    if not isinstance(clases, list) or not all(isinstance(clase, str) for clase in clases):
+        raise ValueError("model_1.data.class_name debe ser una lista de textos")
+    if not isinstance(data.get("clave_idempotencia") or "", str):
+        raise ValueError("clave_idempotencia debe ser texto")
+    if data.get("camera_id") is not None and not isinstance(data["camera_id"], (str, int)):
+        raise ValueError("camera_id debe ser texto")
+    if con_imagen_indice and data.get("imagen_indice") is not None and not _es_entero(data["imagen_indice"]):
+        raise ValueError("imagen_indice debe ser un entero")
+
+
+def _es_entero(valor) -> bool:
+    return isinstance(valor, int) and not isinstance(valor, bool)
+
+
+def _cumplimiento_validado(data: Dict) -> Dict:
+    """calcular_cumplimiento con los errores de cajas mal formadas como ValueError (payload inválido)"""
+    try:
+        return calcular_cumplimiento(data)
+    except (TypeError, KeyError, IndexError) as e:
+        raise ValueError(f"model_1 inválido: {e}") from None
+
+
+async def _procesar_registro(data: Dict,
+                             guardar_imagen: Optional[Callable[[int, str], Optional[str]]]) -> JSONResponse:
+    """
+    Flujo común de ingesta: calcula cumplimiento, almacena en BD y deja
+    la imagen en cola de guardado (la respuesta no espera al disco).
+    
+    Args:
+        data: Detección de Roboflow (model_1 + output_image._video_metadata)
+        guardar_imagen: Función que recibe (registro_id, fecha_hora) y retorna
+                        la ruta guardada (None si el registro no trae imagen)
+    
+    Una metadata mal formada se responde con 422 (main.py la descarta);
+    el 500 queda para fallas del servidor, que main.py reintenta.
+    """
+    try:
+        _validar_metadata(data)
+        resultado_cumplimiento = _cumplimiento_validado(data)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Metadata inválida: {e}")
+    
     try:
         print("\n" + "="*80)
         print("📥 NUEVO REGISTRO RECIBIDO")
@@ -72,65 +346,60 @@ async def recibir_deteccion(data: Dict):
         print(f"⏰ Fecha: {fecha_hora}")
         print(f"🎬 Frame: {frame_number}")
         
-        # 2. Guardar imagen
-        print("\n📸 Guardando imagen...")
-        ruta_imagen = extraer_imagen_del_output(data)
-        if ruta_imagen:
-            print(f"   ✅ Guardada: {ruta_imagen}")
-        else:
-            print("   ⚠️ No se pudo guardar")
-            ruta_imagen = ""
-        
-        # 3. Calcular cumplimiento
-        print("\n📊 Calculando cumplimiento...")
-        metricas = calcular_cumplimiento(data)
-        
-        print(f"   👥 Personas: {metricas['total_personas']}")
-        print(f"   🪖 Cascos: {metricas['total_cascos']}")
-        print(f"   🦺 Chalecos: {metricas['total_chalecos']}")
-        print(f"   🥽 Gafas: {metricas['total_gafas']}")
-        print(f"\n   📈 Cumplimiento General: {metricas['cumplimiento_general']}%")
-        print(f"      - Casco: {metricas['cumplimiento_casco']}%")
-        print(f"      - Chaleco: {metricas['cumplimiento_chaleco']}%")
-        print(f"      - Gafas: {metricas['cumplimiento_gafas']}%")
-        print(f"   ❌ Incumplimientos: {metricas['incumplimientos_totales']}")
-        
-        # 4. Preparar datos para BD
-        datos_bd = {
-            "fecha_hora": fecha_hora,
-            "frame_number": frame_number,
-            "total_personas": metricas["total_personas"],
-            "total_cascos": metricas["total_cascos"],
-            "total_chalecos": metricas["total_chalecos"],
-            "total_gafas": metricas["total_gafas"],
-            "cumplimiento_general": metricas["cumplimiento_general"],
-            "cumplimiento_casco": metricas["cumplimiento_casco"],
-            "cumplimiento_chaleco": metricas["cumplimiento_chaleco"],
-            "cumplimiento_gafas": metricas["cumplimiento_gafas"],
-            "personas_con_casco": metricas["personas_con_casco"],
-            "personas_sin_casco": metricas["personas_sin_casco"],
-            "personas_con_chaleco": metricas["personas_con_chaleco"],
-            "personas_sin_chaleco": metricas["personas_sin_chaleco"],
-            "personas_con_gafas": metricas["personas_con_gafas"],
-            "personas_sin_gafas": metricas["personas_sin_gafas"],
-            "incumplimientos_totales": metricas["incumplimientos_totales"],
-            "ruta_imagen": ruta_imagen,
-            "detecciones_persona": metricas["detecciones_persona"]
-        }
-        
-        # 5. Guardar en BD
+        # Reintento de main.py (spool) que ya se guardó → responder con el mismo ID
+        clave = data.get("clave_idempotencia")
+        existentes = await buscar_claves_existentes.asincrono([clave]) if clave else {}
+        if clave in existentes:
+            print(f"♻️ Registro repetido (clave {clave}) → ID {existentes[clave]}")
+            print("="*80 + "\n")
+            return JSONResponse(content={
+                "status": "success",
+                "registro_id": existentes[clave],
+                "mensaje": "Registro ya recibido anteriormente",
+                "duplicado": True
+            })
+        
+        # 2. Cumplimiento (ya calculado al validar la metadata)
+        print("\n📊 Cumplimiento:")
+        print(f"   👥 Personas: {resultado_cumplimiento['total_personas']}")
+        print(f"   🪖 Cascos: {resultado_cumplimiento['total_cascos']}")
+        print(f"   🦺 Chalecos: {resultado_cumplimiento['total_chalecos']}")
+        print(f"   🥽 Gafas: {resultado_cumplimiento['total_gafas']}")
+        print(f"\n   📈 Cumplimiento General: {resultado_cumplimiento['cumplimiento_general']}%")
+        print(f"      - Casco: {resultado_cumplimiento['cumplimiento_casco']}%")
+        print(f"      - Chaleco: {resultado_cumplimiento['cumplimiento_chaleco']}%")
+        print(f"      - Gafas: {resultado_cumplimiento['cumplimiento_gafas']}%")
+        print(f"   ❌ Incumplimientos: {resultado_cumplimiento['incumplimientos_totales']}")
+        
+        # 3. Preparar datos para BD (la ruta de la imagen se completa al guardarla)
+        estado_imagen = ESTADO_PENDIENTE if guardar_imagen else ESTADO_SIN_IMAGEN
+        datos_bd = _construir_datos_bd(fecha_hora, frame_number, resultado_cumplimiento, "", clave, estado_imagen,
+                                       data.get("camera_id"), _leer_repeticion(data))
+        
+        # 4. Guardar en BD
         print("\n💾 Guardando en base de datos...")
-        registro_id = insertar_registro_completo(datos_bd)
+        registro_id = await insertar_registro_completo.asincrono(datos_bd)
         
         print(f"   ✅ Registro ID {registro_id} guardado")
+        difusor.publicar("registro_nuevo", {"registros": [_resumen_evento(registro_id, datos_bd)]})
+        
+        # 5. Guardar imagen en segundo plano
+        if guardar_imagen:
+            if guardador_imagenes.programar(registro_id,
+                                            functools.partial(guardar_imagen, registro_id, fecha_hora)):
+                print("   📸 Imagen en cola de guardado")
+            else:
+                estado_imagen = ESTADO_ERROR
+                await actualizar_imagen_registro.asincrono(registro_id, "", estado_imagen)
         print("="*80 + "\n")
         
         # 6. Retornar respuesta
         return JSONResponse(content={
             "status": "success",
             "registro_id": registro_id,
+            "estado_imagen": estado_imagen,
             "mensaje": "Registro procesado correctamente",
-            "metricas": metricas
+            "metricas": resultado_cumplimiento
         })
         
     except Exception as e:
@@ -140,50 +409,366 @@ async def recibir_deteccion(data: Dict):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/registros")
+async def recibir_deteccion(data: Dict):
+    """
+    Recibe detección de Roboflow, calcula cumplimiento,
+    guarda imagen y almacena en BD
+    """
+    output_image = data.get("output_image", {})
+    trae_imagen = isinstance(output_image, dict) and \
+        bool(output_image.get("_numpy_image") or output_image.get("_base64_image"))
+    guardar_imagen = (lambda registro_id, fecha_hora: extraer_imagen_del_output(data, registro_id)) \
+        if trae_imagen else None
+    return await _procesar_registro(data, guardar_imagen)
+
+
+@app.post("/api/registros/binario")
+async def recibir_deteccion_binaria(
+    metadata: str = Form(...),
+    imagen: Optional[UploadFile] = File(None)
+):
+    """
+    Recibe detección en formato binario (multipart/form-data).
+    
+    - metadata: JSON compacto (model_1 + output_image._video_metadata), sin píxeles
+    - imagen: frame en un único buffer; JPEG ya codificado en el borde, o
+      buffer crudo si la metadata trae "_frame_crudo": {"shape": [...], "dtype": "uint8"}
+    """
+    try:
+        data = json.loads(metadata)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Metadata JSON inválida: {e}")
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="La metadata debe ser un objeto JSON")
+    
+    contenido = await imagen.read() if imagen is not None else b""
+    
+    camara = data.get("camera_id")
+    
+    def guardar_imagen(registro_id: int, fecha_hora: str) -> Optional[str]:
+        frame_crudo = data.get("_frame_crudo")
+        if frame_crudo:
+            return frame_crudo_a_jpg(contenido, frame_crudo["shape"], frame_crudo["dtype"],
+                                     registro_id, fecha_hora, camara)
+        return jpg_bytes_a_archivo(contenido, registro_id, fecha_hora, camara)
+    
+    return await _procesar_registro(data, guardar_imagen if contenido else None)
+
+
+@app.post("/api/registros/batch")
+async def recibir_lote_detecciones(
+    metadata: str = Form(...),
+    imagenes: List[UploadFile] = File(default=[])
+):
+    """
+    Recibe varios registros en una sola petición (multipart/form-data).
+    
+    - metadata: lista JSON; cada elemento es la metadata compacta de un registro
+      y puede traer "imagen_indice" apuntando a su archivo en `imagenes`
+    - imagenes: frames JPEG del lote
+    
+    Todos los registros y sus detecciones por persona se insertan
+    en una única transacción. Si un elemento está mal formado se responde
+    422 con su posición y no se guarda ninguno.
+    """
+    try:
+        lote = json.loads(metadata)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Metadata JSON inválida: {e}")
+    if not isinstance(lote, list):
+        raise HTTPException(status_code=400, detail="La metadata del lote debe ser una lista")
+    
+    # Un elemento mal formado rechaza el lote entero antes de tocar la BD
+    cumplimientos = []
+    for posicion, data in enumerate(lote):
+        try:
+            _validar_metadata(data, con_imagen_indice=True)
+            cumplimientos.append(_cumplimiento_validado(data))
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f"Registro {posicion} del lote: {e}")
+    
+    try:
+        contenidos = [await imagen.read() for imagen in imagenes]
+        
+        # Reintentos ya guardados: no volver a escribir su imagen
+        existentes = await buscar_claves_existentes.asincrono(
+            [data["clave_idempotencia"] for data in lote if data.get("clave_idempotencia")]
+        )
+        
+        lista_datos = []
+        imagenes_nuevas = {}  # posición en el lote → (bytes JPEG, fecha_hora, cámara)
+        claves_vistas = set(existentes)
+        for posicion, data in enumerate(lote):
+            clave = data.get("clave_idempotencia")
+            video_metadata = data.get("output_image", {}).get("_video_metadata", {})
+            fecha_hora = video_metadata.get("frame_timestamp", datetime.now().isoformat())
+            frame_number = video_metadata.get("frame_number", 0)
+            
+            # Reintentos ya guardados (o repetidos en el lote) no vuelven a escribir imagen
+            indice = data.get("imagen_indice")
+            estado_imagen = ESTADO_SIN_IMAGEN
+            if clave not in claves_vistas and indice is not None \
+                    and 0 <= indice < len(contenidos) and contenidos[indice]:
+                imagenes_nuevas[posicion] = (contenidos[indice], fecha_hora, data.get("camera_id"))
+                estado_imagen = ESTADO_PENDIENTE
+            if clave:
+                claves_vistas.add(clave)
+            
+            lista_datos.append(
+                _construir_datos_bd(fecha_hora, frame_number, cumplimientos[posicion], "", clave, estado_imagen,
+                                    data.get("camera_id"), _leer_repeticion(data))
+            )
+        
+        registro_ids = await insertar_registros_lote.asincrono(lista_datos)
+        if registro_ids:
+            print(f"📥 Lote recibido: {len(registro_ids)} registros guardados (IDs {registro_ids[0]}-{registro_ids[-1]})")
+        
+        # Avisar solo los registros realmente nuevos (no los reintentos)
+        ids_avisados = set(existentes.values())
+        resumenes = []
+        for registro_id, datos_bd in zip(registro_ids, lista_datos):
+            if registro_id not in ids_avisados:
+                ids_avisados.add(registro_id)
+                resumenes.append(_resumen_evento(registro_id, datos_bd))
+        if resumenes:
+            difusor.publicar("registro_nuevo", {"registros": resumenes})
+        
+        # Imágenes en segundo plano
+        for posicion, (contenido, fecha_hora, camara) in imagenes_nuevas.items():
+            registro_id = registro_ids[posicion]
+            guardar = functools.partial(jpg_bytes_a_archivo, contenido, registro_id, fecha_hora, camara)
+            if not guardador_imagenes.programar(registro_id, guardar):
+                await actualizar_imagen_registro.asincrono(registro_id, "", ESTADO_ERROR)
+        
+        return JSONResponse(content={
+            "status": "success",
+            "total": len(registro_ids),
+            "registro_ids": registro_ids,
+            "mensaje": "Lote procesado correctamente"
+        })
+    except Exception as e:
+        print(f"\n❌ ERROR procesando lote: {e}\n")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _etag_version(version: int) -> str:
+    """ETag débil a partir de la versión del registro de cambios"""
+    return f'W/"v{version}"'
+
+
 @app.get("/api/registros")
-async def listar_registros(limite: int = 100):
-    """Obtiene lista de registros"""
+async def listar_registros(
+    request: Request,
+    limite: int = 100,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    since_id: Optional[int] = None,
+    fields: Optional[str] = None,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    camara: Optional[str] = None,
+    cumplimiento_min: Optional[float] = None,
+    cumplimiento_max: Optional[float] = None
+):
+    """
+    Obtiene una página de registros (del más nuevo al más antiguo).
+    
+    - before_id / after_id: cursor; para la página siguiente usar `siguiente_before_id`
+    - since_id: modo delta; pasar el `ultimo_cambio` de la respuesta anterior y
+      se devuelven solo nuevos, modificados y eliminados (o reinicio=true)
+    - fields: columnas separadas por coma, ej. fields=id,timestamp,cumplimiento_general
+    - desde / hasta: rango de fecha (ISO o epoch, inclusivo); 400 si no es una fecha
+    - camara: camera_id
+    - cumplimiento_min / cumplimiento_max: rango de cumplimiento general (%)
+    
+    Todas las respuestas llevan ETag (versión de la tabla); si el cliente
+    envía If-None-Match con la misma versión se responde 304 sin cuerpo.
+    """
+    campos = [campo.strip() for campo in fields.split(",") if campo.strip()] if fields else None
     try:
-        registros = obtener_todos_registros(limite)
-        
-        # Mapear fecha_hora a timestamp para el frontend
-        for registro in registros:
-            if 'fecha_hora' in registro:
-                registro['timestamp'] = registro['fecha_hora']
-            if 'cumplimiento_casco' in registro:
-                registro['cumplimiento_cascos'] = registro['cumplimiento_casco']
-            if 'cumplimiento_chaleco' in registro:
-                registro['cumplimiento_chalecos'] = registro['cumplimiento_chaleco']
-            if 'cumplimiento_gafas' in registro:
-                registro['cumplimiento_gafas'] = registro['cumplimiento_gafas']
-        
-        return JSONResponse(
-            content={
-                "status": "success",
-                "total": len(registros),
-                "registros": registros
-            },
-            headers={
-                "Cache-Control": "no-cache, no-store, must-revalidate",
-                "Pragma": "no-cache",
-                "Expires": "0"
-            }
+        # La versión se lee ANTES que los datos: si algo cambia entremedio,
+        # el próximo sondeo lo vuelve a pedir (nunca se pierde un cambio)
+        version = await obtener_version_cambios.asincrono()
+        etag = _etag_version(version)
+        cabeceras = {"ETag": etag, "Cache-Control": "no-cache"}
+        
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=cabeceras)
+        
+        if since_id is not None:
+            cambios = await obtener_cambios_desde.asincrono(since_id, campos)
+            return JSONResponse(content={"status": "success", **cambios}, headers={
+                **cabeceras, "ETag": _etag_version(cambios["ultimo_cambio"])
+            })
+        
+        registros = await obtener_registros_paginados.asincrono(
+            limite, before_id=before_id, after_id=after_id, campos=campos,
+            desde=desde, hasta=hasta, camara=camara,
+            cumplimiento_min=cumplimiento_min, cumplimiento_max=cumplimiento_max
         )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    
+    # Cursor de la página siguiente (solo si la página vino llena y trae el id)
+    siguiente = None
+    if registros and len(registros) >= max(1, min(limite, MAX_LIMITE_PAGINA)) and "id" in registros[-1]:
+        siguiente = registros[-1]["id"]
+    
+    return JSONResponse(
+        content={
+            "status": "success",
+            "total": len(registros),
+            "siguiente_before_id": siguiente,
+            "ultimo_cambio": version,
+            "registros": registros
+        },
+        headers=cabeceras
+    )
+
+
+@app.post("/api/tracks")
+async def recibir_tracks(tracks: List[Dict]):
+    """
+    Recibe tracks de personas terminados (main.py, uno por persona desde que
+    entra hasta que sale de la imagen). Los reintentos se ignoran por clave.
+    """
+    faltantes = [track.get("clave_idempotencia") or "?" for track in tracks
+                 if not track.get("clave_idempotencia") or not track.get("entrada")
+                 or not track.get("salida")]
+    if faltantes:
+        raise HTTPException(status_code=400,
+                            detail=f"Tracks sin clave_idempotencia, entrada o salida: {faltantes[:5]}")
+    invalidos = []
+    for track in tracks:
+        try:
+            if fecha_a_epoch(track["salida"]) < fecha_a_epoch(track["entrada"]):
+                raise ValueError
+        except ValueError:
+            invalidos.append(track["clave_idempotencia"])
+    if invalidos:
+        raise HTTPException(status_code=400,
+                            detail=f"Tracks con entrada/salida inválidas o salida anterior a entrada: {invalidos[:5]}")
+    try:
+        nuevos = await insertar_tracks.asincrono(tracks) if tracks else 0
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if nuevos:
+        difusor.publicar("tracks", {"nuevos": nuevos})
+    return JSONResponse(content={"status": "success", "total": len(tracks), "nuevos": nuevos})
+
+
+@app.get("/api/tracks")
+async def listar_tracks(limite: int = 100, antes_de: Optional[str] = None,
+                        desde: Optional[str] = None, hasta: Optional[str] = None,
+                        camara: Optional[str] = None):
+    """
+    Página de tracks de personas (del más nuevo al más antiguo).
+    
+    - antes_de: cursor "entrada_epoch:id"; usar `siguiente` de la respuesta anterior
+    - desde / hasta: rango de entrada (ISO o epoch); camara: camera_id
+    """
+    try:
+        cursor = tuple(int(parte) for parte in antes_de.split(":")) if antes_de else None
+        if cursor is not None and len(cursor) != 2:
+            raise ValueError
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Cursor inválido: {antes_de}")
+    try:
+        tracks = await obtener_tracks_paginados.asincrono(limite, cursor, desde, hasta, camara)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    siguiente = None
+    if tracks and len(tracks) >= max(1, min(limite, MAX_LIMITE_PAGINA)):
+        siguiente = f"{tracks[-1]['entrada_epoch']}:{tracks[-1]['id']}"
+    return JSONResponse(content={
+        "status": "success",
+        "total": len(tracks),
+        "siguiente": siguiente,
+        "tracks": tracks
+    })
+
+
+@app.get("/api/tracks/resumen")
+async def resumen_tracks(desde: Optional[str] = None, hasta: Optional[str] = None,
+                         camara: Optional[str] = None):
+    """Estadísticas por persona (tiempo a la vista y fracción de ese tiempo con cada EPP)"""
+    try:
+        resumen = await obtener_resumen_tracks.asincrono(desde, hasta, camara)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return JSONResponse(content={"status": "success", "resumen": resumen})
+
+
+async def _migrar_imagen_si_antigua(registro: Dict):
+    """Mueve al almacén por fecha/cámara la imagen de un registro antiguo y actualiza su ruta"""
+    try:
+        ruta_nueva = await asyncio.to_thread(migrar_imagen_antigua, registro)
+    except OSError as e:
+        print(f"⚠️ No se pudo migrar la imagen del registro {registro.get('id')}: {e}")
+        return
+    if ruta_nueva:
+        await actualizar_imagen_registro.asincrono(registro["id"], ruta_nueva, ESTADO_OK)
+        registro["ruta_imagen"] = ruta_nueva
+
+
+@app.get("/api/export/{formato}")
+async def exportar_registros(formato: str, desde: Optional[str] = None,
+                             hasta: Optional[str] = None, camara: Optional[str] = None):
+    """
+    Descarga registros con sus detecciones por persona, en orden cronológico.
+    
+    Formatos: csv, ndjson, parquet (este último requiere pyarrow).
+    Filtros (se aplican en la consulta SQL): desde / hasta (ISO o epoch,
+    inclusivos) y camara. La respuesta se envía por partes mientras se lee
+    la BD, así que exportar un año no carga todo en memoria.
+    """
+    if formato not in EXPORTADORES:
+        raise HTTPException(status_code=400,
+                            detail=f"formato debe ser uno de: {', '.join(EXPORTADORES)}")
+    if formato == "parquet" and not parquet_disponible():
+        raise HTTPException(status_code=501,
+                            detail="Exportar a Parquet requiere pyarrow (pip install pyarrow)")
+    
+    # Validar las fechas antes del streaming: después el 200 ya está enviado
+    try:
+        desde_epoch = fecha_a_epoch(desde) if desde is not None else None
+        hasta_epoch = fecha_a_epoch(hasta) if hasta is not None else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    media_type, extension = FORMATOS_EXPORTACION[formato]
+    nombre = f"registros_{datetime.now():%Y%m%d_%H%M%S}.{extension}"
+    # Generador síncrono: Starlette lo recorre en un hilo, fuera del event loop
+    contenido = EXPORTADORES[formato](recorrer_lotes(desde_epoch, hasta_epoch, camara))
+    return StreamingResponse(contenido, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{nombre}"'
+    })
 
 
 @app.get("/api/registros/{registro_id}")
 async def obtener_registro_detalle(registro_id: int):
     """Obtiene un registro con detalle por persona"""
     try:
-        data = obtener_registro_con_detalle(registro_id)
+        data = await obtener_registro_con_detalle.asincrono(registro_id)
         if not data:
             raise HTTPException(status_code=404, detail="Registro no encontrado")
         
         # Separar detecciones del registro principal
         detecciones_persona = data.pop('detecciones_persona', [])
         
+        # Imagen guardada con el formato antiguo (carpeta plana) → migrarla ahora
+        await _migrar_imagen_si_antigua(data)
+        
         # Mapear fecha_hora a timestamp en el registro
         if 'fecha_hora' in data:
             data['timestamp'] = data['fecha_hora']
@@ -206,14 +791,78 @@ async def obtener_registro_detalle(registro_id: int):
 
 
 @app.get("/api/estadisticas")
-async def estadisticas():
-    """Obtiene estadísticas generales"""
+async def estadisticas(desde: Optional[str] = None, hasta: Optional[str] = None):
+    """
+    Obtiene estadísticas generales (desde las tablas rollup, tiempo constante).
+    
+    - desde / hasta: ventana opcional (ISO o epoch; hasta exclusivo); cada
+      lado puede omitirse. Sin ventana, totales globales
+    """
     try:
-        stats = obtener_estadisticas_generales()
+        stats = await obtener_estadisticas_generales.asincrono(desde, hasta)
         return JSONResponse(content={
             "status": "success",
             "estadisticas": stats
         })
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/camaras")
+async def listar_camaras():
+    """Cámaras que han enviado registros (para filtrar el dashboard y la exportación)"""
+    try:
+        camaras = await obtener_camaras.asincrono()
+        return JSONResponse(content={
+            "status": "success",
+            "total": len(camaras),
+            "camaras": camaras
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Ventana por defecto de cada granularidad (segundos hacia atrás desde ahora)
+VENTANA_SERIE_POR_DEFECTO = {
+    "minuto": 3600,
+    "hora": 86400,
+    "dia": 30 * 86400,
+    "semana": 26 * 7 * 86400,
+    "mes": 365 * 86400,
+}
+
+
+@app.get("/api/analytics/series")
+async def serie_analitica(granularidad: str = "hora", desde: Optional[str] = None,
+                          hasta: Optional[str] = None):
+    """
+    Serie temporal de cumplimiento, personas e incumplimientos.
+    
+    - granularidad: minuto, hora, dia, semana o mes
+    - desde / hasta: rango (ISO o epoch); hasta es exclusivo. Por defecto la última
+      hora (minuto), día (hora), 30 días (dia), 26 semanas o 12 meses
+    
+    Se responde desde las tablas rollup con una sola consulta por rango de
+    clave primaria, así que el costo depende de los puntos, no de los registros.
+    """
+    if granularidad not in VENTANA_SERIE_POR_DEFECTO:
+        raise HTTPException(status_code=400, detail=f"Granularidad inválida: {granularidad}")
+    
+    fin = hasta if hasta is not None else int(datetime.now().timestamp())
+    inicio = desde if desde is not None else \
+        int(datetime.now().timestamp()) - VENTANA_SERIE_POR_DEFECTO[granularidad]
+    try:
+        serie = await obtener_serie_analitica.asincrono(granularidad, inicio, fin)
+        return JSONResponse(content={
+            "status": "success",
+            "granularidad": granularidad,
+            "total": len(serie),
+            "serie": serie
+        })
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -223,22 +872,24 @@ async def eliminar_registro_endpoint(registro_id: int):
     """Elimina un registro específico y su imagen"""
     try:
         # Primero obtener la ruta de la imagen antes de eliminar
-        registro = obtener_registro_con_detalle(registro_id)
+        registro = await obtener_registro_con_detalle.asincrono(registro_id)
         
         if registro and registro.get('ruta_imagen'):
-            # Eliminar la imagen si existe
-            ruta_imagen = os.path.join(BASE_DIR, registro['ruta_imagen'])
-            if os.path.exists(ruta_imagen):
-                try:
-                    os.remove(ruta_imagen)
-                    print(f"✓ Imagen eliminada: {ruta_imagen}")
-                except Exception as e:
-                    print(f"⚠️ No se pudo eliminar imagen: {e}")
+            # Eliminar la imagen si existe (las rutas antiguas las resuelve el almacén;
+            # otro registro del mismo segundo podía compartir ese archivo, así que
+            # primero se migra y se borra solo la copia propia)
+            await _migrar_imagen_si_antigua(registro)
+            try:
+                if await asyncio.to_thread(eliminar_imagen, registro['ruta_imagen']):
+                    print(f"✓ Imagen eliminada: {registro['ruta_imagen']}")
+            except Exception as e:
+                print(f"⚠️ No se pudo eliminar imagen: {e}")
         
         # Eliminar el registro de la BD
-        resultado = eliminar_registro(registro_id)
+        resultado = await eliminar_registro.asincrono(registro_id)
         
         if resultado:
+            difusor.publicar("registro_eliminado", {"id": registro_id})
             return JSONResponse(content={
                 "status": "success",
                 "mensaje": f"Registro #{registro_id} eliminado correctamente"
@@ -252,51 +903,211 @@ async def eliminar_registro_endpoint(registro_id: int):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.delete("/api/registros")
-async def eliminar_todos_registros_endpoint():
-    """Elimina todos los registros y sus imágenes"""
+def _purgar_registros(trabajo: Trabajo) -> str:
+    """
+    Borra todos los registros existentes al iniciar el trabajo, en lotes:
+    cada lote es una transacción corta del escritor (la ingesta sigue
+    funcionando entre lotes) y sus imágenes se borran en un pool de hilos.
+    """
+    _, hasta_id, total = obtener_rango_ids()
+    trabajo.total = total
+    gestor_trabajos.notificar(trabajo)
+    
+    with ThreadPoolExecutor(max_workers=HILOS_BORRADO_IMAGENES,
+                            thread_name_prefix="borrado-imagenes") as pool:
+        while True:
+            eliminados = eliminar_lote_registros(hasta_id, TAMANO_LOTE_PURGA)
+            if not eliminados:
+                break
+            
+            rutas = [ruta for _, ruta in eliminados if ruta]
+            imagenes = sum(1 for borrada in pool.map(_eliminar_imagen_segura, rutas) if borrada)
+            liberar_espacio(PAGINAS_VACUUM_POR_PASO)
+            
+            trabajo.avanzar(len(eliminados), imagenes_eliminadas=imagenes)
+            gestor_trabajos.notificar(trabajo)
+    
+    # Devolver el resto del espacio libre, en pasos cortos
+    while liberar_espacio(PAGINAS_VACUUM_POR_PASO) > 0:
+        pass
+    eliminar_carpetas_vacias()
+    
+    print(f"✓ Eliminados {trabajo.procesados} registros y sus imágenes")
+    difusor.publicar("registros_eliminados", {"cantidad": trabajo.procesados})
+    return f"Se eliminaron {trabajo.procesados} registros correctamente"
+
+
+def _eliminar_imagen_segura(ruta_imagen: str) -> bool:
     try:
-        # Obtener todos los registros para eliminar sus imágenes
-        registros = obtener_todos_registros(10000)  # Obtener todos
-        
-        # Eliminar todas las imágenes
-        for registro in registros:
-            if registro.get('ruta_imagen'):
-                ruta_imagen = os.path.join(BASE_DIR, registro['ruta_imagen'])
-                if os.path.exists(ruta_imagen):
-                    try:
-                        os.remove(ruta_imagen)
-                    except Exception as e:
-                        print(f"⚠️ No se pudo eliminar {ruta_imagen}: {e}")
-        
-        # Eliminar todos los registros de la BD
-        cantidad = eliminar_todos_registros()
-        
-        print(f"✓ Eliminados {cantidad} registros y sus imágenes")
-        
-        return JSONResponse(content={
-            "status": "success",
-            "mensaje": f"Se eliminaron {cantidad} registros correctamente"
-        })
+        return eliminar_imagen(ruta_imagen)
     except Exception as e:
-        print(f"Error eliminando todos los registros: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        print(f"⚠️ No se pudo eliminar {ruta_imagen}: {e}")
+        return False
+
+
+@app.delete("/api/registros")
+async def eliminar_todos_registros_endpoint():
+    """
+    Elimina todos los registros y sus imágenes en un trabajo en segundo plano.
+    Responde 202 con el ID del trabajo; el progreso se consulta en
+    GET /api/trabajos/{id} (y se publica como evento "trabajo").
+    """
+    trabajo = gestor_trabajos.en_curso("purga") or gestor_trabajos.iniciar("purga", _purgar_registros)
+    return JSONResponse(status_code=202, content={
+        "status": "accepted",
+        "mensaje": "Eliminación de registros en curso",
+        "trabajo": trabajo.a_dict()
+    })
 
 
-@app.get("/registros/{filename}")
-async def obtener_imagen(filename: str):
-    """Sirve las imágenes de los registros"""
+@app.get("/api/retencion")
+async def obtener_retencion():
+    """Reglas de retención vigentes y resultado del último ciclo"""
+    return JSONResponse(content={
+        "status": "success",
+        "configuracion": politica_retencion.configuracion(),
+        "ultimo_ciclo": politica_retencion.ultimo_resumen,
+        "bytes_imagenes": politica_retencion.bytes_imagenes
+    })
+
+
+@app.post("/api/retencion")
+async def ejecutar_retencion():
+    """Lanza un ciclo de retención ahora (responde 202 con el trabajo)"""
+    trabajo = _lanzar_retencion()
+    return JSONResponse(status_code=202, content={"status": "accepted", "trabajo": trabajo.a_dict()})
+
+
+@app.get("/api/trabajos")
+async def listar_trabajos():
+    """Trabajos en segundo plano recientes"""
+    return JSONResponse(content={
+        "status": "success",
+        "trabajos": [trabajo.a_dict() for trabajo in gestor_trabajos.listar()]
+    })
+
+
+@app.get("/api/trabajos/{trabajo_id}")
+async def obtener_trabajo(trabajo_id: int):
+    """Estado y progreso de un trabajo en segundo plano"""
+    trabajo = gestor_trabajos.obtener(trabajo_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return JSONResponse(content={"status": "success", "trabajo": trabajo.a_dict()})
+
+
+# Una imagen de registro nunca cambia (su nombre es el ID del registro)
+CACHE_IMAGEN_INMUTABLE = "public, max-age=31536000, immutable"
+
+
+def _etag_coincide(cabecera: Optional[str], etag: str) -> bool:
+    """Compara If-None-Match (puede traer varios ETags o *) con el ETag actual"""
+    if not cabecera:
+        return False
+    candidatos = [c.strip().removeprefix("W/") for c in cabecera.split(",")]
+    return "*" in candidatos or etag in candidatos
+
+
+def _interpretar_rango(cabecera: str, tamano: int) -> Optional[tuple]:
+    """
+    Interpreta un Range de un solo intervalo ("bytes=inicio-fin", "bytes=inicio-"
+    o "bytes=-sufijo"). Retorna (inicio, fin) inclusivos, o None si la cabecera
+    no se entiende o pide varios intervalos (se responde el archivo completo).
+    
+    Raises:
+        ValueError: Si el rango está fuera del archivo (416)
+    """
+    unidad, _, especificacion = cabecera.partition("=")
+    if unidad.strip().lower() != "bytes" or "," in especificacion:
+        return None
+    inicio_texto, guion, fin_texto = especificacion.strip().partition("-")
+    if not guion or not (inicio_texto.isdigit() or fin_texto.isdigit()):
+        return None
+    if not inicio_texto:
+        sufijo = int(fin_texto)
+        if sufijo == 0:
+            raise ValueError("Rango vacío")
+        return max(0, tamano - sufijo), tamano - 1
+    inicio = int(inicio_texto)
+    fin = min(int(fin_texto), tamano - 1) if fin_texto.isdigit() else tamano - 1
+    if inicio >= tamano or inicio > fin:
+        raise ValueError("Rango fuera del archivo")
+    return inicio, fin
+
+
+def _leer_segmento(ruta: str, inicio: int, fin: int) -> bytes:
+    with open(ruta, "rb") as f:
+        f.seek(inicio)
+        return f.read(fin - inicio + 1)
+
+
+def _stat_y_etag(ruta: str):
+    """os.stat + ETag del archivo (en un thread: ambos tocan el disco)"""
+    info = os.stat(ruta)
+    return info, etags_imagenes.obtener(ruta, info)
+
+
+async def _responder_archivo(request: Request, ruta: str, media_type: str) -> Response:
+    """
+    Sirve un archivo inmutable con ETag de contenido: 304 si el cliente ya
+    lo tiene, 206 para peticiones Range y caché "immutable" en el navegador.
+    """
+    info, etag = await asyncio.to_thread(_stat_y_etag, ruta)
+    cabeceras = {"ETag": etag, "Cache-Control": CACHE_IMAGEN_INMUTABLE, "Accept-Ranges": "bytes"}
+    
+    if _etag_coincide(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cabeceras)
+    
+    rango = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if rango and (if_range is None or if_range == etag):
+        try:
+            limites = _interpretar_rango(rango, info.st_size)
+        except ValueError:
+            return Response(status_code=416, headers={
+                **cabeceras, "Content-Range": f"bytes */{info.st_size}"
+            })
+        if limites is not None:
+            inicio, fin = limites
+            contenido = await asyncio.to_thread(_leer_segmento, ruta, inicio, fin)
+            return Response(content=contenido, status_code=206, media_type=media_type, headers={
+                **cabeceras, "Content-Range": f"bytes {inicio}-{fin}/{info.st_size}"
+            })
+    
+    return FileResponse(ruta, media_type=media_type, headers=cabeceras)
+
+
+@app.get("/registros/{ruta:path}")
+async def obtener_imagen(request: Request, ruta: str, tamano: Optional[str] = None,
+                         formato: str = "jpeg"):
+    """
+    Sirve las imágenes de los registros.
+    Acepta rutas nuevas (AAAA/MM/DD/camara/ID.jpg) y antiguas (IMAGE_*.jpg)
+    
+    Query params:
+    - tamano: "mini" (miniatura) o "media"; sin él se sirve la original
+    - formato: "jpeg" (por defecto) o "webp", solo para tamano
+    """
+    if tamano is not None and tamano not in TAMANOS:
+        raise HTTPException(status_code=400, detail=f"tamano debe ser uno de: {', '.join(TAMANOS)}")
+    if formato not in FORMATOS:
+        raise HTTPException(status_code=400, detail=f"formato debe ser uno de: {', '.join(FORMATOS)}")
+    
     try:
-        ruta_imagen = os.path.join(BASE_DIR, "registros", filename)
+        ruta_imagen = resolver_ruta(ruta)
         
-        if not os.path.exists(ruta_imagen):
+        if ruta_imagen is None or not os.path.isfile(ruta_imagen):
             raise HTTPException(status_code=404, detail="Imagen no encontrada")
         
-        return FileResponse(
-            ruta_imagen,
-            media_type="image/jpeg",
-            headers={"Cache-Control": "public, max-age=3600"}
-        )
+        media_type = "image/jpeg"
+        if tamano is not None:
+            # Se genera una sola vez y queda en la caché de derivados
+            ruta_imagen = await asyncio.to_thread(
+                cache_derivados.obtener, ruta_imagen, ruta, tamano, formato
+            )
+            media_type = FORMATOS[formato][1]
+        
+        return await _responder_archivo(request, ruta_imagen, media_type)
     except HTTPException:
         raise
     except Exception as e:
@@ -335,11 +1146,15 @@ async def iniciar_camara():
         
         # Iniciar main.py
         main_path = os.path.join(BASE_DIR, "main.py")
+        comando = [sys.executable, main_path]
+        if os.name != 'nt' and not os.environ.get("DISPLAY"):
+            comando.append("--headless")  # Servidor sin pantalla: sin ventanas de video
         camera_process = subprocess.Popen(
-            [sys.executable, main_path],
+            comando,
             cwd=BASE_DIR,
             creationflags=subprocess.CREATE_NEW_CONSOLE if os.name == 'nt' else 0
         )
+        difusor.publicar("camara", {"status": "running", "pid": camera_process.pid})
         
         return JSONResponse(content={
             "status": "success",
@@ -378,6 +1193,7 @@ async def detener_camara():
             parent.kill()
         
         camera_process = None
+        difusor.publicar("camara", {"status": "stopped"})
         
         # 🚦 APAGAR LED DEL ESP32 (sistema desactivado)
         try:
@@ -423,6 +1239,38 @@ async def estado_camara():
         })
 
 
+@app.get("/api/eventos")
+async def stream_eventos(request: Request):
+    """
+    Canal de eventos en tiempo real (Server-Sent Events).
+    
+    Eventos: registro_nuevo, registro_actualizado, registro_eliminado,
+    registros_eliminados, camara y resync (el cliente se quedó atrás y
+    debe pedir /api/registros?since_id=...).
+    """
+    suscripcion = difusor.suscribir()
+    
+    # Estado inicial: el cliente no necesita consultar /api/camera/status
+    activa = camera_process is not None and camera_process.poll() is None
+    suscripcion.entregar(_formatear_estado_camara(activa))
+    
+    async def generar():
+        async for evento in difusor.escuchar(suscripcion):
+            if await request.is_disconnected():
+                break
+            yield evento
+    
+    return StreamingResponse(generar(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # Sin buffering si hay un proxy nginx delante
+    })
+
+
+def _formatear_estado_camara(activa: bool) -> str:
+    datos = {"status": "running", "pid": camera_process.pid} if activa else {"status": "stopped"}
+    return formatear_evento("camara", datos)
+
+
 if __name__ == "__main__":
     import uvicorn
     print("🚀 Iniciando servidor API EPP...")
@@ -0,0 +1,129 @@
+"""
+Trabajos en segundo plano con progreso consultable
+Operaciones largas (ej. borrar todos los registros) se ejecutan en un hilo
+aparte; el endpoint responde de inmediato con el ID del trabajo y el
+progreso se consulta en GET /api/trabajos/{id}.
+"""
+import itertools
+import threading
+import traceback
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+# Estados de un trabajo
+TRABAJO_EN_COLA = "en_cola"
+TRABAJO_EN_CURSO = "en_curso"
+TRABAJO_COMPLETADO = "completado"
+TRABAJO_ERROR = "error"
+
+# Trabajos terminados que se recuerdan para consultar su resultado
+MAX_TRABAJOS_GUARDADOS = 50
+
+
+class Trabajo:
+    """Estado y progreso de un trabajo (lo actualiza la función que lo ejecuta)"""
+
+    def __init__(self, trabajo_id: int, tipo: str):
+        self.id = trabajo_id
+        self.tipo = tipo
+        self.estado = TRABAJO_EN_COLA
+        self.total = 0
+        self.procesados = 0
+        self.detalle: Dict = {}
+        self.mensaje = ""
+        self.creado_en = datetime.now().isoformat()
+        self.terminado_en: Optional[str] = None
+
+    def avanzar(self, cantidad: int, **detalle):
+        """Suma `cantidad` a procesados y acumula contadores de detalle"""
+        self.procesados += cantidad
+        for clave, valor in detalle.items():
+            self.detalle[clave] = self.detalle.get(clave, 0) + valor
+
+    @property
+    def terminado(self) -> bool:
+        return self.estado in (TRABAJO_COMPLETADO, TRABAJO_ERROR)
+
+    def a_dict(self) -> Dict:
+        progreso = 100.0 if self.terminado and self.estado == TRABAJO_COMPLETADO else (
+            round(100 * self.procesados / self.total, 1) if self.total else 0.0
+        )
+        return {
+            "id": self.id,
+            "tipo": self.tipo,
+            "estado": self.estado,
+            "total": self.total,
+            "procesados": self.procesados,
+            "progreso": min(progreso, 100.0),
+            "detalle": dict(self.detalle),
+            "mensaje": self.mensaje,
+            "creado_en": self.creado_en,
+            "terminado_en": self.terminado_en,
+        }
+
+
+class GestorTrabajos:
+    """
+    Ejecuta trabajos en hilos propios y guarda su estado.
+
+    Uso:
+        trabajo = gestor.iniciar("purga", funcion)   # funcion(trabajo) → mensaje final
+        gestor.obtener(trabajo.id).a_dict()
+    """
+
+    def __init__(self, al_actualizar: Optional[Callable[[Trabajo], None]] = None):
+        self._trabajos: "OrderedDict[int, Trabajo]" = OrderedDict()
+        self._contador = itertools.count(1)
+        self._lock = threading.Lock()
+        self._al_actualizar = al_actualizar
+
+    def iniciar(self, tipo: str, funcion: Callable[[Trabajo], Optional[str]]) -> Trabajo:
+        with self._lock:
+            trabajo = Trabajo(next(self._contador), tipo)
+            self._trabajos[trabajo.id] = trabajo
+            self._descartar_antiguos()
+
+        hilo = threading.Thread(target=self._ejecutar, args=(trabajo, funcion),
+                                name=f"trabajo-{trabajo.id}", daemon=True)
+        hilo.start()
+        return trabajo
+
+    def _ejecutar(self, trabajo: Trabajo, funcion: Callable[[Trabajo], Optional[str]]):
+        trabajo.estado = TRABAJO_EN_CURSO
+        self.notificar(trabajo)
+        try:
+            trabajo.mensaje = funcion(trabajo) or ""
+            trabajo.estado = TRABAJO_COMPLETADO
+        except Exception as e:
+            traceback.print_exc()
+            trabajo.mensaje = str(e)
+            trabajo.estado = TRABAJO_ERROR
+        trabajo.terminado_en = datetime.now().isoformat()
+        self.notificar(trabajo)
+
+    def notificar(self, trabajo: Trabajo):
+        """Avisa un cambio de progreso (ej. para publicarlo a los dashboards)"""
+        if self._al_actualizar:
+            try:
+                self._al_actualizar(trabajo)
+            except Exception as e:
+                print(f"⚠️ No se pudo notificar el trabajo {trabajo.id}: {e}")
+
+    def obtener(self, trabajo_id: int) -> Optional[Trabajo]:
+        return self._trabajos.get(trabajo_id)
+
+    def listar(self) -> List[Trabajo]:
+        return list(reversed(self._trabajos.values()))
+
+    def en_curso(self, tipo: str) -> Optional[Trabajo]:
+        """Trabajo no terminado de un tipo (para no lanzar dos purgas a la vez)"""
+        for trabajo in self._trabajos.values():
+            if trabajo.tipo == tipo and not trabajo.terminado:
+                return trabajo
+        return None
+
+    def _descartar_antiguos(self):
+        terminados = [t.id for t in self._trabajos.values() if t.terminado]
+        for trabajo_id in terminados[:max(0, len(self._trabajos) - MAX_TRABAJOS_GUARDADOS)]:
+            del self._trabajos[trabajo_id]
@@ -0,0 +1,31 @@
+"""
+Módulo Captura - Componentes del proceso de captura (main.py)
+==============================================================
+
+Piezas que usa main.py entre la inferencia y el backend:
+
+Componentes:
+- spool.py: Spool en disco (append-only) entre el sink y el envío al backend
+- detecciones.py: Detecciones de model_1 en columnas NumPy tipadas, creadas
+  una vez por frame, y codificación JSON con orjson (si está instalado)
+- muestreo.py: Qué frames se registran (cada X segundos de reloj real o al
+  cambiar el estado de cumplimiento)
+- deduplicador.py: Descarta muestras sin cambios (con un keep-alive) y cuenta
+  las repeticiones del último registro guardado
+- supervisor.py: Varias cámaras (camaras.json) en un solo pipeline, cada una
+  con su estado, y el LED del ESP32 combinado
+- seguimiento.py: Tracker de personas por IoU; un registro por persona
+  (entrada, salida y EPP acumulado) en lugar de uno por frame
+- motor_onnx.py: Inferencia local con ONNX Runtime (modelo YOLOv8 exportado),
+  misma salida model_1 que el workflow de Roboflow
+- pipeline_local.py: Lectura de las cámaras con OpenCV y lotes de frames para
+  motor_onnx (main.py --motor onnx, sin conexión)
+- anillo_frames.py: Anillo de frames en memoria compartida entre los procesos
+  decodificadores y la inferencia (lectura sin copias, frames viejos se
+  reescriben)
+- vista_previa.py: Ventanas de video en un thread aparte (último frame,
+  sin frenar la inferencia); se desactiva con --headless
+"""
+
+__version__ = "1.0.0"
+__author__ = "Sistema EPP"
@@ -0,0 +1,154 @@
+"""
+Anillo de frames en memoria compartida
+Un proceso decodificador por cámara escribe los frames en un bloque de
+multiprocessing.shared_memory dividido en `slots`; el proceso de
+inferencia los lee sin copiarlos (una vista NumPy sobre el slot).
+
+- Cada frame publicado lleva un número de secuencia creciente; el lector
+  solo toma el último y los saltos de secuencia son frames descartados.
+- El escritor nunca espera: reescribe el slot más antiguo (nunca el
+  último publicado ni el que tiene fijado el lector). Los frames viejos no
+  se encolan.
+- El lector fija el slot que está usando (tomar) hasta que termina con él
+  (liberar), así que la vista no cambia mientras el sink la procesa.
+
+Un escritor y un lector por anillo; el lock solo protege el cambio de
+slots (microsegundos), nunca la copia de píxeles.
+"""
+import multiprocessing
+from multiprocessing import shared_memory
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+SLOTS_POR_DEFECTO = 4  # Último publicado + fijado por el lector + uno escribiéndose + holgura
+RESOLUCION_MAXIMA = (1920, 1080)
+
+# Control del anillo (int64)
+_ULTIMO_SLOT, _ULTIMA_SECUENCIA, _TERMINADO, _FIJADO = range(4)
+# Cabecera de cada slot (int64); secuencia -1 = escribiéndose
+_SECUENCIA, _FRAME_ID, _TIMESTAMP_US, _ALTO, _ANCHO = range(5)
+_CAMPOS_CABECERA = 5
+
+
+class FrameAnillo(NamedTuple):
+    secuencia: int
+    frame_id: int
+    timestamp_us: int
+    imagen: np.ndarray  # Vista sobre la memoria compartida (válida hasta liberar())
+
+
+class AnilloFrames:
+    """
+    Uso (con fork, el hijo hereda el objeto):
+        anillo = AnilloFrames(ancho_max=1920, alto_max=1080)
+        # proceso decodificador
+        destino = anillo.reservar(alto, ancho)
+        captura.read(destino)            # decodifica directo en el slot
+        anillo.publicar(frame_id, timestamp_us)
+        # proceso de inferencia
+        frame = anillo.tomar(ultima_secuencia_vista)
+        ...usar frame.imagen...
+        anillo.liberar()
+    """
+
+    def __init__(self, slots: int = SLOTS_POR_DEFECTO,
+                 ancho_max: int = RESOLUCION_MAXIMA[0], alto_max: int = RESOLUCION_MAXIMA[1],
+                 contexto=multiprocessing):
+        if slots < 3:
+            raise ValueError("El anillo necesita al menos 3 slots")
+        self.slots = slots
+        self.ancho_max = ancho_max
+        self.alto_max = alto_max
+        self._bytes_slot = alto_max * ancho_max * 3
+        bytes_control = 4 * 8
+        bytes_cabeceras = slots * _CAMPOS_CABECERA * 8
+        self._memoria = shared_memory.SharedMemory(
+            create=True, size=bytes_control + bytes_cabeceras + slots * self._bytes_slot)
+        buffer = self._memoria.buf
+        self._control = np.ndarray((4,), dtype=np.int64, buffer=buffer)
+        self._cabeceras = np.ndarray((slots, _CAMPOS_CABECERA), dtype=np.int64,
+                                     buffer=buffer, offset=bytes_control)
+        self._datos = np.ndarray((slots, self._bytes_slot), dtype=np.uint8,
+                                 buffer=buffer, offset=bytes_control + bytes_cabeceras)
+        self._control[:] = (-1, 0, 0, -1)
+        self._cabeceras[:] = 0
+        self._lock = contexto.Lock()
+        self._escribiendo = -1  # Solo en el proceso escritor
+
+    # ------------------------------------------------------------------------
+    # Escritor (proceso decodificador)
+    # ------------------------------------------------------------------------
+
+    def reservar(self, alto: int, ancho: int) -> np.ndarray:
+        """Slot libre para el próximo frame, como vista (alto, ancho, 3) donde escribirlo"""
+        if alto > self.alto_max or ancho > self.ancho_max:
+            raise ValueError(f"Frame {ancho}x{alto} mayor que el anillo ({self.ancho_max}x{self.alto_max})")
+        with self._lock:
+            ultimo, fijado = self._control[_ULTIMO_SLOT], self._control[_FIJADO]
+            # El más antiguo que no sea el último publicado ni el que usa el lector
+            slot = next(s for s in ((ultimo + i) % self.slots for i in range(1, self.slots + 1))
+                        if s != ultimo and s != fijado)
+            self._cabeceras[slot, _SECUENCIA] = -1
+        self._escribiendo = slot
+        self._cabeceras[slot, _ALTO] = alto
+        self._cabeceras[slot, _ANCHO] = ancho
+        return self._vista(slot, alto, ancho)
+
+    def publicar(self, frame_id: int, timestamp_us: int) -> int:
+        """Marca el slot reservado como el último frame. Retorna su secuencia"""
+        slot, self._escribiendo = self._escribiendo, -1
+        with self._lock:
+            secuencia = int(self._control[_ULTIMA_SECUENCIA]) + 1
+            self._cabeceras[slot, _FRAME_ID] = frame_id
+            self._cabeceras[slot, _TIMESTAMP_US] = timestamp_us
+            self._cabeceras[slot, _SECUENCIA] = secuencia
+            self._control[_ULTIMO_SLOT] = slot
+            self._control[_ULTIMA_SECUENCIA] = secuencia
+        return secuencia
+
+    def marcar_terminado(self):
+        """La fuente terminó (fin de un archivo de video)"""
+        self._control[_TERMINADO] = 1
+
+    # ------------------------------------------------------------------------
+    # Lector (proceso de inferencia)
+    # ------------------------------------------------------------------------
+
+    @property
+    def terminado(self) -> bool:
+        return bool(self._control[_TERMINADO])
+
+    @property
+    def ultima_secuencia(self) -> int:
+        return int(self._control[_ULTIMA_SECUENCIA])
+
+    def tomar(self, vista_hasta: int = 0) -> Optional[FrameAnillo]:
+        """
+        Fija y retorna el último frame si su secuencia es mayor que
+        `vista_hasta` (None si no hay uno nuevo). Reemplaza el fijado anterior.
+        """
+        with self._lock:
+            slot = int(self._control[_ULTIMO_SLOT])
+            if slot < 0:
+                return None
+            secuencia, frame_id, timestamp_us, alto, ancho = self._cabeceras[slot].tolist()
+            if secuencia <= vista_hasta:
+                return None
+            self._control[_FIJADO] = slot
+        return FrameAnillo(secuencia, frame_id, timestamp_us, self._vista(slot, alto, ancho))
+
+    def liberar(self):
+        """El lector terminó con el frame tomado: su slot se puede reescribir"""
+        with self._lock:
+            self._control[_FIJADO] = -1
+
+    def cerrar(self, eliminar: bool = True):
+        """Libera las vistas y (en el proceso que lo creó) elimina el bloque compartido"""
+        self._control = self._cabeceras = self._datos = None
+        self._memoria.close()
+        if eliminar:
+            self._memoria.unlink()
+
+    def _vista(self, slot: int, alto: int, ancho: int) -> np.ndarray:
+        return self._datos[slot, :alto * ancho * 3].reshape(alto, ancho, 3)
@@ -0,0 +1,112 @@
+"""
+Deduplicador de registros sin cambios
+En una escena quieta cada muestra trae las mismas detecciones y casi la
+misma imagen: guardarlas todas solo llena la BD y el disco. Entre el
+muestreo y el spool, este paso compara la firma de cada muestra (conteo de
+clases + EPP que le falta a cada persona según asociar_epp) con el último
+registro persistido y solo deja pasar:
+
+- muestras con detecciones distintas (cambió el conteo o a quién le falta
+  qué EPP, aunque los conteos sean iguales)
+- una muestra cada `intervalo_keepalive` segundos aunque nada cambie
+
+Las muestras descartadas se cuentan; el total viaja con el siguiente
+registro persistido ("repite_anterior") y el backend lo guarda en la
+columna repeticiones del registro anterior.
+"""
+import time
+from collections import Counter
+from typing import Callable, Dict, Optional
+
+from captura.detecciones import Detecciones
+
+INTERVALO_KEEPALIVE = 60.0
+
+
+def firma_detecciones(detecciones: Optional[Detecciones]) -> tuple:
+    """
+    (conteo de clases ordenado, cuántas personas tienen cada combinación de
+    EPP faltante). Mismo conteo no implica mismo cumplimiento: un casco que
+    pasa de una persona al suelo cambia la segunda parte. Sin cajas solo
+    hay conteo.
+    """
+    if detecciones is None:
+        return ((), ())
+    conteo = tuple(sorted(Counter(detecciones.clases).items()))
+    asociado = detecciones.epp_por_persona()
+    if asociado is None:
+        return conteo, ()
+    _, epp = asociado
+    faltantes = Counter(map(tuple, (~epp).tolist()))
+    return conteo, tuple(sorted(faltantes.items()))
+
+
+class _UltimoPersistido:
+    __slots__ = ("firma", "clave", "momento", "repeticiones", "ultima_fecha")
+
+    def __init__(self, firma: tuple, momento: float):
+        self.firma = firma
+        self.clave: Optional[str] = None
+        self.momento = momento
+        self.repeticiones = 0
+        self.ultima_fecha: Optional[str] = None
+
+
+class Deduplicador:
+    """
+    Uso:
+        if deduplicador.debe_persistir("cam1", detecciones, fecha_hora):
+            metadata = ...
+            repeticion = deduplicador.marcar_persistido("cam1", metadata["clave_idempotencia"])
+            if repeticion:
+                metadata["repite_anterior"] = repeticion
+    """
+
+    def __init__(self, intervalo_keepalive: float = INTERVALO_KEEPALIVE,
+                 reloj: Callable[[], float] = time.monotonic):
+        self.intervalo_keepalive = intervalo_keepalive
+        self._reloj = reloj
+        self._camaras: Dict[str, _UltimoPersistido] = {}
+        self._aceptadas: Dict[str, tuple] = {}  # cámara → (firma, momento) aún sin marcar
+        self.descartados = 0
+
+    def debe_persistir(self, camara: str, detecciones: Optional[Detecciones], fecha_hora: str) -> bool:
+        """
+        True si la muestra se debe guardar. Si no, se cuenta como repetición
+        del último registro persistido de la cámara.
+        """
+        firma = firma_detecciones(detecciones)
+        ahora = self._reloj()
+        ultimo = self._camaras.get(camara)
+        if (ultimo is not None and ultimo.firma == firma
+                and ahora - ultimo.momento < self.intervalo_keepalive):
+            ultimo.repeticiones += 1
+            ultimo.ultima_fecha = fecha_hora
+            self.descartados += 1
+            return False
+
+        self._aceptadas[camara] = (firma, ahora)
+        return True
+
+    def marcar_persistido(self, camara: str, clave_idempotencia: str) -> Optional[Dict]:
+        """
+        Registra la muestra que se acaba de aceptar con debe_persistir().
+
+        Returns:
+            Repeticiones del registro anterior para enviarlas al backend
+            ({"clave_idempotencia", "repeticiones", "ultima_repeticion"}),
+            o None si no hubo repeticiones
+        """
+        firma, momento = self._aceptadas.pop(camara)
+        anterior = self._camaras.get(camara)
+        nuevo = _UltimoPersistido(firma, momento)
+        nuevo.clave = clave_idempotencia
+        self._camaras[camara] = nuevo
+
+        if anterior is None or not anterior.repeticiones or not anterior.clave:
+            return None
+        return {
+            "clave_idempotencia": anterior.clave,
+            "repeticiones": anterior.repeticiones,
+            "ultima_repeticion": anterior.ultima_fecha,
+        }
@@ -0,0 +1,139 @@
+"""
+Detecciones compactas de un frame
+Las detecciones de model_1 (sv.Detections del workflow o el dict de
+motor_onnx) se convierten UNA vez por frame a columnas NumPy tipadas
+(cajas, confianzas, ids de clase) más la tupla de nombres de clase. El
+mismo objeto lo usan el seguimiento, el muestreo, el resumen en consola,
+el ESP32 y la metadata que va al backend, sin recorrer el resultado con
+__dict__ ni convertir arrays a listas.
+
+codificar_json() serializa la metadata con orjson (arrays NumPy nativos,
+sin pasar por listas de Python); sin orjson se usa json con el mismo
+resultado.
+"""
+import json
+from typing import Optional, Tuple
+
+import numpy as np
+
+from backend.cumplimiento import asociar_epp
+
+try:
+    import orjson
+except ImportError:  # Opcional: json de la biblioteca estándar como respaldo
+    orjson = None
+
+
+_SIN_CALCULAR = object()
+
+
+class Detecciones:
+    """
+    Uso:
+        detecciones = Detecciones.desde_resultado(result)
+        detecciones.clases           # ("person", "helmet", ...)
+        detecciones.a_model_1()      # Para la metadata (mismo formato que model_1)
+    """
+
+    __slots__ = ("xyxy", "confianza", "clase_id", "clases", "_epp_por_persona")
+
+    def __init__(self, xyxy: np.ndarray, confianza: np.ndarray, clase_id: np.ndarray,
+                 clases: Tuple[str, ...]):
+        self.xyxy = xyxy              # (N, 4) float32 contiguo
+        self.confianza = confianza    # (N,) float32
+        self.clase_id = clase_id      # (N,) int32
+        self.clases = clases          # N nombres de clase (str de Python)
+        self._epp_por_persona = _SIN_CALCULAR
+
+    def __len__(self) -> int:
+        return len(self.clases)
+
+    @classmethod
+    def vacias(cls) -> "Detecciones":
+        return cls(np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32),
+                   np.zeros(0, dtype=np.int32), ())
+
+    @classmethod
+    def desde_resultado(cls, result) -> Optional["Detecciones"]:
+        """Detecciones de result["model_1"], o None si el resultado no trae modelo"""
+        predicciones = result.get("model_1")
+        if predicciones is None:
+            return None
+        if isinstance(predicciones, dict):
+            campo = predicciones.get
+        else:
+            # sv.Detections: se leen sus arrays tal cual
+            campo = lambda nombre: getattr(predicciones, nombre, None)
+
+        datos = campo("data") or {}
+        nombres = datos.get("class_name")
+        if nombres is None:
+            return cls.vacias()
+        clases = tuple(np.asarray(nombres).tolist())
+        cantidad = len(clases)
+
+        xyxy = campo("xyxy")
+        confianza = campo("confidence")
+        clase_id = campo("class_id")
+        return cls(
+            np.ascontiguousarray(xyxy, dtype=np.float32).reshape(-1, 4) if xyxy is not None
+            else np.zeros((0, 4), dtype=np.float32),
+            np.ascontiguousarray(confianza, dtype=np.float32).reshape(-1) if confianza is not None
+            else np.ones(cantidad, dtype=np.float32),
+            np.ascontiguousarray(clase_id, dtype=np.int32).reshape(-1) if clase_id is not None
+            else np.full(cantidad, -1, dtype=np.int32),
+            clases,
+        )
+
+    def epp_por_persona(self) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Cajas de las personas (P, 4) y si cada una tiene casco, chaleco y
+        gafas (P, 3) según asociar_epp, o None si model_1 no trae cajas.
+        Se calcula una vez por frame (lo usan el seguimiento, el muestreo
+        y el deduplicador).
+        """
+        if self._epp_por_persona is _SIN_CALCULAR:
+            asociacion = asociar_epp(self.a_model_1())
+            if asociacion is None:
+                self._epp_por_persona = None
+            else:
+                epp = np.stack([asociacion[tipo] >= 0 for tipo in ("Casco", "Chaleco", "Gafas")], axis=1)
+                self._epp_por_persona = (asociacion["Persona"], epp.reshape(-1, 3))
+        return self._epp_por_persona
+
+    def a_model_1(self) -> dict:
+        """
+        model_1 para la metadata y para asociar_epp: xyxy, confidence,
+        class_id y data.class_name (lo único que usa el backend). Los arrays
+        se comparten, no se copian.
+        """
+        return {
+            "xyxy": self.xyxy,
+            "confidence": self.confianza,
+            "class_id": self.clase_id,
+            "data": {"class_name": list(self.clases)},
+        }
+
+
+def _a_json_estandar(obj):
+    """default= de json.dumps para lo que orjson serializa de forma nativa"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    raise TypeError(f"{type(obj).__name__} no es serializable a JSON")
+
+
+def codificar_json(obj, indentar: bool = False) -> bytes:
+    """JSON en UTF-8 de metadata con arrays NumPy (orjson si está instalado)"""
+    if orjson is not None:
+        opciones = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if indentar else 0)
+        return orjson.dumps(obj, default=_a_json_estandar, option=opciones)
+    return json.dumps(obj, ensure_ascii=False, default=_a_json_estandar,
+                      indent=2 if indentar else None).encode("utf-8")
+
+
+def decodificar_json(datos: bytes):
+    return orjson.loads(datos) if orjson is not None else json.loads(datos)
@@ -0,0 +1,216 @@
+"""
+Motor de inferencia local con ONNX Runtime (sin conexión)
+Alternativa al workflow alojado de Roboflow: carga un detector exportado a
+ONNX (YOLOv8: `yolo export model=best.pt format=onnx`) y procesa en un solo
+session.run los frames de todas las cámaras (un lote).
+
+La salida de cada frame tiene la misma forma que model_1 del workflow
+(sv.Detections): xyxy, confidence, class_id y data["class_name"], así que
+procesar_frame, calcular_cumplimiento y calcular_color_led la consumen sin
+cambios.
+"""
+import ast
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+try:
+    import onnxruntime as ort
+except ImportError:  # Solo se necesita con --motor onnx
+    ort = None
+
+TAMANO_ENTRADA = 640
+UMBRAL_CONFIANZA = 0.4
+UMBRAL_NMS = 0.5
+MAX_DETECCIONES = 300
+
+# Relleno del letterbox (gris, como en el entrenamiento de YOLO)
+COLOR_RELLENO = (114, 114, 114)
+
+
+def crear_opciones_sesion(hilos_intra: Optional[int] = None, hilos_inter: int = 1,
+                          ruta_optimizado: Optional[str] = None, optimizar: bool = True):
+    """
+    SessionOptions para CPU:
+    - todas las optimizaciones de grafo (fusiones, constantes plegadas)
+    - hilos intra-op = núcleos físicos aprox. (un lote grande usa todos)
+    - inter-op secuencial: un detector no tiene ramas que paralelizar
+    - ruta_optimizado: además guarda ahí el grafo ya optimizado
+    - optimizar=False: para cargar un grafo que ya se optimizó
+    """
+    opciones = ort.SessionOptions()
+    opciones.graph_optimization_level = (ort.GraphOptimizationLevel.ORT_ENABLE_ALL if optimizar
+                                         else ort.GraphOptimizationLevel.ORT_DISABLE_ALL)
+    opciones.intra_op_num_threads = hilos_intra or max(1, (os.cpu_count() or 2) // 2)
+    opciones.inter_op_num_threads = hilos_inter
+    opciones.execution_mode = (ort.ExecutionMode.ORT_SEQUENTIAL if hilos_inter <= 1
+                               else ort.ExecutionMode.ORT_PARALLEL)
+    opciones.enable_mem_pattern = True
+    opciones.enable_cpu_mem_arena = True
+    if ruta_optimizado:
+        opciones.optimized_model_filepath = ruta_optimizado
+    return opciones
+
+
+def clases_del_modelo(sesion) -> Optional[List[str]]:
+    """Nombres de clase guardados por ultralytics en la metadata del ONNX ("names")"""
+    nombres = sesion.get_modelmeta().custom_metadata_map.get("names")
+    if not nombres:
+        return None
+    try:
+        por_indice = ast.literal_eval(nombres)
+    except (ValueError, SyntaxError):
+        return None
+    return [por_indice[i] for i in sorted(por_indice)]
+
+
+def letterbox(imagen: np.ndarray, tamano: int) -> Tuple[np.ndarray, float, Tuple[int, int]]:
+    """Escala manteniendo la proporción y rellena hasta tamano×tamano. Retorna (imagen, escala, (dx, dy))"""
+    alto, ancho = imagen.shape[:2]
+    escala = min(tamano / alto, tamano / ancho)
+    nuevo_ancho, nuevo_alto = round(ancho * escala), round(alto * escala)
+    if (nuevo_ancho, nuevo_alto) != (ancho, alto):
+        imagen = cv2.resize(imagen, (nuevo_ancho, nuevo_alto), interpolation=cv2.INTER_LINEAR)
+    dx, dy = (tamano - nuevo_ancho) // 2, (tamano - nuevo_alto) // 2
+    imagen = cv2.copyMakeBorder(imagen, dy, tamano - nuevo_alto - dy, dx, tamano - nuevo_ancho - dx,
+                                cv2.BORDER_CONSTANT, value=COLOR_RELLENO)
+    return imagen, escala, (dx, dy)
+
+
+class MotorONNX:
+    """
+    Uso:
+        motor = MotorONNX("modelos/epp.onnx")
+        detecciones = motor.inferir([frame_cam1, frame_cam2])   # una por frame
+    """
+
+    def __init__(self, ruta_modelo: str, clases: Optional[Sequence[str]] = None,
+                 tamano_entrada: int = TAMANO_ENTRADA,
+                 umbral_confianza: float = UMBRAL_CONFIANZA,
+                 umbral_nms: float = UMBRAL_NMS,
+                 hilos_intra: Optional[int] = None,
+                 proveedores: Sequence[str] = ("CPUExecutionProvider",),
+                 ruta_optimizado: Optional[str] = None):
+        if ort is None:
+            raise RuntimeError("El motor ONNX requiere onnxruntime (pip install onnxruntime)")
+        if not os.path.exists(ruta_modelo):
+            raise FileNotFoundError(f"No existe el modelo ONNX: {ruta_modelo}")
+
+        self.sesion = self._crear_sesion(ruta_modelo, ruta_optimizado, hilos_intra, list(proveedores))
+        entrada = self.sesion.get_inputs()[0]
+        self._nombre_entrada = entrada.name
+        self._nombre_salida = self.sesion.get_outputs()[0].name
+        # Modelos exportados sin lote dinámico solo aceptan lotes de un frame
+        self._lote_fijo = entrada.shape[0] if isinstance(entrada.shape[0], int) else None
+        self.tamano_entrada = tamano_entrada
+        self.umbral_confianza = umbral_confianza
+        self.umbral_nms = umbral_nms
+        self.clases = np.array(list(clases or clases_del_modelo(self.sesion) or []))
+        if not len(self.clases):
+            raise ValueError("El modelo no trae nombres de clase: pasarlos en `clases`")
+
+        # IO binding: la entrada se enlaza sin copias extra y la salida la
+        # reserva ORT una vez por forma de lote
+        self._enlace = self.sesion.io_binding()
+
+    @staticmethod
+    def _crear_sesion(ruta_modelo: str, ruta_optimizado: Optional[str],
+                      hilos_intra: Optional[int], proveedores: List[str]):
+        """
+        Sin ruta_optimizado el grafo se optimiza en memoria en cada arranque.
+        Con ruta_optimizado se reutiliza el grafo guardado si es más nuevo
+        que el modelo; si no existe, está viejo o no carga (ej. se optimizó
+        en otro equipo: ORT_ENABLE_ALL usa kernels de este hardware) se
+        regenera. Si la carpeta no admite escritura se sigue sin guardarlo.
+        """
+        if ruta_optimizado:
+            if (os.path.exists(ruta_optimizado)
+                    and os.path.getmtime(ruta_optimizado) >= os.path.getmtime(ruta_modelo)):
+                try:
+                    return ort.InferenceSession(
+                        ruta_optimizado,
+                        sess_options=crear_opciones_sesion(hilos_intra, optimizar=False),
+                        providers=proveedores
+                    )
+                except Exception as e:
+                    print(f"⚠️ No se pudo cargar el modelo optimizado {ruta_optimizado} ({e}), se regenera")
+            if not os.access(os.path.dirname(os.path.abspath(ruta_optimizado)), os.W_OK):
+                print(f"⚠️ Sin permiso de escritura para {ruta_optimizado}: el modelo se optimiza sin guardarlo")
+                ruta_optimizado = None
+        return ort.InferenceSession(
+            ruta_modelo,
+            sess_options=crear_opciones_sesion(hilos_intra, ruta_optimizado=ruta_optimizado),
+            providers=proveedores
+        )
+
+    def inferir(self, imagenes: List[np.ndarray]) -> List[Dict]:
+        """Detecciones (forma model_1) de cada imagen BGR, en el mismo orden"""
+        if not imagenes:
+            return []
+        paso = self._lote_fijo or len(imagenes)
+        resultados = []
+        for inicio in range(0, len(imagenes), paso):
+            resultados += self._inferir_lote(imagenes[inicio:inicio + paso])
+        return resultados
+
+    def _inferir_lote(self, imagenes: List[np.ndarray]) -> List[Dict]:
+        preparadas, escalas, desplazamientos = zip(*(letterbox(imagen, self.tamano_entrada)
+                                                     for imagen in imagenes))
+        # (B, 3, H, W) float32 RGB 0..1 en una sola llamada
+        lote = cv2.dnn.blobFromImages(list(preparadas), scalefactor=1 / 255.0, swapRB=True)
+
+        self._enlace.bind_cpu_input(self._nombre_entrada, lote)
+        self._enlace.bind_output(self._nombre_salida)
+        self.sesion.run_with_iobinding(self._enlace)
+        salida = self._enlace.copy_outputs_to_cpu()[0]
+
+        return [
+            self._decodificar(prediccion, escala, desplazamiento, imagen.shape[:2])
+            for prediccion, escala, desplazamiento, imagen in zip(salida, escalas, desplazamientos, imagenes)
+        ]
+
+    def _decodificar(self, prediccion: np.ndarray, escala: float, desplazamiento: Tuple[int, int],
+                     forma: Tuple[int, int]) -> Dict:
+        """Salida YOLOv8 (4 + clases, N) → cajas xyxy en píxeles de la imagen original + NMS"""
+        prediccion = prediccion.T                                   # (N, 4 + clases)
+        puntajes = prediccion[:, 4:]
+        class_id = puntajes.argmax(axis=1)
+        confianza = puntajes[np.arange(len(puntajes)), class_id]
+        candidatos = confianza >= self.umbral_confianza
+        centros, class_id, confianza = prediccion[candidatos, :4], class_id[candidatos], confianza[candidatos]
+
+        # cx, cy, w, h (entrada del modelo) → x, y, w, h en la imagen original
+        dx, dy = desplazamiento
+        cajas = np.empty_like(centros)
+        cajas[:, 0] = (centros[:, 0] - centros[:, 2] / 2 - dx) / escala
+        cajas[:, 1] = (centros[:, 1] - centros[:, 3] / 2 - dy) / escala
+        cajas[:, 2:] = centros[:, 2:] / escala
+
+        conservar = cv2.dnn.NMSBoxesBatched(cajas.tolist(), confianza.tolist(), class_id.tolist(),
+                                            self.umbral_confianza, self.umbral_nms) if len(cajas) else []
+        conservar = np.asarray(conservar, dtype=np.intp).reshape(-1)[:MAX_DETECCIONES]
+
+        alto, ancho = forma
+        xyxy = np.concatenate([cajas[conservar, :2], cajas[conservar, :2] + cajas[conservar, 2:]], axis=1)
+        xyxy = np.clip(xyxy, 0, [ancho, alto, ancho, alto]).astype(np.float32)
+        return {
+            "xyxy": xyxy,
+            "confidence": confianza[conservar].astype(np.float32),
+            "class_id": class_id[conservar],
+            "data": {"class_name": self.clases[class_id[conservar]]},
+        }
+
+
+def anotar(imagen: np.ndarray, detecciones: Dict) -> np.ndarray:
+    """Copia de la imagen con las cajas y clases dibujadas (como output_image del workflow)"""
+    anotada = imagen.copy()
+    for (x1, y1, x2, y2), clase, confianza in zip(detecciones["xyxy"].astype(int).tolist(),
+                                                  detecciones["data"]["class_name"],
+                                                  detecciones["confidence"].tolist()):
+        color = (0, 200, 0) if clase == "person" else (255, 160, 0)
+        cv2.rectangle(anotada, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(anotada, f"{clase} {confianza:.2f}", (x1, max(12, y1 - 4)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.45, color, 1, cv2.LINE_AA)
+    return anotada
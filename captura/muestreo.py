@@ -0,0 +1,122 @@
+"""
+Planificador de muestreo por tiempo real
+Decide qué frames del stream se registran en la BD. En lugar de contar
+frames (cada N frames ≈ cada X segundos solo si los FPS no cambian), usa
+el reloj monotónico: cada cámara se registra cada `intervalo` segundos sin
+importar a cuántos FPS llegue el video.
+
+Además se registra de inmediato cuando cambia el estado de cumplimiento
+(ej. aparece una persona sin casco), con un mínimo entre capturas por
+cambio para que el parpadeo del detector no dispare ráfagas. El estado
+sale del EPP asignado a cada persona (asociar_epp), no del conteo de
+clases: un casco que pasa de la cabeza de alguien al suelo es un cambio.
+"""
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from backend.cumplimiento import contar_detecciones
+from captura.detecciones import Detecciones
+
+# Motivos de captura
+MOTIVO_INICIO = "inicio"
+MOTIVO_INTERVALO = "intervalo"
+MOTIVO_CAMBIO = "cambio_estado"
+
+INTERVALO_POR_DEFECTO = 5.0
+INTERVALO_MINIMO_CAMBIO = 1.0
+
+
+def estado_cumplimiento(detecciones: Optional[Detecciones]) -> Tuple[bool, bool, bool, bool]:
+    """
+    Resumen del cumplimiento de un frame para detectar cambios:
+    (hay personas, a alguna le falta casco, chaleco, gafas)
+
+    Con cajas se usa el EPP asignado a cada persona; sin cajas (solo
+    nombres de clase) se comparan los conteos como respaldo.
+    """
+    if detecciones is None:
+        return (False, False, False, False)
+    asociado = detecciones.epp_por_persona()
+    if asociado is not None:
+        personas, epp = asociado
+        faltan = (~epp).any(axis=0).tolist()
+        return (len(personas) > 0, faltan[0], faltan[1], faltan[2])
+
+    conteo = contar_detecciones(list(detecciones.clases))
+    personas = conteo["personas"]
+    return (
+        personas > 0,
+        conteo["cascos"] < personas,
+        conteo["chalecos"] < personas,
+        conteo["gafas"] < personas,
+    )
+
+
+class _EstadoCamara:
+    __slots__ = ("proxima", "ultima", "estado")
+
+    def __init__(self, ahora: float, intervalo: float, estado):
+        self.proxima = ahora + intervalo
+        self.ultima = ahora
+        self.estado = estado
+
+
+class PlanificadorMuestreo:
+    """
+    Uso:
+        planificador = PlanificadorMuestreo({"cam1": 5.0, "patio": 10.0})
+        motivo = planificador.evaluar("cam1", estado_cumplimiento(detecciones))
+        if motivo:
+            ...registrar el frame...
+    """
+
+    def __init__(self, intervalos: Optional[Dict[str, float]] = None,
+                 intervalo_por_defecto: float = INTERVALO_POR_DEFECTO,
+                 intervalo_minimo_cambio: float = INTERVALO_MINIMO_CAMBIO,
+                 reloj: Callable[[], float] = time.monotonic):
+        self.intervalos = dict(intervalos or {})
+        self.intervalo_por_defecto = intervalo_por_defecto
+        self.intervalo_minimo_cambio = intervalo_minimo_cambio
+        self._reloj = reloj
+        self._camaras: Dict[str, _EstadoCamara] = {}
+
+    def intervalo(self, camara: str) -> float:
+        return self.intervalos.get(camara, self.intervalo_por_defecto)
+
+    def evaluar(self, camara: str, estado=None) -> Optional[str]:
+        """
+        Indica si el frame actual de `camara` se debe registrar.
+
+        Args:
+            camara: ID de la cámara
+            estado: Estado de cumplimiento del frame (None = no evaluar cambios)
+
+        Returns:
+            Motivo de la captura (MOTIVO_*) o None si el frame se salta
+        """
+        ahora = self._reloj()
+        intervalo = self.intervalo(camara)
+        camara_estado = self._camaras.get(camara)
+        if camara_estado is None:
+            self._camaras[camara] = _EstadoCamara(ahora, intervalo, estado)
+            return MOTIVO_INICIO
+
+        if ahora >= camara_estado.proxima:
+            motivo = MOTIVO_INTERVALO
+            # Mantener la grilla (sin deriva); si el stream estuvo detenido,
+            # no recuperar las capturas perdidas en ráfaga
+            camara_estado.proxima += intervalo
+            if camara_estado.proxima <= ahora:
+                camara_estado.proxima = ahora + intervalo
+        elif (estado is not None and estado != camara_estado.estado
+              and ahora - camara_estado.ultima >= self.intervalo_minimo_cambio):
+            motivo = MOTIVO_CAMBIO
+            camara_estado.proxima = ahora + intervalo
+        else:
+            return None
+
+        camara_estado.ultima = ahora
+        if estado is not None:
+            camara_estado.estado = estado
+        return motivo
+
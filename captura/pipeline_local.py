@@ -0,0 +1,374 @@
+"""
+Pipeline de inferencia local (sin conexión)
+Reemplazo de InferencePipeline.init_with_workflow para --motor onnx: lee
+las cámaras con OpenCV, junta el último frame de cada una en un lote y lo
+pasa por MotorONNX (captura/motor_onnx.py). Llama a on_prediction con la
+misma forma que el pipeline de Roboflow, así que SupervisorCamaras.sink y
+procesar_frame no cambian:
+
+- una fuente: on_prediction(resultado, frame)
+- varias: on_prediction([resultados], [frames]) alineadas por fuente,
+  con None en las fuentes sin frame nuevo
+
+Cada resultado es {"model_1": detecciones, "output_image": ImagenSalida}.
+
+Con procesos=True (POSIX) cada cámara se decodifica en su propio proceso
+y los frames llegan por un AnilloFrames en memoria compartida
+(captura/anillo_frames.py): la inferencia y el sink (JPEG, spool) leen el
+slot sin copiarlo, en otro núcleo que el decodificador. En Windows (sin
+fork) se usan threads.
+
+Los decodificadores se crean con fork: un fork con otros threads vivos
+puede dejar al hijo bloqueado en un lock que tenía otro thread (ej. el de
+stdout). main.py los inicia con iniciar_lectores() antes de arrancar
+workers, el servidor de métricas y la sesión de ONNX Runtime.
+"""
+import multiprocessing
+import threading
+import time
+from datetime import datetime
+from typing import Callable, List, NamedTuple, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+from captura.anillo_frames import RESOLUCION_MAXIMA, AnilloFrames
+from captura.motor_onnx import MotorONNX, anotar
+
+# Espera entre reconexiones de una cámara caída (se duplica hasta el máximo)
+RECONEXION_INICIAL = 1.0
+RECONEXION_MAXIMA = 30.0
+
+
+class FrameLocal(NamedTuple):
+    """Los campos de VideoFrame que usa procesar_frame"""
+    image: np.ndarray
+    frame_id: int
+    frame_timestamp: datetime
+    source_id: int
+
+
+class ImagenSalida:
+    """Como WorkflowImageData: la imagen anotada se dibuja solo si alguien la pide"""
+
+    def __init__(self, imagen: np.ndarray, detecciones: dict):
+        self._imagen = imagen
+        self._detecciones = detecciones
+        self._anotada: Optional[np.ndarray] = None
+
+    @property
+    def numpy_image(self) -> np.ndarray:
+        if self._anotada is None:
+            self._anotada = anotar(self._imagen, self._detecciones)
+        return self._anotada
+
+
+def leer_fuente(referencia: Union[str, int], source_id: int, continuar: Callable[[], bool],
+                leer: Callable[[cv2.VideoCapture], bool]) -> bool:
+    """
+    Abre la fuente y llama a leer(captura) mientras continuar() y leer()
+    sean verdaderos; los streams caídos se reabren con espera creciente.
+    Retorna True si la fuente terminó (archivo de video al final).
+    """
+    es_archivo = isinstance(referencia, str) and "://" not in referencia
+    espera = RECONEXION_INICIAL
+    while continuar():
+        captura = cv2.VideoCapture(referencia)
+        if not captura.isOpened():
+            print(f"⚠️ [fuente {source_id}] No se pudo abrir {referencia}, "
+                  f"reintentando en {espera:.0f}s")
+            time.sleep(espera)
+            espera = min(espera * 2, RECONEXION_MAXIMA)
+            continue
+        espera = RECONEXION_INICIAL
+        try:
+            while continuar() and leer(captura):
+                pass
+        finally:
+            captura.release()
+        if es_archivo:
+            return True
+        if continuar():
+            print(f"⚠️ [fuente {source_id}] Stream cortado, reconectando...")
+    return False
+
+
+class _LectorCamara:
+    """Lee una fuente en un thread y deja solo el último frame (buffer de un lugar)"""
+
+    def __init__(self, referencia: Union[str, int], source_id: int):
+        self.referencia = referencia
+        self.source_id = source_id
+        self._ultimo: Optional[FrameLocal] = None
+        self._lock = threading.Lock()
+        self._activo = False
+        self._thread: Optional[threading.Thread] = None
+        self._frame_id = 0
+        self.terminado = False  # Archivo de video que llegó al final
+        self.descartados = 0
+
+    @property
+    def iniciado(self) -> bool:
+        return self._thread is not None
+
+    def iniciar(self):
+        self._activo = True
+        self._thread = threading.Thread(target=self._bucle, name=f"camara-{self.source_id}", daemon=True)
+        self._thread.start()
+
+    def detener(self):
+        self._activo = False
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def tomar(self) -> Optional[FrameLocal]:
+        """El frame más reciente sin procesar (o None si no llegó uno nuevo)"""
+        with self._lock:
+            frame, self._ultimo = self._ultimo, None
+        return frame
+
+    def liberar(self):
+        pass  # Cada frame es un array propio
+
+    def _leer(self, captura: cv2.VideoCapture) -> bool:
+        ok, imagen = captura.read()
+        if ok:
+            self._frame_id += 1
+            with self._lock:
+                if self._ultimo is not None:
+                    self.descartados += 1
+                self._ultimo = FrameLocal(imagen, self._frame_id, datetime.now(), self.source_id)
+        return ok
+
+    def _bucle(self):
+        self.terminado = leer_fuente(self.referencia, self.source_id, lambda: self._activo, self._leer)
+
+
+def _decodificar_en_anillo(referencia: Union[str, int], source_id: int,
+                           anillo: AnilloFrames, parar) -> None:
+    """Proceso decodificador: escribe cada frame directo en un slot del anillo"""
+    estado = {"frame_id": 0, "forma": None}
+
+    def leer(captura: cv2.VideoCapture) -> bool:
+        if not captura.grab():
+            return False
+        forma = estado["forma"]
+        if forma is None:
+            ok, imagen = captura.retrieve()
+            if not ok:
+                return False
+            forma = estado["forma"] = imagen.shape[:2]
+            if forma[0] > anillo.alto_max or forma[1] > anillo.ancho_max:
+                print(f"⚠️ [fuente {source_id}] {forma[1]}x{forma[0]} supera la resolución máxima "
+                      f"del anillo ({anillo.ancho_max}x{anillo.alto_max}); se reducirá")
+            destino = anillo.reservar(*_forma_en_anillo(forma, anillo))
+            _copiar_ajustado(imagen, destino)
+        else:
+            destino = anillo.reservar(*_forma_en_anillo(forma, anillo))
+            # Sin reducción, OpenCV decodifica dentro del slot (sin copia intermedia)
+            ok, imagen = captura.retrieve(destino)
+            if not ok:
+                return False
+            if imagen.shape[:2] != forma:
+                forma = estado["forma"] = imagen.shape[:2]  # La cámara cambió de resolución
+                destino = anillo.reservar(*_forma_en_anillo(forma, anillo))
+            if not np.shares_memory(imagen, destino):
+                _copiar_ajustado(imagen, destino)
+        estado["frame_id"] += 1
+        anillo.publicar(estado["frame_id"], time.time_ns() // 1000)
+        return True
+
+    try:
+        if leer_fuente(referencia, source_id, lambda: not parar.is_set(), leer):
+            anillo.marcar_terminado()
+    except KeyboardInterrupt:
+        pass  # Ctrl+C llega a todo el grupo: el proceso principal se encarga
+    finally:
+        anillo.cerrar(eliminar=False)
+
+
+def _forma_en_anillo(forma: Tuple[int, int], anillo: AnilloFrames) -> Tuple[int, int]:
+    alto, ancho = forma
+    escala = min(1.0, anillo.alto_max / alto, anillo.ancho_max / ancho)
+    return int(alto * escala), int(ancho * escala)
+
+
+def _copiar_ajustado(imagen: np.ndarray, destino: np.ndarray):
+    if imagen.shape == destino.shape:
+        destino[...] = imagen
+    else:
+        cv2.resize(imagen, (destino.shape[1], destino.shape[0]), dst=destino, interpolation=cv2.INTER_AREA)
+
+
+class _LectorProceso:
+    """
+    Decodifica una fuente en otro proceso (otro núcleo, otro GIL). Los
+    frames llegan por un AnilloFrames y se leen sin copiar: la imagen de
+    cada FrameLocal es válida hasta liberar().
+    """
+
+    def __init__(self, referencia: Union[str, int], source_id: int, contexto,
+                 resolucion_maxima: Tuple[int, int]):
+        self.referencia = referencia
+        self.source_id = source_id
+        self._contexto = contexto
+        self._anillo = AnilloFrames(ancho_max=resolucion_maxima[0], alto_max=resolucion_maxima[1],
+                                    contexto=contexto)
+        self._parar = contexto.Event()
+        self._proceso = None
+        self._vista_hasta = 0
+        self.descartados = 0  # Frames reescritos antes de que la inferencia los tomara
+
+    @property
+    def terminado(self) -> bool:
+        return self._anillo.terminado and self._anillo.ultima_secuencia <= self._vista_hasta
+
+    @property
+    def iniciado(self) -> bool:
+        return self._proceso is not None
+
+    def iniciar(self):
+        if threading.active_count() > 1:
+            print(f"⚠️ [fuente {self.source_id}] Decodificador creado con {threading.active_count()} threads "
+                  f"activos: iniciar los lectores antes que los workers (ver iniciar_lectores)")
+        self._proceso = self._contexto.Process(
+            target=_decodificar_en_anillo, name=f"decodificador-{self.source_id}",
+            args=(self.referencia, self.source_id, self._anillo, self._parar), daemon=True)
+        self._proceso.start()
+
+    def detener(self):
+        self._parar.set()
+        if self._proceso is not None:
+            self._proceso.join(timeout=5)
+            if self._proceso.is_alive():
+                self._proceso.terminate()
+                self._proceso.join()
+        self._anillo.cerrar()
+
+    def tomar(self) -> Optional[FrameLocal]:
+        frame = self._anillo.tomar(self._vista_hasta)
+        if frame is None:
+            return None
+        self.descartados += frame.secuencia - self._vista_hasta - 1
+        self._vista_hasta = frame.secuencia
+        return FrameLocal(frame.imagen, frame.frame_id,
+                          datetime.fromtimestamp(frame.timestamp_us / 1e6), self.source_id)
+
+    def liberar(self):
+        self._anillo.liberar()
+
+
+def crear_lectores(video_reference, procesos: bool = True,
+                   resolucion_maxima: Tuple[int, int] = RESOLUCION_MAXIMA) -> list:
+    """Un lector por fuente: proceso + anillo si hay fork, thread si no"""
+    referencias = video_reference if isinstance(video_reference, list) else [video_reference]
+    if procesos and "fork" in multiprocessing.get_all_start_methods():
+        # fork: el hijo hereda el anillo sin volver a ejecutar main.py
+        contexto = multiprocessing.get_context("fork")
+        return [_LectorProceso(referencia, i, contexto, resolucion_maxima)
+                for i, referencia in enumerate(referencias)]
+    return [_LectorCamara(referencia, i) for i, referencia in enumerate(referencias)]
+
+
+def iniciar_lectores(video_reference, procesos: bool = True,
+                     resolucion_maxima: Tuple[int, int] = RESOLUCION_MAXIMA) -> list:
+    """
+    Crea e inicia los lectores ya (llamar mientras el proceso tiene un solo
+    thread) para pasarlos luego a PipelineLocal(lectores=...)
+    """
+    lectores = crear_lectores(video_reference, procesos, resolucion_maxima)
+    for lector in lectores:
+        lector.iniciar()
+    return lectores
+
+
+class PipelineLocal:
+    """
+    Uso:
+        lectores = iniciar_lectores(referencias)          # antes de crear threads
+        motor = MotorONNX("modelos/epp.onnx")
+        pipeline = PipelineLocal(referencias, motor, on_prediction=supervisor.sink,
+                                 max_fps=5, lectores=lectores)
+        pipeline.start()
+        pipeline.join()
+    """
+
+    def __init__(self, video_reference, motor: MotorONNX,
+                 on_prediction: Callable, max_fps: Optional[float] = None,
+                 procesos: bool = True,
+                 resolucion_maxima: Tuple[int, int] = RESOLUCION_MAXIMA,
+                 lectores: Optional[list] = None):
+        self._una_fuente = not isinstance(video_reference, list)
+        self._lectores = lectores if lectores is not None else \
+            crear_lectores(video_reference, procesos, resolucion_maxima)
+        self._motor = motor
+        self._on_prediction = on_prediction
+        self._periodo = 1.0 / max_fps if max_fps else 0.0
+        self._activo = False
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def frames_descartados(self) -> List[int]:
+        """Por fuente: frames reemplazados por uno más nuevo antes de la inferencia"""
+        return [lector.descartados for lector in self._lectores]
+
+    def start(self):
+        self._activo = True
+        for lector in self._lectores:
+            if not lector.iniciado:
+                lector.iniciar()
+        self._thread = threading.Thread(target=self._bucle, name="inferencia-local", daemon=True)
+        self._thread.start()
+
+    def join(self):
+        # Espera en intervalos cortos para que Ctrl+C llegue al thread principal
+        try:
+            while self._thread is not None and self._thread.is_alive():
+                self._thread.join(timeout=0.5)
+        except KeyboardInterrupt:
+            print("\n🛑 Deteniendo la captura...")
+            self.terminate()
+
+    def terminate(self):
+        self._activo = False
+        for lector in self._lectores:
+            lector.detener()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+
+    def _bucle(self):
+        while self._activo:
+            inicio = time.monotonic()
+            frames: List[Optional[FrameLocal]] = [lector.tomar() for lector in self._lectores]
+            nuevos = [frame for frame in frames if frame is not None]
+
+            if not nuevos:
+                if all(lector.terminado for lector in self._lectores):
+                    break  # Todos los archivos de video terminaron
+                time.sleep(0.005)
+                continue
+
+            # Un solo session.run para los frames nuevos de todas las cámaras
+            detecciones = iter(self._motor.inferir([frame.image for frame in nuevos]))
+            resultados = [
+                None if frame is None else self._resultado(frame.image, next(detecciones))
+                for frame in frames
+            ]
+            try:
+                if self._una_fuente:
+                    self._on_prediction(resultados[0], frames[0])
+                else:
+                    self._on_prediction(resultados, frames)
+            finally:
+                # El sink ya codificó/anotó sus copias: los slots se pueden reescribir
+                for lector in self._lectores:
+                    lector.liberar()
+
+            espera = self._periodo - (time.monotonic() - inicio)
+            if espera > 0:
+                time.sleep(espera)
+        self._activo = False
+
+    @staticmethod
+    def _resultado(imagen: np.ndarray, detecciones: dict) -> dict:
+        return {"model_1": detecciones, "output_image": ImagenSalida(imagen, detecciones)}
@@ -0,0 +1,204 @@
+"""
+Seguimiento de personas entre frames (tracker por IoU)
+Cada frame (no solo los muestreados) asocia las personas detectadas con
+los tracks abiertos de su cámara por IoU de cajas, con el mismo
+emparejamiento en bloque que usa backend/cumplimiento.py. Cada track
+acumula el EPP de la persona mientras está a la vista; cuando deja de
+verse durante `tiempo_perdido` segundos se cierra y se envía al backend
+un único registro con entrada, salida y cumplimiento mínimo / máximo /
+promedio.
+
+El estado de los tracks se guarda en arreglos (uno por campo), así que
+actualizar 100 tracks cuesta unas pocas operaciones de NumPy.
+"""
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from backend.cumplimiento import emparejar
+
+# IoU mínimo entre la caja del track y la detección para seguirla
+UMBRAL_IOU = 0.3
+
+# Segundos sin ver a la persona tras los que su track se cierra
+TIEMPO_PERDIDO = 2.0
+
+# Frames mínimos para reportar un track (menos = detección espuria)
+MIN_FRAMES_TRACK = 3
+
+# Una persona que no se va (ej. un puesto fijo) se reporta por tramos de esta duración
+DURACION_MAXIMA_TRACK = 15 * 60
+
+# Columnas de EPP por persona (mismo orden que epp en actualizar())
+ELEMENTOS_EPP = ("casco", "chaleco", "gafas")
+
+
+def matriz_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU de cada caja de `a` (A, 4) con cada caja de `b` (B, 4), en xyxy"""
+    ancho = np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0])
+    alto = np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1])
+    interseccion = np.clip(ancho, 0, None) * np.clip(alto, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return interseccion / np.maximum(area_a[:, None] + area_b[None, :] - interseccion, 1e-6)
+
+
+class RastreadorPersonas:
+    """
+    Tracks de personas de una cámara.
+
+    Uso:
+        rastreador = RastreadorPersonas("cam1")
+        for track in rastreador.actualizar(personas, epp, fecha_hora):
+            ...enviar el track terminado al backend...
+    """
+
+    def __init__(self, camara_id: str, umbral_iou: float = UMBRAL_IOU,
+                 tiempo_perdido: float = TIEMPO_PERDIDO,
+                 min_frames: int = MIN_FRAMES_TRACK,
+                 duracion_maxima: float = DURACION_MAXIMA_TRACK,
+                 reloj: Callable[[], float] = time.monotonic):
+        self.camara_id = camara_id
+        self.umbral_iou = umbral_iou
+        self.tiempo_perdido = tiempo_perdido
+        self.min_frames = min_frames
+        self.duracion_maxima = duracion_maxima
+        self._reloj = reloj
+        self._siguiente_id = 1
+
+        # Un elemento por track abierto
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._cajas = np.zeros((0, 4), dtype=np.float32)
+        self._inicio = np.zeros(0)                      # Reloj monotónico al entrar
+        self._visto = np.zeros(0)                       # Reloj monotónico de la última detección
+        self._frames = np.zeros(0, dtype=np.int64)
+        self._frames_epp = np.zeros((0, len(ELEMENTOS_EPP)), dtype=np.int64)
+        self._cumplimiento_min = np.zeros(0)
+        self._cumplimiento_max = np.zeros(0)
+        self._cumplimiento_suma = np.zeros(0)
+        self._entrada = np.zeros(0, dtype=object)       # fecha_hora ISO de entrada
+        self._salida = np.zeros(0, dtype=object)        # fecha_hora ISO de la última detección
+
+    @property
+    def abiertos(self) -> int:
+        return len(self._ids)
+
+    def actualizar(self, personas: np.ndarray, epp: np.ndarray, fecha_hora: str) -> List[Dict]:
+        """
+        Procesa las personas de un frame.
+
+        Args:
+            personas: Cajas (P, 4) en xyxy
+            epp: (P, 3) bool, si cada persona tiene casco, chaleco y gafas
+            fecha_hora: Fecha ISO del frame
+
+        Returns:
+            Tracks que terminaron en este frame (ver _a_dict)
+        """
+        ahora = self._reloj()
+        personas = np.asarray(personas, dtype=np.float32).reshape(-1, 4)
+        epp = np.asarray(epp, dtype=bool).reshape(len(personas), len(ELEMENTOS_EPP))
+        cumplimiento = epp.sum(axis=1) * (100 / len(ELEMENTOS_EPP))
+
+        # 1. Asociar tracks abiertos ↔ detecciones
+        if len(self._ids) and len(personas):
+            iou = matriz_iou(self._cajas, personas)
+            asignados = emparejar(np.where(iou >= self.umbral_iou, iou, -np.inf))
+        else:
+            asignados = np.full(len(self._ids), -1, dtype=np.intp)
+        tracks = np.flatnonzero(asignados >= 0)
+        detecciones = asignados[tracks]
+
+        self._cajas[tracks] = personas[detecciones]
+        self._visto[tracks] = ahora
+        self._frames[tracks] += 1
+        self._frames_epp[tracks] += epp[detecciones]
+        self._cumplimiento_min[tracks] = np.minimum(self._cumplimiento_min[tracks], cumplimiento[detecciones])
+        self._cumplimiento_max[tracks] = np.maximum(self._cumplimiento_max[tracks], cumplimiento[detecciones])
+        self._cumplimiento_suma[tracks] += cumplimiento[detecciones]
+        self._salida[tracks] = fecha_hora
+
+        # 2. Cerrar los tracks que se perdieron y cortar los muy largos
+        terminados = []
+        perdidos = ahora - self._visto > self.tiempo_perdido
+        if perdidos.any():
+            terminados += self._a_dict(np.flatnonzero(perdidos & (self._frames >= self.min_frames)))
+            self._conservar(~perdidos)
+        largos = np.flatnonzero(ahora - self._inicio >= self.duracion_maxima)
+        if len(largos):
+            terminados += self._a_dict(largos[self._frames[largos] >= self.min_frames])
+            self._reiniciar(largos, ahora, fecha_hora)
+
+        # 3. Abrir un track por cada detección sin asociar
+        libres = np.ones(len(personas), dtype=bool)
+        libres[detecciones] = False
+        if libres.any():
+            self._abrir(personas[libres], epp[libres], cumplimiento[libres], ahora, fecha_hora)
+        return terminados
+
+    def cerrar(self) -> List[Dict]:
+        """Termina todos los tracks abiertos (al detener la captura)"""
+        terminados = self._a_dict(np.flatnonzero(self._frames >= self.min_frames))
+        self._conservar(np.zeros(len(self._ids), dtype=bool))
+        return terminados
+
+    # ------------------------------------------------------------------------
+
+    def _abrir(self, cajas: np.ndarray, epp: np.ndarray, cumplimiento: np.ndarray,
+               ahora: float, fecha_hora: str):
+        nuevos = len(cajas)
+        fechas = np.full(nuevos, fecha_hora, dtype=object)
+        self._ids = np.concatenate([self._ids, np.arange(self._siguiente_id, self._siguiente_id + nuevos)])
+        self._siguiente_id += nuevos
+        self._cajas = np.concatenate([self._cajas, cajas])
+        self._inicio = np.concatenate([self._inicio, np.full(nuevos, ahora)])
+        self._visto = np.concatenate([self._visto, np.full(nuevos, ahora)])
+        self._frames = np.concatenate([self._frames, np.ones(nuevos, dtype=np.int64)])
+        self._frames_epp = np.concatenate([self._frames_epp, epp.astype(np.int64)])
+        self._cumplimiento_min = np.concatenate([self._cumplimiento_min, cumplimiento])
+        self._cumplimiento_max = np.concatenate([self._cumplimiento_max, cumplimiento])
+        self._cumplimiento_suma = np.concatenate([self._cumplimiento_suma, cumplimiento])
+        self._entrada = np.concatenate([self._entrada, fechas])
+        self._salida = np.concatenate([self._salida, fechas.copy()])
+
+    def _conservar(self, mascara: np.ndarray):
+        for campo in ("_ids", "_cajas", "_inicio", "_visto", "_frames", "_frames_epp",
+                      "_cumplimiento_min", "_cumplimiento_max", "_cumplimiento_suma",
+                      "_entrada", "_salida"):
+            setattr(self, campo, getattr(self, campo)[mascara])
+
+    def _reiniciar(self, indices: np.ndarray, ahora: float, fecha_hora: str):
+        """El track sigue (misma persona, mismo id) pero empieza un tramo nuevo"""
+        self._inicio[indices] = ahora
+        self._frames[indices] = 0
+        self._frames_epp[indices] = 0
+        self._cumplimiento_min[indices] = np.inf
+        self._cumplimiento_max[indices] = -np.inf
+        self._cumplimiento_suma[indices] = 0
+        self._entrada[indices] = fecha_hora
+
+    def _a_dict(self, indices: np.ndarray) -> List[Dict]:
+        """Registro de cada track para el backend (POST /api/tracks)"""
+        frames = self._frames[indices]
+        promedio = self._cumplimiento_suma[indices] / np.maximum(frames, 1)
+        return [
+            {
+                "clave_idempotencia": f"{self.camara_id}:{track_id}:{entrada}",
+                "camera_id": self.camara_id,
+                "track_id": track_id,
+                "entrada": entrada,
+                "salida": salida,
+                "duracion": round(duracion, 2),
+                "frames": cantidad,
+                **{f"frames_{elemento}": con for elemento, con in zip(ELEMENTOS_EPP, con_epp)},
+                "cumplimiento_min": round(minimo, 2),
+                "cumplimiento_max": round(maximo, 2),
+                "cumplimiento_promedio": round(media, 2),
+            }
+            for track_id, entrada, salida, duracion, cantidad, con_epp, minimo, maximo, media in zip(
+                self._ids[indices].tolist(), self._entrada[indices], self._salida[indices],
+                (self._visto[indices] - self._inicio[indices]).tolist(), frames.tolist(),
+                self._frames_epp[indices].tolist(), self._cumplimiento_min[indices].tolist(),
+                self._cumplimiento_max[indices].tolist(), promedio.tolist())
+        ]
@@ -0,0 +1,317 @@
+"""
+Spool en Disco - Cola Persistente hacia el Backend
+===================================================
+
+Reemplaza la cola en memoria entre my_sink() y el worker de backend:
+1. El sink agrega registros al final del segmento activo (append-only, sin fsync)
+2. El worker lee desde el cursor confirmado y solo avanza cuando el backend respondió
+3. Si el proceso muere, al reiniciar se descarta el último registro incompleto
+   y se retoma desde el cursor guardado en el índice
+
+Formato de cada registro dentro de un segmento:
+    [magic 4B][len_metadata 4B][len_imagen 4B][crc32 4B][metadata JSON][imagen JPEG]
+
+El disco usado está acotado: si se supera max_bytes se descartan
+los segmentos más antiguos (como hacía la cola llena, pero horas después).
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from captura.detecciones import codificar_json, decodificar_json
+
+
+MAGIC = b"EPPS"
+CABECERA = struct.Struct("<4sIII")
+NOMBRE_INDICE = "indice.json"
+
+
+class RegistroSpool(NamedTuple):
+    """Registro leído del spool"""
+    posicion: Tuple[int, int]  # (segmento, offset) justo DESPUÉS de este registro
+    metadata_json: bytes       # Tal como se escribió (se puede reenviar sin decodificar)
+    imagen: Optional[bytes]
+
+    @property
+    def metadata(self) -> Dict:
+        return decodificar_json(self.metadata_json)
+
+
+class SpoolDisco:
+    """
+    Cola persistente en segmentos de disco con un índice de lectura.
+
+    Uso:
+        spool = SpoolDisco("spool/")
+        spool.agregar(metadata, imagen_jpg)       # desde el sink
+        lote = spool.leer(20)                     # desde el worker
+        spool.confirmar(lote[-1].posicion)        # tras respuesta OK del backend
+    """
+
+    def __init__(self, directorio: str, segmento_max_bytes: int = 8 * 1024 * 1024,
+                 max_bytes: int = 2 * 1024 * 1024 * 1024):
+        self.directorio = directorio
+        self.segmento_max_bytes = segmento_max_bytes
+        self.max_bytes = max_bytes
+        self.bytes_descartados = 0  # Segmentos borrados por el límite de disco
+
+        os.makedirs(directorio, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._hay_datos = threading.Condition(self._lock)
+
+        # Tamaño de cada segmento existente {numero: bytes}
+        self._tamanos = {
+            numero: os.path.getsize(self._ruta_segmento(numero))
+            for numero in self._listar_segmentos()
+        }
+
+        if self._tamanos:
+            self._activo = max(self._tamanos)
+            self._tamanos[self._activo] = self._reparar_segmento(self._activo)
+        else:
+            self._activo = 1
+            self._tamanos[self._activo] = 0
+
+        self._archivo = open(self._ruta_segmento(self._activo), "ab")
+        self._cursor = self._validar_cursor(self._cargar_indice())
+
+    # ========================================================================
+    # ESCRITURA (sink)
+    # ========================================================================
+
+    def agregar(self, metadata: Dict, imagen: Optional[bytes] = None):
+        """
+        Agrega un registro al final del spool.
+        Solo escribe al page cache (sin fsync), así que no bloquea el sink.
+        """
+        datos_meta = codificar_json(metadata)
+        imagen = imagen or b""
+        crc = zlib.crc32(imagen, zlib.crc32(datos_meta))
+        bloque = CABECERA.pack(MAGIC, len(datos_meta), len(imagen), crc) + datos_meta + imagen
+
+        with self._lock:
+            if self._tamanos[self._activo] > 0 and \
+                    self._tamanos[self._activo] + len(bloque) > self.segmento_max_bytes:
+                self._rotar()
+
+            self._archivo.write(bloque)
+            self._archivo.flush()
+            self._tamanos[self._activo] += len(bloque)
+
+            self._aplicar_limite_disco()
+            self._hay_datos.notify_all()
+
+    def _rotar(self):
+        """Sella el segmento activo (fsync) y abre uno nuevo"""
+        self._archivo.flush()
+        os.fsync(self._archivo.fileno())
+        self._archivo.close()
+
+        self._activo += 1
+        self._tamanos[self._activo] = 0
+        self._archivo = open(self._ruta_segmento(self._activo), "ab")
+
+    def _aplicar_limite_disco(self):
+        """Descarta los segmentos sellados más antiguos si se supera max_bytes"""
+        while sum(self._tamanos.values()) > self.max_bytes:
+            mas_antiguo = min(self._tamanos)
+            if mas_antiguo == self._activo:
+                break
+
+            tamano = self._tamanos.pop(mas_antiguo)
+            self.bytes_descartados += tamano
+            try:
+                os.remove(self._ruta_segmento(mas_antiguo))
+            except OSError:
+                pass
+            print(f"⚠️ [SPOOL] Límite de {self.max_bytes // (1024 * 1024)} MB alcanzado: "
+                  f"descartado segmento {mas_antiguo} ({tamano // 1024} KB)")
+
+            if self._cursor[0] <= mas_antiguo:
+                self._cursor = (mas_antiguo + 1, 0)
+                self._guardar_indice()
+
+    # ========================================================================
+    # LECTURA (worker de backend)
+    # ========================================================================
+
+    def leer(self, max_registros: int) -> List[RegistroSpool]:
+        """
+        Lee hasta max_registros desde el cursor confirmado, SIN avanzarlo.
+        Los mismos registros se vuelven a entregar hasta llamar a confirmar().
+        """
+        with self._lock:
+            segmento, offset = self._cursor
+            tamanos = dict(self._tamanos)
+            activo = self._activo
+
+        registros = []
+        while len(registros) < max_registros and segmento <= activo:
+            fin = tamanos.get(segmento)
+            if fin is None or offset >= fin:
+                if segmento == activo:
+                    break
+                segmento, offset = segmento + 1, 0
+                continue
+
+            nuevos, offset = self._leer_segmento(segmento, offset, fin, max_registros - len(registros))
+            registros.extend(nuevos)
+
+        # Si solo había basura (registros corruptos), avanzar el cursor igualmente
+        if not registros and (segmento, offset) != self._cursor:
+            self.confirmar((segmento, offset))
+
+        return registros
+
+    def _leer_segmento(self, segmento: int, offset: int, fin: int,
+                       max_registros: int) -> Tuple[List[RegistroSpool], int]:
+        """Lee registros de un segmento vía mmap entre offset y fin"""
+        registros = []
+        try:
+            archivo = open(self._ruta_segmento(segmento), "rb")
+        except FileNotFoundError:
+            # El límite de disco lo borró después de que leer() tomó la foto
+            # (ya corrigió el cursor bajo el lock): seguir con el siguiente
+            return registros, fin
+        with archivo as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                while len(registros) < max_registros and offset + CABECERA.size <= fin:
+                    magic, len_meta, len_imagen, crc = CABECERA.unpack_from(mm, offset)
+                    inicio = offset + CABECERA.size
+                    final = inicio + len_meta + len_imagen
+
+                    if magic != MAGIC or final > fin:
+                        print(f"⚠️ [SPOOL] Segmento {segmento} corrupto desde offset {offset}, se omite el resto")
+                        return registros, fin
+
+                    datos_meta = mm[inicio:inicio + len_meta]
+                    imagen = mm[inicio + len_meta:final]
+                    offset = final
+
+                    if zlib.crc32(imagen, zlib.crc32(datos_meta)) != crc:
+                        print(f"⚠️ [SPOOL] CRC inválido en segmento {segmento}, registro omitido")
+                        continue
+
+                    registros.append(RegistroSpool(
+                        posicion=(segmento, offset),
+                        metadata_json=datos_meta,
+                        imagen=imagen or None
+                    ))
+        return registros, offset
+
+    def confirmar(self, posicion: Tuple[int, int]):
+        """
+        Marca como enviado todo lo anterior a `posicion`.
+        Borra los segmentos sellados que ya se consumieron por completo.
+        """
+        with self._lock:
+            segmento, offset = posicion
+            if (segmento, offset) < self._cursor:
+                return  # El límite de disco ya movió el cursor más adelante
+            if segmento < self._activo and offset >= self._tamanos.get(segmento, 0):
+                segmento, offset = segmento + 1, 0
+
+            for numero in [n for n in self._tamanos if n < segmento]:
+                self._tamanos.pop(numero)
+                try:
+                    os.remove(self._ruta_segmento(numero))
+                except OSError:
+                    pass
+
+            self._cursor = (segmento, offset)
+            self._guardar_indice()
+
+    def esperar(self, timeout: float) -> bool:
+        """Bloquea hasta que haya registros pendientes o pase el timeout"""
+        with self._hay_datos:
+            if not self._hay_pendientes():
+                self._hay_datos.wait(timeout)
+            return self._hay_pendientes()
+
+    def pendientes_bytes(self) -> int:
+        """Bytes que faltan por enviar (aproximado, incluye cabeceras)"""
+        with self._lock:
+            segmento, offset = self._cursor
+            return sum(t for n, t in self._tamanos.items() if n >= segmento) - offset
+
+    def cerrar(self):
+        """Sincroniza el segmento activo a disco y lo cierra"""
+        with self._lock:
+            self._archivo.flush()
+            os.fsync(self._archivo.fileno())
+            self._archivo.close()
+
+    # ========================================================================
+    # INTERNOS
+    # ========================================================================
+
+    def _hay_pendientes(self) -> bool:
+        return self._cursor != (self._activo, self._tamanos[self._activo])
+
+    def _ruta_segmento(self, numero: int) -> str:
+        return os.path.join(self.directorio, f"segmento_{numero:08d}.spool")
+
+    def _listar_segmentos(self) -> List[int]:
+        numeros = []
+        for nombre in os.listdir(self.directorio):
+            if nombre.startswith("segmento_") and nombre.endswith(".spool"):
+                try:
+                    numeros.append(int(nombre[len("segmento_"):-len(".spool")]))
+                except ValueError:
+                    pass
+        return sorted(numeros)
+
+    def _reparar_segmento(self, numero: int) -> int:
+        """
+        Recorre el segmento activo y trunca un registro final incompleto
+        (el proceso murió a mitad de una escritura). Retorna el tamaño válido.
+        """
+        ruta = self._ruta_segmento(numero)
+        tamano = os.path.getsize(ruta)
+        offset = 0
+        with open(ruta, "rb") as f:
+            while offset + CABECERA.size <= tamano:
+                f.seek(offset)
+                magic, len_meta, len_imagen, _ = CABECERA.unpack(f.read(CABECERA.size))
+                final = offset + CABECERA.size + len_meta + len_imagen
+                if magic != MAGIC or final > tamano:
+                    break
+                offset = final
+
+        if offset != tamano:
+            print(f"🔧 [SPOOL] Segmento {numero}: truncando {tamano - offset} bytes incompletos")
+            with open(ruta, "r+b") as f:
+                f.truncate(offset)
+        return offset
+
+    def _cargar_indice(self) -> Tuple[int, int]:
+        try:
+            with open(os.path.join(self.directorio, NOMBRE_INDICE), "r", encoding="utf-8") as f:
+                indice = json.load(f)
+            return int(indice["segmento"]), int(indice["offset"])
+        except (OSError, ValueError, KeyError):
+            return min(self._tamanos), 0
+
+    def _validar_cursor(self, cursor: Tuple[int, int]) -> Tuple[int, int]:
+        """Ajusta un cursor que apunta a segmentos ya borrados o fuera de rango"""
+        segmento, offset = cursor
+        existentes = sorted(n for n in self._tamanos if n >= segmento)
+        if not existentes:
+            return self._activo, self._tamanos[self._activo]
+        if existentes[0] != segmento:
+            return existentes[0], 0
+        return segmento, min(offset, self._tamanos[segmento])
+
+    def _guardar_indice(self):
+        """Escribe el cursor de forma atómica (archivo temporal + rename)"""
+        ruta = os.path.join(self.directorio, NOMBRE_INDICE)
+        temporal = ruta + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump({"segmento": self._cursor[0], "offset": self._cursor[1]}, f)
+        os.replace(temporal, ruta)
@@ -0,0 +1,168 @@
+"""
+Supervisor de varias cámaras
+Lee la lista de cámaras (camaras.json) y reparte los resultados de un
+único InferencePipeline multi-fuente entre ellas. Cada cámara tiene su
+propio estado (contadores, muestreo, deduplicación) pero todas comparten
+el spool/worker de backend y el despachador del ESP32.
+
+Formato de camaras.json:
+
+    {
+      "camaras": [
+        {"id": "cam1", "video_reference": "rtsp://...", "intervalo": 5.0},
+        {"id": "patio", "video_reference": "rtsp://...", "intervalo": 10.0, "esp32": false}
+      ]
+    }
+"""
+import json
+import os
+import threading
+import time
+import traceback
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+# Con muchas cámaras el CPU no alcanza para 30 FPS por stream: el muestreo
+# solo necesita unos pocos frames por segundo
+MAX_FPS_UNA_CAMARA = 30
+MAX_FPS_MULTICAMARA = 5
+
+# Segundos sin noticias de una cámara tras los que el ESP32 deja de considerarla
+CADUCIDAD_ESP32 = 30
+
+
+class ConfigCamara(NamedTuple):
+    id: str
+    video_reference: str
+    intervalo: Optional[float] = None   # None = intervalo de muestreo por defecto
+    esp32: bool = True                  # Sus detecciones cuentan para el LED
+
+
+class EstadoCamara:
+    """Contadores del sink de una cámara"""
+
+    def __init__(self, config: ConfigCamara):
+        self.config = config
+        self.frame_counter = 0
+        self.frames_desde_captura = 0
+        self.ultimo_timestamp: Optional[float] = None
+
+
+def cargar_camaras(ruta: str, por_defecto: List[ConfigCamara]) -> List[ConfigCamara]:
+    """
+    Lee la lista de cámaras de `ruta`. Si el archivo no existe se usa
+    `por_defecto` (instalaciones de una sola cámara).
+
+    Raises:
+        ValueError: Si el archivo es inválido o repite IDs
+    """
+    if not os.path.exists(ruta):
+        return list(por_defecto)
+
+    with open(ruta, "r", encoding="utf-8") as f:
+        contenido = json.load(f)
+    entradas = contenido.get("camaras", []) if isinstance(contenido, dict) else contenido
+
+    camaras = []
+    for entrada in entradas:
+        if not entrada.get("id") or not entrada.get("video_reference"):
+            raise ValueError(f"Cámara sin 'id' o 'video_reference' en {ruta}: {entrada}")
+        camaras.append(ConfigCamara(
+            id=str(entrada["id"]),
+            video_reference=entrada["video_reference"],
+            intervalo=entrada.get("intervalo"),
+            esp32=bool(entrada.get("esp32", True)),
+        ))
+
+    ids = [camara.id for camara in camaras]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"IDs de cámara repetidos en {ruta}: {ids}")
+    if not camaras:
+        raise ValueError(f"{ruta} no tiene cámaras")
+    return camaras
+
+
+class DespachadorESP32:
+    """
+    Combina las últimas detecciones de cada cámara en una sola lista para
+    el LED (un único ESP32 por sitio). Las cámaras que dejan de informar
+    durante `caducidad` segundos dejan de contar.
+    """
+
+    def __init__(self, enviar: Callable[[List[str]], bool], caducidad: float = CADUCIDAD_ESP32):
+        self._enviar = enviar
+        self._caducidad = caducidad
+        self._ultimas: Dict[str, tuple] = {}  # cámara → (momento, clases)
+        self._lock = threading.Lock()
+
+    def actualizar(self, camara_id: str, clases: List[str]) -> bool:
+        ahora = time.monotonic()
+        with self._lock:
+            self._ultimas[camara_id] = (ahora, list(clases))
+            combinadas = [
+                clase
+                for momento, clases_camara in self._ultimas.values()
+                if ahora - momento <= self._caducidad
+                for clase in clases_camara
+            ]
+        return self._enviar(combinadas)
+
+
+class SupervisorCamaras:
+    """
+    Uso:
+        supervisor = SupervisorCamaras(camaras, procesar=procesar_frame)
+        pipeline = InferencePipeline.init_with_workflow(
+            video_reference=supervisor.referencias(), on_prediction=supervisor.sink, ...)
+    """
+
+    def __init__(self, camaras: List[ConfigCamara],
+                 procesar: Callable[[EstadoCamara, Dict, object], None]):
+        self.camaras = camaras
+        self.estados = [EstadoCamara(camara) for camara in camaras]
+        self._procesar = procesar
+        self._fuentes_desconocidas = set()  # source_id ya avisados (un aviso por fuente)
+
+    def referencias(self):
+        """video_reference para el pipeline (un valor con una cámara, lista con varias)"""
+        referencias = [camara.video_reference for camara in self.camaras]
+        return referencias[0] if len(referencias) == 1 else referencias
+
+    def max_fps(self) -> int:
+        return MAX_FPS_UNA_CAMARA if len(self.camaras) == 1 else MAX_FPS_MULTICAMARA
+
+    def sink(self, predicciones, frames):
+        """
+        on_prediction del pipeline. Con una fuente recibe (resultado, frame);
+        con varias, listas alineadas donde las fuentes sin frame nuevo son None.
+        """
+        if not isinstance(predicciones, list):
+            predicciones, frames = [predicciones], [frames]
+        for resultado, frame in zip(predicciones, frames):
+            if resultado is None or frame is None:
+                continue
+            estado = self._estado_de(frame)
+            if estado is None:
+                continue
+            try:
+                self._procesar(estado, resultado, frame)
+            except Exception as e:
+                # Un error en una cámara no debe frenar a las demás
+                print(f"⚠️ [{estado.config.id}] Error procesando frame: {e}")
+                traceback.print_exc()
+
+    def _estado_de(self, frame) -> Optional[EstadoCamara]:
+        """
+        Estado de la cámara que produjo el frame, o None si su source_id no
+        corresponde a ninguna (el frame se descarta: atribuirlo a otra cámara
+        enviaría sus registros con un camera_id equivocado)
+        """
+        source_id = getattr(frame, "source_id", None)
+        if source_id is None and len(self.estados) == 1:
+            return self.estados[0]  # Una sola fuente: el pipeline puede no numerarla
+        if isinstance(source_id, int) and 0 <= source_id < len(self.estados):
+            return self.estados[source_id]
+        if source_id not in self._fuentes_desconocidas:
+            self._fuentes_desconocidas.add(source_id)
+            print(f"⚠️ Frame con source_id {source_id!r} fuera de las {len(self.estados)} cámaras: "
+                  f"se descartan sus frames")
+        return None
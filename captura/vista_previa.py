@@ -0,0 +1,89 @@
+"""
+Vista previa del video fuera del sink
+cv2.imshow / cv2.waitKey dentro del callback de inferencia frenan el
+pipeline (la ventana se dibuja a la velocidad de la pantalla) y fallan en
+servidores sin pantalla. Aquí el sink solo deja el último frame de cada
+cámara en un buffer de un lugar; un thread aparte lo muestra a su ritmo.
+Si la ventana va más lenta que la inferencia, los frames intermedios se
+reemplazan (se descartan) sin esperar a nadie.
+
+Con --headless (main.py) no se crea ninguna ventana.
+"""
+import threading
+import time
+from typing import Dict, Optional
+
+import cv2
+
+# Tope de refresco de las ventanas (la inferencia puede ir más rápido)
+MAX_FPS_VISTA_PREVIA = 15
+
+
+class VistaPrevia:
+    """
+    Uso:
+        vista_previa = VistaPrevia()
+        vista_previa.iniciar()
+        vista_previa.publicar("cam1", imagen)   # desde el sink, no bloquea
+    """
+
+    def __init__(self, max_fps: float = MAX_FPS_VISTA_PREVIA):
+        self._periodo = 1.0 / max_fps
+        self._ultimos: Dict[str, object] = {}  # ventana → último frame sin mostrar
+        self._lock = threading.Lock()
+        self._hay_frame = threading.Event()
+        self._activa = False
+        self._thread: Optional[threading.Thread] = None
+        self.mostrados = 0
+        self.descartados = 0
+
+    def iniciar(self):
+        self._activa = True
+        self._thread = threading.Thread(target=self._bucle, name="vista-previa", daemon=True)
+        self._thread.start()
+
+    def detener(self):
+        self._activa = False
+        self._hay_frame.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def publicar(self, ventana: str, imagen):
+        """Deja `imagen` como el frame a mostrar en `ventana` (reemplaza al anterior)"""
+        if not self._activa:
+            return
+        with self._lock:
+            if ventana in self._ultimos:
+                self.descartados += 1
+            self._ultimos[ventana] = imagen
+        self._hay_frame.set()
+
+    def _bucle(self):
+        ventanas = set()
+        try:
+            while self._activa:
+                self._hay_frame.wait()
+                self._hay_frame.clear()
+                with self._lock:
+                    pendientes, self._ultimos = self._ultimos, {}
+
+                inicio = time.monotonic()
+                for ventana, imagen in pendientes.items():
+                    if ventana not in ventanas:
+                        # Redimensionable; la imagen se muestra sin escalar para mantener la calidad
+                        cv2.namedWindow(ventana, cv2.WINDOW_NORMAL)
+                        ventanas.add(ventana)
+                    cv2.imshow(ventana, imagen)
+                    self.mostrados += 1
+                cv2.waitKey(1)
+
+                espera = self._periodo - (time.monotonic() - inicio)
+                if espera > 0:
+                    time.sleep(espera)
+        except cv2.error as e:
+            # Sin pantalla (ej. servidor): seguir sin vista previa, la captura no se detiene
+            print(f"⚠️ Vista previa desactivada ({e}). Usa --headless en equipos sin pantalla")
+            self._activa = False
+        finally:
+            if ventanas:
+                cv2.destroyAllWindows()
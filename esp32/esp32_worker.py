@@ -45,6 +45,9 @@ thread_esp32 = None
 # Flag para detener el worker
 _detener_worker = False
 
+# Callback opcional al terminar cada envío: al_enviar(segundos, ok)
+_al_enviar = None
+
 
 # ============================================================================
 # WORKER (corre en segundo plano)
@@ -81,8 +84,11 @@ def _worker_esp32():
                 tamano_cola = cola_esp32.qsize()
                 print(f"\n🚦 [ESP32] Personas: {num_personas} → Color: {color.upper()} [Cola: {tamano_cola}]")
             
-            # Enviar al ESP32
-            enviar_color_a_esp32(color)
+            # Enviar al ESP32 (midiendo el tiempo de ida y vuelta)
+            inicio = time.perf_counter()
+            ok = enviar_color_a_esp32(color)
+            if _al_enviar is not None:
+                _al_enviar(time.perf_counter() - inicio, ok)
             ultimo_color = color
             
             # Marcar tarea completada
@@ -104,16 +110,22 @@ def _worker_esp32():
 # FUNCIONES PÚBLICAS
 # ============================================================================
 
-def iniciar_worker_esp32():
+def iniciar_worker_esp32(al_enviar=None):
     """
     Inicia el worker ESP32 en un thread separado.
     Llamar UNA SOLA VEZ al inicio del programa.
     
+    Parámetros:
+        al_enviar (callable): Opcional, se llama con (segundos, ok) tras
+                              cada envío al ESP32 (métricas)
+    
     Retorna:
         bool: True si se inició correctamente, False si está desactivado
     """
     
-    global thread_esp32, _detener_worker
+    global thread_esp32, _detener_worker, _al_enviar
+    
+    _al_enviar = al_enviar
     
     # Verificar si el módulo está activado
     if not USAR_ESP32:
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react'
+import { useState, useEffect, useRef } from 'react'
 import { motion, AnimatePresence } from 'framer-motion'
 import axios from 'axios'
 import { useNavigate } from 'react-router-dom'
@@ -9,6 +9,27 @@ import {
 } from 'lucide-react'
 import './Dashboard.css'
 
+// Cantidad de registros que se mantienen en pantalla
+const LIMITE_REGISTROS = 100
+
+// URL de una imagen de registro; tamano "mini" / "media" pide un derivado liviano
+const urlImagen = (rutaImagen, tamano) => {
+  const url = `http://localhost:8000/${rutaImagen.replace(/\\/g, '/')}`
+  return tamano ? `${url}?tamano=${tamano}&formato=webp` : url
+}
+
+// Aplica una respuesta delta (since_id) sobre la lista actual (más nuevo primero)
+const fusionarCambios = (actuales, cambios) => {
+  const eliminados = new Set(cambios.eliminados)
+  const modificados = new Map(cambios.modificados.map(r => [r.id, r]))
+  const fusion = actuales
+    .filter(r => !eliminados.has(r.id))
+    .map(r => modificados.get(r.id) || r)
+  return [...cambios.nuevos, ...fusion]
+    .sort((a, b) => b.id - a.id)
+    .slice(0, LIMITE_REGISTROS)
+}
+
 const Dashboard = ({ isSystemActive, setIsSystemActive, onLogout }) => {
   const navigate = useNavigate()
   const [stats, setStats] = useState(null)
@@ -20,12 +41,34 @@ const Dashboard = ({ isSystemActive, setIsSystemActive, onLogout }) => {
   const [cameraStatus, setCameraStatus] = useState('stopped') // stopped, starting, running
   const [showCameraPopup, setShowCameraPopup] = useState(false)
 
+  // Versión de la tabla que ya tenemos (null = pedir la lista completa)
+  const ultimoCambio = useRef(null)
+  const registrosActuales = useRef([])
+
   // Cargar datos del backend
   const fetchData = async (showMessage = false) => {
     try {
-      // Agregar timestamp para evitar caché del navegador
-      const response = await axios.get(`/api/registros?_t=${Date.now()}`)
-      const data = response.data.registros
+      // La primera vez se pide la lista completa; después solo lo que cambió.
+      // Sin cambios el backend responde 304 (ETag) y el navegador reusa su caché.
+      let data
+      if (ultimoCambio.current === null) {
+        const response = await axios.get(`/api/registros?limite=${LIMITE_REGISTROS}`)
+        data = response.data.registros
+        ultimoCambio.current = response.data.ultimo_cambio
+      } else {
+        const response = await axios.get(`/api/registros?since_id=${ultimoCambio.current}`)
+        const cambios = response.data
+        if (cambios.reinicio) {
+          // Se borró todo o quedamos muy atrás: recargar la lista completa
+          ultimoCambio.current = null
+          return fetchData(showMessage)
+        }
+        data = cambios.ultimo_cambio === ultimoCambio.current
+          ? registrosActuales.current
+          : fusionarCambios(registrosActuales.current, cambios)
+        ultimoCambio.current = cambios.ultimo_cambio
+      }
+      registrosActuales.current = data
 
       // Guardar registros SIN invertir (más nuevo primero para la tabla)
       setRegistros(data)
@@ -125,11 +168,45 @@ const Dashboard = ({ isSystemActive, setIsSystemActive, onLogout }) => {
   useEffect(() => {
     fetchData()
     checkCameraStatus()
+
+    // Eventos en tiempo real: cada aviso dispara un delta (since_id), agrupando ráfagas
+    let sseConectado = false
+    let actualizacionPendiente = null
+    const programarActualizacion = () => {
+      if (actualizacionPendiente) return
+      actualizacionPendiente = setTimeout(() => {
+        actualizacionPendiente = null
+        fetchData()
+      }, 300)
+    }
+
+    const eventos = new EventSource('/api/eventos')
+    eventos.onopen = () => {
+      sseConectado = true
+      programarActualizacion() // Recuperar lo que llegó mientras estaba desconectado
+    }
+    eventos.onerror = () => {
+      sseConectado = false // EventSource reintenta solo; mientras tanto se sondea
+    }
+    ;['registro_nuevo', 'registro_actualizado', 'registro_eliminado', 'registros_eliminados', 'resync']
+      .forEach(tipo => eventos.addEventListener(tipo, programarActualizacion))
+    eventos.addEventListener('camara', (e) => {
+      const { status } = JSON.parse(e.data)
+      setCameraStatus(status)
+      setIsSystemActive(status === 'running')
+    })
+
+    // Sondeo de respaldo solo si el canal de eventos no está conectado
     const interval = setInterval(() => {
+      if (sseConectado) return
       fetchData()
       checkCameraStatus()
     }, 5000) // Actualizar cada 5 segundos
-    return () => clearInterval(interval)
+    return () => {
+      clearInterval(interval)
+      clearTimeout(actualizacionPendiente)
+      eventos.close()
+    }
   }, [])
 
   // Verificar estado de la cámara
@@ -282,8 +359,17 @@ const Dashboard = ({ isSystemActive, setIsSystemActive, onLogout }) => {
     if (!confirm('¿Estás seguro de eliminar TODOS los registros? Esta acción no se puede deshacer.')) return
     
     try {
-      await axios.delete('/api/registros')
+      // El backend borra en segundo plano: esperar a que termine el trabajo
+      const response = await axios.delete('/api/registros')
       setLoading(true)
+      let trabajo = response.data.trabajo
+      while (trabajo && trabajo.estado !== 'completado' && trabajo.estado !== 'error') {
+        await new Promise(resolve => setTimeout(resolve, 1000))
+        trabajo = (await axios.get(`/api/trabajos/${trabajo.id}`)).data.trabajo
+      }
+      if (trabajo && trabajo.estado === 'error') {
+        alert(`Error al eliminar registros: ${trabajo.mensaje}`)
+      }
       await fetchData(true)
     } catch (error) {
       console.error('Error eliminando registros:', error)
@@ -757,6 +843,7 @@ const Dashboard = ({ isSystemActive, setIsSystemActive, onLogout }) => {
                     <thead>
                       <tr>
                         <th>ID</th>
+                        <th>Imagen</th>
                         <th>Fecha y Hora</th>
                         <th>Personas</th>
                         <th>Cascos</th>
@@ -776,10 +863,32 @@ const Dashboard = ({ isSystemActive, setIsSystemActive, onLogout }) => {
                           whileHover={{ backgroundColor: 'rgba(255, 255, 255, 0.05)' }}
                         >
                           <td>#{registro.id}</td>
+                          <td>
+                            {registro.ruta_imagen ? (
+                              <img
+                                src={urlImagen(registro.ruta_imagen, 'mini')}
+                                alt={`Registro ${registro.id}`}
+                                className="registro-thumb"
+                                loading="lazy"
+                                width={80}
+                                height={45}
+                              />
+                            ) : (
+                              <ImageIcon size={20} opacity={0.3} />
+                            )}
+                          </td>
                           <td>
                             <div className="datetime-cell">
                               <Calendar size={14} />
                               <span>{formatearFecha(registro.timestamp)}</span>
+                              {registro.repeticiones > 0 && (
+                                <span
+                                  className="repeticiones-badge"
+                                  title={`Sin cambios en ${registro.repeticiones} muestra(s) posteriores`}
+                                >
+                                  ×{registro.repeticiones + 1}
+                                </span>
+                              )}
                             </div>
                           </td>
                           <td>
@@ -889,7 +998,7 @@ const Dashboard = ({ isSystemActive, setIsSystemActive, onLogout }) => {
                 <div className="registro-image-container">
                   {selectedRegistro.registro.ruta_imagen ? (
                     <img
-                      src={`http://localhost:8000/${selectedRegistro.registro.ruta_imagen.replace(/\\/g, '/')}`}
+                      src={urlImagen(selectedRegistro.registro.ruta_imagen, 'media')}
                       alt={`Registro ${selectedRegistro.registro.id}`}
                       className="registro-image"
                       onError={(e) => {
@@ -0,0 +1,52 @@
+"""
+Estadísticas con ventanas abiertas por un lado y filtros de fecha inválidos
+Cada prueba usa una BD temporal (python -m pytest -q desde la raíz)
+"""
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.BD import conexion_bd, crear_bd
+from backend.BD import operaciones_bd as bd
+from backend.BD.tiempo import fecha_a_epoch
+from backend.cumplimiento import calcular_cumplimiento
+
+FECHAS = ["2024-01-01T10:00:00", "2025-06-01T10:00:00", "2025-06-02T10:00:00"]
+
+
+@pytest.fixture
+def bd_temporal(tmp_path, monkeypatch):
+    ruta = str(tmp_path / "epp_registros.db")
+    monkeypatch.setattr(conexion_bd, "DB_PATH", ruta)
+    monkeypatch.setattr(crear_bd, "DB_PATH", ruta)
+    crear_bd.asegurar_esquema()
+    for fecha_hora in FECHAS:
+        datos = calcular_cumplimiento({"model_1": {"data": {"class_name": ["person", "safety helmet"]}}})
+        datos.update(fecha_hora=fecha_hora, frame_number=0, ruta_imagen="", estado_imagen="ok")
+        bd.insertar_registro_completo(datos)
+    yield
+    conexion_bd.cerrar_conexiones()
+
+
+def test_ventana_abierta_por_cada_lado(bd_temporal):
+    assert bd.obtener_estadisticas_generales(desde="2025-01-01")["total_registros"] == 2
+    assert bd.obtener_estadisticas_generales(hasta="2025-01-01")["total_registros"] == 1
+    assert bd.obtener_estadisticas_generales(desde="2026-01-01")["total_registros"] == 0
+    assert bd.obtener_estadisticas_generales()["total_registros"] == 3
+
+
+def test_ventana_con_epoch(bd_temporal):
+    desde = str(int(datetime(2025, 1, 1).timestamp()))
+    assert bd.obtener_estadisticas_generales(desde=desde)["total_registros"] == 2
+
+
+def test_fechas_invalidas():
+    assert fecha_a_epoch("1700000000") == 1700000000
+    assert fecha_a_epoch(1700000000.5) == 1700000000
+    for invalida in ("basura", "", "2025-13-01", str(2 ** 40), None):
+        with pytest.raises(ValueError):
+            fecha_a_epoch(invalida)